@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+"""Micro-benchmark of the --window aggregation of per-second samples.
+
+Usage: python benchmarks/bench_aggregate.py [-n REPEAT] [-r ROWS]
+"""
+
+
+import optparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from logtogss import aggregate
+
+
+COLUMNS = ['time', 'host', 'cpu', 'mem']
+
+
+def iso_samples(num_rows, hosts=10):
+  """A sample a second from each host, with ISO 8601 times."""
+  return [('2011-01-01T%02d:%02d:%02d' % (i / hosts / 3600 % 24, i / hosts / 60 % 60, i / hosts % 60),
+           'host%d' % (i % hosts), str(i % 97), '%.1f' % (i % 13 * 1.5))
+          for i in xrange(num_rows)]
+
+def epoch_samples(num_rows, hosts=10):
+  """The same, with the times in seconds since the epoch."""
+  return [(str(1300000000 + i / hosts), 'host%d' % (i % hosts), str(i % 97), '%.1f' % (i % 13 * 1.5))
+          for i in xrange(num_rows)]
+
+
+CASES = [
+  ('iso, avg', iso_samples, ['cpu=avg(cpu)'], ()),
+  ('iso, by host, 4 aggregates', iso_samples,
+   ['n=count()', 'cpu=avg(cpu)', 'mem=max(mem)', 'memsum=sum(mem)'], ['host']),
+  ('iso, by host, percentiles', iso_samples, ['cpu50=p50(cpu)', 'cpu99=p99(cpu)'], ['host']),
+  ('epoch, by host, 4 aggregates', epoch_samples,
+   ['n=count()', 'cpu=avg(cpu)', 'mem=max(mem)', 'memsum=sum(mem)'], ['host']),
+]
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [-n REPEAT] [-r ROWS]')
+  parser.add_option('-n', dest='repeat', type='int', default=3,
+                    help='Number of timed runs of each case, best one reported (default: 3)')
+  parser.add_option('-r', dest='rows', type='int', default=200000,
+                    help='Number of rows to aggregate (default: 200000)')
+  (opts, args) = parser.parse_args()
+  print '%-32s %10s %12s' % ('case', 'best (ms)', 'rows/sec')
+  for (label, generate, aggregates, group_by) in CASES:
+    rows = generate(opts.rows)
+    def run():
+      aggregator = aggregate.WindowAggregator(COLUMNS, 60, aggregates, group_by=group_by)
+      for row in aggregator.Aggregate(rows):
+        pass
+    best = min(timeit.repeat(run, number=1, repeat=opts.repeat))
+    print '%-32s %10.2f %12.0f' % (label, best * 1000, len(rows) / best)
+
+
+if __name__ == '__main__':
+  main()
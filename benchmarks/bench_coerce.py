@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+"""Micro-benchmark of the --column-type conversion of rows, a row and a batch
+at a time.
+
+Usage: python benchmarks/bench_coerce.py [-n REPEAT] [-r ROWS] [-b BATCH]
+"""
+
+
+import optparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from logtogss import coerce
+
+
+COLUMNS = ['day', 'time', 'host', 'count', 'ratio', 'ok']
+
+
+def samples(num_rows, hosts=10):
+  """A row a second from each host, with a value of every type."""
+  return [('2011-01-%02d' % (i / hosts / 86400 % 28 + 1),
+           '2011-01-01T%02d:%02d:%02d' % (i / hosts / 3600 % 24, i / hosts / 60 % 60, i / hosts % 60),
+           'host%d' % (i % hosts), str(i % 997), '%.3f' % (i % 13 / 7.0), i % 3 and 'yes' or 'no')
+          for i in xrange(num_rows)]
+
+
+CASES = [
+  ('int, float', ['count=int', 'ratio=float:%.2f']),
+  ('bool', ['ok=bool']),
+  ('date, datetime', ['day=date', 'time=datetime']),
+  ('all', ['day=date', 'time=datetime', 'count=int', 'ratio=float:%.2f', 'ok=bool']),
+]
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [-n REPEAT] [-r ROWS] [-b BATCH]')
+  parser.add_option('-n', dest='repeat', type='int', default=3,
+                    help='Number of timed runs of each case, best one reported (default: 3)')
+  parser.add_option('-r', dest='rows', type='int', default=200000,
+                    help='Number of rows to convert (default: 200000)')
+  parser.add_option('-b', dest='batch', type='int', default=1000,
+                    help='Number of rows converted at a time, in the batch runs (default: 1000)')
+  (opts, args) = parser.parse_args()
+  rows = samples(opts.rows)
+  print '%-24s %6s %10s %12s' % ('case', 'batch', 'best (ms)', 'rows/sec')
+  for (label, specs) in CASES:
+    types = [coerce.parse_column_type(spec) for spec in specs]
+    for batch_size in (1, opts.batch):
+      def run():
+        for row in coerce.RowCoercer(COLUMNS, types, batch_size).Coerce(rows):
+          pass
+      best = min(timeit.repeat(run, number=1, repeat=opts.repeat))
+      print '%-24s %6d %10.2f %12.0f' % (label, batch_size, best * 1000, len(rows) / best)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,308 @@
+#!/usr/bin/python
+
+"""Benchmark logtogss end to end, against a local fake of the feeds.
+
+Each scenario runs in a child process of its own, with the fake feeds server
+(see fakefeeds.py) in another, so that the peak RSS reported is that of the
+client alone. The scenarios are:
+
+  list     Listing of all the spreadsheets and their worksheets (--list).
+  headers  Mapping of the column names from a wide, two row header.
+  pipe     Rows piped through stdin, one request per row.
+  batch    Rows piped through stdin, in batches (--batch-size).
+  workers  Rows piped through stdin, in batches over workers (--workers).
+  sharded  Rows of a file, parsed and serialized by --processes processes,
+           in batches over workers (--input and --processes). The RSS is
+           that of the main process only.
+  block    Rows of --block-width values piped through stdin, written as a
+           block of cells (--block), with the items being the cells.
+  upsert   Rows piped through stdin, keyed by the message (--key-column),
+           into a sheet that has every other one already, at another level.
+
+For each, the rows (or items) per second, the p50/p99 latency of the HTTP
+requests and the peak RSS are reported, as a table or as JSON for CI.
+
+Usage: python benchmarks/bench_load.py [options] [scenario ...]
+"""
+
+
+import json
+import multiprocessing
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+import fakefeeds
+import logtogss
+from logtogss import transport
+
+
+SCENARIOS = ['list', 'headers', 'pipe', 'batch', 'workers', 'sharded', 'block', 'upsert']
+
+# The headers are the same as their tags, so the columns can be given either way.
+COLUMNS = ['time', 'host', 'level', 'message']
+
+
+class BenchHttpClient(transport.PooledHttpClient):
+  """Time each of the requests."""
+
+  def __init__(self, endpoint, pool_size=4, idle_timeout=60):
+    transport.PooledHttpClient.__init__(self, pool_size, idle_timeout, endpoint)
+    self.latencies = []
+
+  def _http_request(self, method, uri, headers=None, body_parts=None):
+    start = time.time()
+    try:
+      return transport.PooledHttpClient._http_request(self, method, uri, headers, body_parts)
+    finally:
+      self.latencies.append(time.time() - start)
+
+
+def percentile(values, pct):
+  if not values:
+    return 0.0
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def populate(server, opts):
+  """Add the spreadsheets that the scenarios work on."""
+  for i in xrange(opts.spreadsheets):
+    worksheets = [fakefeeds.Worksheet('od%d' % j, 'Sheet%d' % j, COLUMNS)
+                  for j in xrange(opts.worksheets)]
+    server.AddSpreadsheet('key%d' % i, 'Spreadsheet %d' % i, worksheets)
+  # A worksheet for each insert scenario, with a data row to find the tags from.
+  worksheets = [fakefeeds.Worksheet(name, name, COLUMNS) for name in SCENARIOS[2:]]
+  for ws in worksheets:
+    for (col, value) in enumerate(['2011-01-01T00:00:00', 'host0', 'INFO', 'first'], 1):
+      ws.Set(2, col, value)
+  for i in xrange(0, opts.rows, 2):
+    for (col, value) in enumerate(['', '', 'DEBUG', 'message number %d' % i], 1):
+      worksheets[-1].Set(i / 2 + 3, col, value)
+  server.AddSpreadsheet('load', 'Load', worksheets)
+  # Two header rows over wide groups of columns, as with metric paths.
+  groups = ['servers.dc%d.host%03d' % (i % 3, i) for i in xrange(opts.width / 4)]
+  wide = fakefeeds.Worksheet('wide', 'Wide', ['c%d' % c for c in xrange(1, opts.width + 1)])
+  for (i, group) in enumerate(groups):
+    wide.Set(2, i * 4 + 1, group)
+    for (j, metric) in enumerate(['cpu', 'mem', 'disk', 'net']):
+      wide.Set(3, i * 4 + j + 1, metric)
+  server.AddSpreadsheet('wide', 'Wide', [wide])
+
+
+def serve(opts, conn):
+  """Run the fake feeds server, sending its URL back through conn."""
+  server = fakefeeds.FakeFeedsServer(opts.latency, opts.jitter, opts.errorRate, opts.errorStatus,
+                                     quota=opts.quota, retry_after=opts.retryAfter, seed=0)
+  populate(server, opts)
+  conn.send(server.my_url())
+  server.serve_forever()
+
+
+def write_lines(fd, num_rows):
+  """Write num_rows log lines to fd, as a producer on stdin would."""
+  with os.fdopen(fd, 'w') as fh:
+    for i in xrange(num_rows):
+      fh.write('2011-01-01T00:%02d:%02d host%d INFO message number %d\n' %
+               (i / 60 % 60, i % 60, i % 10, i))
+
+
+def write_matrix(fd, num_rows, width):
+  """Write num_rows lines of width numbers to fd."""
+  with os.fdopen(fd, 'w') as fh:
+    for i in xrange(num_rows):
+      fh.write(' '.join(str(i * width + j) for j in xrange(width)) + '\n')
+
+
+def make_action(cls, url, opts, **kwargs):
+  action = cls(pool_size=max(opts.workers, opts.concurrency), concurrency=opts.concurrency,
+               max_rate=opts.maxRate, **kwargs)
+  action.client.http_client = BenchHttpClient(url, max(opts.workers, opts.concurrency))
+  return action
+
+
+def run_scenario(name, url, opts):
+  """Run the scenario against the server at url, and return the measurements."""
+  if name == 'list':
+    action = make_action(logtogss.LogssAction, url, opts)
+    start = time.time()
+    try:
+      count = sum(len(list(worksheets)) for (ssname, ssid, worksheets) in action.GenerateListing())
+    finally:
+      action.Close()
+  elif name == 'headers':
+    action = make_action(logtogss.SpreadsheetInserter, url, opts)
+    action.SelectWorksheet('wide', True, 'wide', True)
+    start = time.time()
+    for i in xrange(opts.repeat):
+      action.SetColumnHeaderRowNums(2, 3, shortenColumnNames=True)
+    count = opts.repeat * len(action.col_name_to_key)
+  elif name == 'block':
+    action = make_action(logtogss.SpreadsheetInserter, url, opts)
+    action.SelectWorksheet('load', True, name, True)
+    (read_fd, write_fd) = os.pipe()
+    writer = threading.Thread(target=write_matrix, args=(write_fd, opts.rows, opts.blockWidth))
+    writer.daemon = True
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    start = time.time()
+    writer.start()
+    try:
+      rows = action.ReadTuples((), os.fdopen(read_fd))
+      count = action.WriteBlock(rows, cells_per_request=opts.cellsPerRequest,
+                                workers=opts.workers)[2]
+    finally:
+      sys.stderr = stderr
+  elif name == 'upsert':
+    action = make_action(logtogss.SpreadsheetInserter, url, opts)
+    action.SelectWorksheet('load', True, name, True)
+    (read_fd, write_fd) = os.pipe()
+    writer = threading.Thread(target=write_lines, args=(write_fd, opts.rows))
+    writer.daemon = True
+    start = time.time()
+    writer.start()
+    rows = action.ReadTuples(COLUMNS, os.fdopen(read_fd))
+    count = sum(action.UpsertRows(COLUMNS, rows, 'message').values())
+  elif name == 'sharded':
+    from logtogss import sharded
+    action = make_action(logtogss.SpreadsheetInserter, url, opts)
+    action.SelectWorksheet('load', True, name, True)
+    (fd, path) = tempfile.mkstemp()
+    write_lines(fd, opts.rows)
+    loader = sharded.ShardedLoader(action, path, COLUMNS, opts.processes,
+                                   batch_size=opts.batchSize, workers=opts.workers)
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    start = time.time()
+    try:
+      failed = loader.Run()
+    finally:
+      sys.stderr = stderr
+      os.unlink(path)
+    count = opts.rows - sum(last - first + 1 for (first, last) in failed)
+  else:
+    action = make_action(logtogss.SpreadsheetInserter, url, opts)
+    action.SelectWorksheet('load', True, name, True)
+    (read_fd, write_fd) = os.pipe()
+    writer = threading.Thread(target=write_lines, args=(write_fd, opts.rows))
+    writer.daemon = True
+    kwargs = {'pipe': {}, 'batch': {'batch_size': opts.batchSize},
+              'workers': {'batch_size': opts.batchSize, 'workers': opts.workers}}[name]
+    # Keep the progress messages out of the report.
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    start = time.time()
+    writer.start()
+    try:
+      failed = action.InsertFromFileHandle(COLUMNS, os.fdopen(read_fd), **kwargs)
+    finally:
+      sys.stderr = stderr
+    count = opts.rows - sum(last - first + 1 for (first, last) in failed)
+  elapsed = time.time() - start
+  latencies = action.client.http_client.latencies
+  return {'scenario': name,
+          'items': count,
+          'seconds': round(elapsed, 3),
+          'items_per_sec': round(count / elapsed, 1),
+          'requests': len(latencies),
+          'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+          'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+          # Linux reports it in KB.
+          'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+          'retries': action.client.scheduler.retries}
+
+
+def DefineFlags():
+  parser = optparse.OptionParser(usage='%prog [options] [scenario ...]')
+  parser.add_option('--rows', type='int', default=2000,
+                    help='Number of rows to pipe in the insert scenarios (default: 2000)')
+  parser.add_option('--batch-size', dest='batchSize', type='int', default=100,
+                    help='Batch size for the batch, workers and sharded scenarios (default: 100)')
+  parser.add_option('--workers', type='int', default=4,
+                    help='Workers for the workers and sharded scenarios (default: 4)')
+  parser.add_option('--processes', type='int', default=4,
+                    help='Processes for the sharded scenario (default: 4)')
+  parser.add_option('--block-width', dest='blockWidth', type='int', default=50,
+                    help='Number of values in each row of the block scenario (default: 50)')
+  parser.add_option('--cells-per-request', dest='cellsPerRequest', type='int', default=2000,
+                    help='Cells in each request of the block scenario (default: 2000)')
+  parser.add_option('--concurrency', type='int', default=8,
+                    help='Concurrent requests for the list scenario (default: 8)')
+  parser.add_option('--spreadsheets', type='int', default=20,
+                    help='Number of spreadsheets to list (default: 20)')
+  parser.add_option('--worksheets', type='int', default=3,
+                    help='Number of worksheets in each spreadsheet (default: 3)')
+  parser.add_option('--width', type='int', default=400,
+                    help='Number of columns in the headers scenario (default: 400)')
+  parser.add_option('--repeat', type='int', default=5,
+                    help='Times to map the headers in the headers scenario (default: 5)')
+  parser.add_option('--latency', type='float', default=0.005,
+                    help='Seconds the server takes for each response (default: 0.005)')
+  parser.add_option('--jitter', type='float', default=0.0,
+                    help='Up to this many more seconds of random delay (default: 0)')
+  parser.add_option('--error-rate', dest='errorRate', type='float', default=0.0,
+                    help='Share of the requests that the server fails (default: 0)')
+  parser.add_option('--error-status', dest='errorStatus', type='int', default=503,
+                    help='Status of the failed requests, 503 is retried but 500 is not (default: 503)')
+  parser.add_option('--quota', type='float',
+                    help='Requests per second the server allows, before a 429')
+  parser.add_option('--retry-after', dest='retryAfter', type='int', default=1,
+                    help='Retry-After of the 429 responses, in seconds (default: 1)')
+  parser.add_option('--max-rate', dest='maxRate', type='float',
+                    help='The --max-rate of the client')
+  parser.add_option('--json', action='store_true', default=False,
+                    help='Report as a JSON line per scenario')
+  parser.add_option('--server', help=optparse.SUPPRESS_HELP)
+  return parser
+
+
+def main():
+  parser = DefineFlags()
+  (opts, args) = parser.parse_args()
+  unknown = [name for name in args if name not in SCENARIOS]
+  if unknown:
+    parser.error('Unknown scenarios: %s' % ', '.join(unknown))
+  if opts.server:
+    # A child run of a single scenario.
+    print json.dumps(run_scenario(args[0], opts.server, opts))
+    return 0
+
+  (conn, child_conn) = multiprocessing.Pipe()
+  server = multiprocessing.Process(target=serve, args=(opts, child_conn))
+  server.daemon = True
+  server.start()
+  url = conn.recv()
+  status = 0
+  if not opts.json:
+    print '%-8s %8s %9s %10s %9s %8s %8s %8s' % ('scenario', 'items', 'seconds', 'items/sec',
+                                                  'requests', 'p50 ms', 'p99 ms', 'RSS MB')
+  for name in args or SCENARIOS:
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--server', url, name] +
+                             sys.argv[1:], stdout=subprocess.PIPE)
+    output = child.communicate()[0]
+    if child.returncode:
+      print >> sys.stderr, 'Scenario %s failed' % name
+      status = 1
+      continue
+    result = json.loads(output.splitlines()[-1])
+    if opts.json:
+      print json.dumps(result)
+    else:
+      print '%(scenario)-8s %(items)8d %(seconds)9.2f %(items_per_sec)10.1f %(requests)9d ' \
+            '%(p50_ms)8.2f %(p99_ms)8.2f %(peak_rss_mb)8.1f' % result
+  stats = json.loads(urllib2.urlopen(url + '/_stats').read())
+  print >> sys.stderr, 'Server: %(requests)d requests, %(errors)d failed, %(throttled)d throttled' % stats
+  server.terminate()
+  return status
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+"""Micro-benchmark of shorten() on wide and pathological header sets.
+
+Usage: python benchmarks/bench_shorten.py [-n REPEAT] [-w WIDTH]
+"""
+
+
+import optparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from logtogss import shorten
+
+
+def metric_paths(width):
+  """Dotted metric paths, sharing long prefixes, as in wide monitoring sheets."""
+  return ['servers.dc%d.rack%02d.host%03d.cpu.user' % (i % 3, i % 40, i)
+          for i in xrange(width)]
+
+def shared_prefix(width, prefix_len=200):
+  """Names that only differ in their last few characters."""
+  return ['x' * prefix_len + '%06d' % i for i in xrange(width)]
+
+def nested(width):
+  """Each name is the start of the next one, so that none can be shortened."""
+  return ['a' * i for i in xrange(1, width + 1)]
+
+def duplicates(width):
+  """A few names repeated many times, which all need numbering."""
+  return ['column%d' % (i % 10) for i in xrange(width)]
+
+
+CASES = [
+  ('metric paths', metric_paths, None),
+  ('metric paths, max_len=20', metric_paths, 20),
+  ('shared prefix', shared_prefix, None),
+  ('nested', nested, None),
+  ('duplicates', duplicates, None),
+  ('duplicates, max_len=7', duplicates, 7),
+]
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [-n REPEAT] [-w WIDTH]')
+  parser.add_option('-n', dest='repeat', type='int', default=5,
+                    help='Number of timed runs of each case, best one reported (default: 5)')
+  parser.add_option('-w', dest='width', type='int', default=5000,
+                    help='Number of header columns (default: 5000)')
+  (opts, args) = parser.parse_args()
+  print '%-28s %10s %12s' % ('case', 'best (ms)', 'names/sec')
+  for (label, generate, max_len) in CASES:
+    # The nested names are quadratic in size by themselves, so keep them narrower.
+    names = generate(generate is nested and min(opts.width, 1000) or opts.width)
+    best = min(timeit.repeat(lambda: shorten(names, max_len), number=1, repeat=opts.repeat))
+    print '%-28s %10.2f %12.0f' % (label, best * 1000, len(names) / best)
+
+
+if __name__ == '__main__':
+  main()
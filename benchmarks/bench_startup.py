@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+"""Time whole runs of the logtogss command, as when it is run per event.
+
+The command is run as a new process each time, like the installed script,
+with a throwaway home directory that has a dummy token and, after a first
+run, the ids and column tags cached, so the insert needs just one request. The
+requests go to a local fake of the feeds (see fakefeeds.py).
+
+  help     logtogss --help
+  error    logtogss with a usage error
+  insert   A line on stdin inserted as a row, with the cache warm.
+
+The insert is checked against a time budget, so that slower startups fail a
+CI run. Use --print-startup-profile on the command to see where the time goes.
+
+Usage: python benchmarks/bench_startup.py [options]
+"""
+
+
+import optparse
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+
+import gdata.gauth
+
+import fakefeeds
+
+
+SCRIPT = """\
+import sys
+sys.path.insert(0, %r)
+import logtogss
+sys.exit(logtogss.main())
+"""
+
+
+def percentile(values, pct):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def time_runs(cmd, env, runs, stdin=''):
+  """Return the wall times of runs runs of cmd, which must succeed."""
+  times = []
+  for i in xrange(runs):
+    start = time.time()
+    child = subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+    (out, err) = child.communicate(stdin)
+    times.append(time.time() - start)
+    if child.returncode not in (0, 2):
+      raise Exception('%s failed: %s' % (' '.join(cmd), err))
+  return times
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--runs', type='int', default=20,
+                    help='Number of runs of each command (default: 20)')
+  parser.add_option('--latency', type='float', default=0.0,
+                    help='Seconds the server takes for each response (default: 0)')
+  parser.add_option('--budget-ms', dest='budgetMs', type='float', default=250,
+                    help='Fail if the median insert takes longer (default: 250)')
+  (opts, args) = parser.parse_args()
+
+  server = fakefeeds.FakeFeedsServer(opts.latency)
+  server.AddSpreadsheet('key1', 'Events', [fakefeeds.Worksheet('od6', 'Sheet1', ['time', 'event'])])
+  server.Start()
+  home = tempfile.mkdtemp()
+  try:
+    # Named like the installed script, for the names of the token and cache.
+    script = os.path.join(home, 'logtogss')
+    with open(script, 'w') as fh:
+      fh.write(SCRIPT % os.path.abspath(SRC_DIR))
+    with open(os.path.join(home, '.logtogss.tok'), 'wb') as fh:
+      pickle.dump(gdata.gauth.OAuthHmacToken('anonymous', 'anonymous', 'token', 'secret',
+                                             gdata.gauth.ACCESS_TOKEN), fh)
+    # The usage has non-ASCII characters, which a pipe would fail to encode.
+    env = dict(os.environ, HOME=home, PYTHONIOENCODING='utf-8')
+    python = [sys.executable, script]
+    insert = python + ['--endpoint', server.my_url(), '-n', 'Events', 'time', 'event']
+    # Warm up the cache.
+    time_runs(insert, env, 1, '2011-01-01T00:00:00 started\n')
+    print '%-8s %8s %8s %8s' % ('command', 'min ms', 'p50 ms', 'p90 ms')
+    results = {}
+    for (name, cmd, stdin) in [('help', python + ['--help'], ''),
+                               ('error', python, ''),
+                               ('insert', insert, '2011-01-01T00:00:01 event\n')]:
+      times = time_runs(cmd, env, opts.runs, stdin)
+      results[name] = percentile(times, 50) * 1000
+      print '%-8s %8.1f %8.1f %8.1f' % (name, min(times) * 1000, results[name],
+                                        percentile(times, 90) * 1000)
+  finally:
+    shutil.rmtree(home)
+  if results['insert'] > opts.budgetMs:
+    print >> sys.stderr, 'The median insert took %.1fms, over the budget of %.0fms' % (
+        results['insert'], opts.budgetMs)
+    return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
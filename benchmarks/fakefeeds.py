@@ -0,0 +1,407 @@
+#!/usr/bin/python
+
+"""A local stand-in for the Spreadsheets feeds, to benchmark against.
+
+It serves just enough of the spreadsheets, worksheets, list and cells feeds
+(including the cells batch feed) for logtogss to list, read headers from,
+insert into and update in-memory worksheets. Every response can be delayed,
+and a share of them replaced with an error, or with a 429 once a request quota
+is used up, to see how the client copes. Like oneshot.ParamsReceiverServer, it listens on
+a port picked by the kernel.
+
+Usage: python benchmarks/fakefeeds.py [options]
+"""
+
+
+import BaseHTTPServer
+import SocketServer
+import json
+import optparse
+import random
+import re
+import threading
+import time
+import urlparse
+from xml.sax.saxutils import escape, quoteattr, unescape
+
+
+# The feeds are served with the real URLs in them (e.g. in the ids and edit
+# links), as the client may follow them; it has to be pointed at this server.
+BASE_URL = 'https://spreadsheets.google.com/feeds'
+
+NAMESPACES = ('xmlns="http://www.w3.org/2005/Atom" '
+              'xmlns:openSearch="http://a9.com/-/spec/opensearch/1.1/" '
+              'xmlns:gs="http://schemas.google.com/spreadsheets/2006" '
+              'xmlns:gsx="http://schemas.google.com/spreadsheets/2006/extended" '
+              'xmlns:batch="http://schemas.google.com/gdata/batch"')
+
+
+def timestamp():
+  """The current time, as in the updated elements of the feeds."""
+  now = time.time()
+  return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + '.%03dZ' % (now * 1000 % 1000)
+
+
+def column_tag(name):
+  """The list feed tag of a header, roughly as the real feeds derive it."""
+  return re.sub(r'[^a-z0-9.-]', '', name.lower())
+
+
+class Worksheet(object):
+  """The cells of a worksheet, and the list feed view of them."""
+
+  def __init__(self, wsid, title, headers=(), row_count=1000, col_count=26):
+    self.id = wsid
+    self.title = title
+    self.row_count = row_count
+    self.col_count = max(col_count, len(headers))
+    self.rows = {}
+    # When each row, and the worksheet, were last updated.
+    self.updated = {}
+    self.modified = timestamp()
+    self.lock = threading.Lock()
+    self.next_free = 2
+    for (col, header) in enumerate(headers, 1):
+      self.Set(1, col, header)
+
+  def Set(self, row, col, value):
+    self.updated[row] = self.modified = timestamp()
+    if value:
+      self.rows.setdefault(row, {})[col] = value
+    elif row in self.rows:
+      self.rows[row].pop(col, None)
+    while self.rows.get(self.next_free):
+      self.next_free += 1
+
+  def ColumnTags(self):
+    """Return the (col, tag) of the non-empty header cells, in order."""
+    tags = []
+    seen = set()
+    for (col, name) in sorted(self.rows.get(1, {}).items()):
+      tag = column_tag(name) or '_c%d' % col
+      # Repeated tags are numbered, from _2.
+      (base, num) = (tag, 1)
+      while tag in seen:
+        num += 1
+        tag = '%s_%d' % (base, num)
+      seen.add(tag)
+      tags.append((col, tag))
+    return tags
+
+
+class FakeFeedsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Serve the feeds of the given spreadsheets, from memory.
+
+  Methods:
+    AddSpreadsheet: Add a spreadsheet, with its worksheets.
+    my_url: The URL to point the client at.
+    Start: Serve from a background thread.
+
+  Extra properties:
+    stats: Counters of the requests served, failed and throttled.
+  """
+
+  daemon_threads = True
+  allow_reuse_address = True
+  # The default backlog of 5 overflows with more concurrent connects, and
+  # the dropped ones are retried after a second.
+  request_queue_size = 64
+
+  class FeedsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep the connections alive, as the real server does.
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one go, rather than a write per header, which
+    # with Nagle's algorithm and delayed acks would add ~40ms to each.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+      ('GET', r'/feeds/spreadsheets/private/full$', 'Spreadsheets'),
+      ('GET', r'/feeds/worksheets/([^/]+)/private/full$', 'Worksheets'),
+      ('GET', r'/feeds/worksheets/([^/]+)/private/full/([^/]+)$', 'Worksheet'),
+      ('PUT', r'/feeds/worksheets/([^/]+)/private/full/([^/]+)(?:/[^/]+)?$', 'UpdateWorksheet'),
+      ('GET', r'/feeds/list/([^/]+)/([^/]+)/private/full$', 'ListFeed'),
+      ('POST', r'/feeds/list/([^/]+)/([^/]+)/private/full$', 'AddListEntry'),
+      ('GET', r'/feeds/list/([^/]+)/([^/]+)/private/full/R(\d+)$', 'GetListEntry'),
+      ('PUT', r'/feeds/list/([^/]+)/([^/]+)/private/full/R(\d+)(?:/[^/]+)?$', 'UpdateListEntry'),
+      ('GET', r'/feeds/cells/([^/]+)/([^/]+)/private/full$', 'CellsFeed'),
+      ('POST', r'/feeds/cells/([^/]+)/([^/]+)/private/full/batch$', 'BatchCells'),
+      ('GET', r'/_stats$', 'Stats'),
+    ]
+
+    def log_message(self, format, *args):
+      """Don't log anything."""
+      pass
+
+    def do_GET(self):
+      self.Dispatch('GET')
+
+    def do_POST(self):
+      self.Dispatch('POST')
+
+    def do_PUT(self):
+      self.Dispatch('PUT')
+
+    def Dispatch(self, method):
+      url = urlparse.urlparse(self.path)
+      self.query = dict((k, v[0].isdigit() and int(v[0]) or v[0])
+                        for (k, v) in urlparse.parse_qs(url.query).items())
+      length = int(self.headers.getheader('content-length') or 0)
+      self.body = length and self.rfile.read(length) or ''
+      for (route_method, pattern, name) in self.ROUTES:
+        match = re.match(pattern, url.path)
+        if match and route_method == method:
+          break
+      else:
+        return self.Respond(404, 'Not found: %s %s' % (method, url.path), 'text/plain')
+      if name != 'Stats':
+        rejected = self.server.Admit()
+        if rejected:
+          return self.Respond(*rejected)
+      try:
+        response = getattr(self, name)(*match.groups())
+      except KeyError, e:
+        return self.Respond(404, 'Not found: %s' % e, 'text/plain')
+      self.Respond(*response)
+
+    def Respond(self, status, body, content_type='application/atom+xml', headers=()):
+      self.send_response(status)
+      self.send_header('Content-Type', content_type)
+      self.send_header('Content-Length', str(len(body)))
+      for (name, value) in headers:
+        self.send_header(name, value)
+      self.end_headers()
+      self.wfile.write(body)
+
+    def Sheet(self, key, wsid):
+      spreadsheet = self.server.spreadsheets[key]
+      if wsid == 'default':
+        return spreadsheet['worksheets'][0]
+      return [ws for ws in spreadsheet['worksheets'] if ws.id == wsid][0]
+
+    def Spreadsheets(self):
+      entries = ['<entry><id>%s/spreadsheets/private/full/%s</id><title>%s</title></entry>' %
+                 (BASE_URL, key, escape(ss['title']))
+                 for (key, ss) in sorted(self.server.spreadsheets.items())]
+      return (200, '<feed %s><id>%s/spreadsheets/private/full</id>%s</feed>' %
+              (NAMESPACES, BASE_URL, ''.join(entries)))
+
+    def WorksheetEntry(self, key, ws):
+      url = '%s/worksheets/%s/private/full/%s' % (BASE_URL, key, ws.id)
+      return ('<entry><id>%s</id><title>%s</title>'
+              '<link rel="edit" type="application/atom+xml" href="%s/v1"/>'
+              '<gs:rowCount>%d</gs:rowCount><gs:colCount>%d</gs:colCount></entry>' %
+              (url, escape(ws.title), url, ws.row_count, ws.col_count))
+
+    def Worksheets(self, key):
+      entries = [self.WorksheetEntry(key, ws)
+                 for ws in self.server.spreadsheets[key]['worksheets']]
+      return (200, '<feed %s><id>%s/worksheets/%s/private/full</id>%s</feed>' %
+              (NAMESPACES, BASE_URL, key, ''.join(entries)))
+
+    def Worksheet(self, key, wsid):
+      entry = self.WorksheetEntry(key, self.Sheet(key, wsid))
+      return (200, entry.replace('<entry>', '<entry %s>' % NAMESPACES, 1))
+
+    def UpdateWorksheet(self, key, wsid):
+      ws = self.Sheet(key, wsid)
+      with ws.lock:
+        for (name, value) in re.findall(r'<(?:\w+:)?(rowCount|colCount)[^>]*>(\d+)<', self.body):
+          setattr(ws, name == 'rowCount' and 'row_count' or 'col_count', int(value))
+      return self.Worksheet(key, wsid)
+
+    def ListEntry(self, key, ws, row, tags):
+      values = ws.rows.get(row, {})
+      url = '%s/list/%s/%s/private/full/R%d' % (BASE_URL, key, ws.id, row)
+      return ('<entry><id>%s</id><updated>%s</updated>'
+              '<link rel="edit" type="application/atom+xml" href="%s/v"/>%s</entry>' %
+              (url, ws.updated.get(row, ws.modified), url,
+               ''.join('<gsx:%s>%s</gsx:%s>' % (tag, escape(values.get(col, '')), tag)
+                       for (col, tag) in tags)))
+
+    def ListFeed(self, key, wsid):
+      ws = self.Sheet(key, wsid)
+      with ws.lock:
+        tags = ws.ColumnTags()
+        rows = range(2, ws.next_free)
+        if 'updated-min' in self.query:
+          rows = [row for row in rows if ws.updated.get(row, '') >= self.query['updated-min']]
+        start = self.query.get('start-index', 1)
+        page = rows[start - 1:start - 1 + self.query.get('max-results', len(rows))]
+        entries = [self.ListEntry(key, ws, row, tags) for row in page]
+      return (200, '<feed %s><id>%s/list/%s/%s/private/full</id><updated>%s</updated>'
+              '<openSearch:totalResults>%d</openSearch:totalResults>'
+              '<openSearch:startIndex>%d</openSearch:startIndex>%s</feed>' %
+              (NAMESPACES, BASE_URL, key, ws.id, ws.modified, len(rows), start, ''.join(entries)))
+
+    def GetListEntry(self, key, wsid, row):
+      ws = self.Sheet(key, wsid)
+      row = int(row)
+      with ws.lock:
+        if not 2 <= row < ws.next_free:
+          raise KeyError(row)
+        entry = self.ListEntry(key, ws, row, ws.ColumnTags())
+      return (200, entry.replace('<entry>', '<entry %s>' % NAMESPACES, 1))
+
+    def UpdateListEntry(self, key, wsid, row):
+      ws = self.Sheet(key, wsid)
+      row = int(row)
+      values = dict((tag, unescape(value)) for (tag, value)
+                    in re.findall(r'<gsx:([^\s>]+)>(.*?)</gsx:\1>', self.body, re.S))
+      with ws.lock:
+        if not 2 <= row < ws.next_free:
+          raise KeyError(row)
+        # The whole row is replaced.
+        for (col, tag) in ws.ColumnTags():
+          ws.Set(row, col, values.get(tag, ''))
+      return self.GetListEntry(key, wsid, row)
+
+    def AddListEntry(self, key, wsid):
+      ws = self.Sheet(key, wsid)
+      values = dict((tag, unescape(value)) for (tag, value)
+                    in re.findall(r'<gsx:([^\s>]+)>(.*?)</gsx:\1>', self.body, re.S))
+      with ws.lock:
+        tags = ws.ColumnTags()
+        row = ws.next_free
+        if row > ws.row_count:
+          ws.row_count = row
+        for (col, tag) in tags:
+          ws.Set(row, col, values.get(tag, ''))
+        # An empty row would not count, so keep the spot taken.
+        ws.next_free = max(ws.next_free, row + 1)
+        entry = self.ListEntry(key, ws, row, tags)
+      return (201, entry.replace('<entry>', '<entry %s>' % NAMESPACES, 1))
+
+    def CellEntry(self, key, ws, row, col, value, extra=''):
+      url = '%s/cells/%s/%s/private/full/R%dC%d' % (BASE_URL, key, ws.id, row, col)
+      return ('<entry>%s<id>%s</id><title>R%dC%d</title><content>%s</content>'
+              '<link rel="edit" type="application/atom+xml" href="%s"/>'
+              '<gs:cell row="%d" col="%d" inputValue=%s>%s</gs:cell></entry>' %
+              (extra, url, row, col, escape(value), url, row, col, quoteattr(value), escape(value)))
+
+    def CellsFeed(self, key, wsid):
+      ws = self.Sheet(key, wsid)
+      q = self.query
+      with ws.lock:
+        entries = [self.CellEntry(key, ws, row, col, value)
+                   for (row, cells) in sorted(ws.rows.items())
+                   if q.get('min-row', 1) <= row <= q.get('max-row', ws.row_count)
+                   for (col, value) in sorted(cells.items())
+                   if q.get('min-col', 1) <= col <= q.get('max-col', ws.col_count)]
+        return (200, '<feed %s><id>%s/cells/%s/%s/private/full</id>'
+                '<gs:rowCount>%d</gs:rowCount><gs:colCount>%d</gs:colCount>%s</feed>' %
+                (NAMESPACES, BASE_URL, key, ws.id, ws.row_count, ws.col_count, ''.join(entries)))
+
+    def BatchCells(self, key, wsid):
+      ws = self.Sheet(key, wsid)
+      entries = []
+      with ws.lock:
+        for (batch_id, row, col, value) in re.findall(
+            r'<batch:id>([^<]*)</batch:id>.*?<gs:cell row="(\d+)" col="(\d+)" inputValue="([^"]*)"',
+            self.body, re.S):
+          (row, col) = (int(row), int(col))
+          value = unescape(value, {'&quot;': '"', '&#10;': '\n', '&#13;': '\r', '&#9;': '\t'})
+          if row > ws.row_count or col > ws.col_count:
+            status = '<batch:status code="400" reason="Cell outside of the worksheet"/>'
+          else:
+            ws.Set(row, col, value)
+            status = '<batch:status code="200" reason="Success"/>'
+          entries.append(self.CellEntry(key, ws, row, col, value,
+                                        '<batch:id>%s</batch:id>%s'
+                                        '<batch:operation type="update"/>' % (batch_id, status)))
+      return (200, '<feed %s><id>%s/cells/%s/%s/private/full</id>%s</feed>' %
+              (NAMESPACES, BASE_URL, key, ws.id, ''.join(entries)))
+
+    def Stats(self):
+      return (200, json.dumps(self.server.stats), 'application/json')
+
+  def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500, quota=None,
+               retry_after=1, seed=None, handler_class=FeedsHandler):
+    """
+    Delay each response by latency seconds, plus up to jitter more. Fail
+    error_rate of the requests with error_status, and when quota is given,
+    reject the requests over quota per second with a 429 that asks to retry
+    after retry_after seconds.
+    """
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.error_status = error_status
+    self.quota = quota
+    self.retry_after = retry_after
+    self.random = random.Random(seed)
+    self.spreadsheets = {}
+    self.stats = {'requests': 0, 'errors': 0, 'throttled': 0}
+    self.lock = threading.Lock()
+    self.tokens = quota or 0
+    self.last_refill = time.time()
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), handler_class)
+    self.port = self.server_address[1]
+
+  def AddSpreadsheet(self, key, title, worksheets):
+    """Add a spreadsheet with the given list of Worksheets."""
+    self.spreadsheets[key] = {'title': title, 'worksheets': worksheets}
+
+  def Admit(self):
+    """
+    Count the request and wait out the latency. Returns the response to
+    reject it with, or None to serve it.
+    """
+    with self.lock:
+      self.stats['requests'] += 1
+      delay = self.latency + (self.jitter and self.random.uniform(0, self.jitter))
+      failed = self.error_rate and self.random.random() < self.error_rate
+      throttled = False
+      if self.quota:
+        now = time.time()
+        self.tokens = min(self.quota, self.tokens + (now - self.last_refill) * self.quota)
+        self.last_refill = now
+        if self.tokens < 1:
+          throttled = True
+        else:
+          self.tokens -= 1
+      if throttled:
+        self.stats['throttled'] += 1
+      elif failed:
+        self.stats['errors'] += 1
+    if delay:
+      time.sleep(delay)
+    if throttled:
+      return (429, 'Quota exceeded', 'text/plain', [('Retry-After', str(self.retry_after))])
+    if failed:
+      return (self.error_status, 'Injected error', 'text/plain')
+    return None
+
+  def my_url(self):
+    """What URL is this server listening on?"""
+    return 'http://127.0.0.1:%d' % self.port
+
+  def Start(self):
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--latency', type='float', default=0.0,
+                    help='Seconds to delay each response by')
+  parser.add_option('--jitter', type='float', default=0.0,
+                    help='Up to this many more seconds of random delay')
+  parser.add_option('--error-rate', dest='errorRate', type='float', default=0.0,
+                    help='Share of the requests to fail, between 0 and 1')
+  parser.add_option('--error-status', dest='errorStatus', type='int', default=500,
+                    help='Status to fail the requests with (default: 500)')
+  parser.add_option('--quota', type='float',
+                    help='Requests per second to allow, before responding with 429')
+  (opts, args) = parser.parse_args()
+  server = FakeFeedsServer(opts.latency, opts.jitter, opts.errorRate, opts.errorStatus,
+                           quota=opts.quota)
+  server.AddSpreadsheet('key1', 'Sheet 1',
+                        [Worksheet('od6', 'Sheet1', ['Time', 'Host', 'Message'])])
+  print server.my_url()
+  server.serve_forever()
+
+if __name__ == '__main__':
+  main()
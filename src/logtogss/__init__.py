@@ -37,19 +37,31 @@ __status__ = 'Development'
 __maintainer__ = 'Hari Dara'
 __email__ = 'haridara@gmail.com'
 
-import pickle
+import sys
+
+import startup
+if '--print-startup-profile' in sys.argv[1:]:
+  # Before anything else is imported, to time it all.
+  startup.TimeImports()
+
+import contextlib
 import optparse
 import os
-import sys
-import urllib
+import re
 import textwrap
-import csv
+import itertools
+import threading
+import Queue
+import time
+import functools
 
-import gdata.gauth
-import gdata.spreadsheets.client
-import gdata.spreadsheets.data
+import instrument
+import rowreader
+import rowxml
 
-import oneshot
+# The modules that only some of the paths need, above all the gdata modules
+# (see sheets), are imported where they are used. Every run imports what it
+# uses anew, which for a run per logged event adds up to more than the work.
 
 
 # OAuth bits.  We use “anonymous” to behave as an unregistered application.
@@ -61,29 +73,144 @@ SCOPES = ['https://spreadsheets.google.com/feeds/']
 
 
 class TokenStore(object):
-  """Store and retreive OAuth access tokens."""
+  """Store and retreive OAuth access tokens.
+
+  The token file is shared by all the runs of the user, many of which may
+  start at once, e.g. from cron. It is only ever replaced whole, so it can be
+  read without locking. Writing it (after fetching or refreshing the token)
+  takes a lock first, so that only one run does, and the others wait for the
+  result. A token read is kept for the rest of the process.
+  """
+
+  # token file -> token, shared by all the clients of the process.
+  tokens = {}
 
   def __init__(self, token_file=None):
     default = os.path.expanduser('~/.%s.tok' % os.path.basename(sys.argv[0]))
     self.token_file = token_file or default
 
-  def ReadToken(self):
+  def ReadToken(self, cached=True):
     """Read in the stored auth token object.
 
+    Args:
+      cached: Whether to return the token already read by this process, if any.
+
     Returns:
       The stored token object, or None.
     """
+    tok = cached and TokenStore.tokens.get(self.token_file) or None
+    if tok is not None:
+      return tok
+    import pickle
     try:
       with open(self.token_file, 'rb') as fh:
-        return pickle.load(fh)
+        tok = pickle.load(fh)
     except IOError, e:
       return None
+    except Exception, e:
+      # Left partially written by an older version, or otherwise corrupt.
+      return None
+    TokenStore.tokens[self.token_file] = tok
+    return tok
 
   def WriteToken(self, tok):
     """Write the token object to a file."""
-    with open(self.token_file, 'wb') as fh:
+    import pickle
+    # Write then rename, so that concurrent runs never see a partial file.
+    tmp_file = '%s.%d' % (self.token_file, os.getpid())
+    with open(tmp_file, 'wb') as fh:
+      os.fchmod(fh.fileno(), 0600)
+      pickle.dump(tok, fh, pickle.HIGHEST_PROTOCOL)
+      fh.flush()
+      os.fsync(fh.fileno())
+    os.rename(tmp_file, self.token_file)
+    TokenStore.tokens[self.token_file] = tok
+
+  def Locked(self):
+    """
+    Return a context manager that holds an exclusive lock on the token file,
+    waiting for it as long as another run holds it.
+    """
+    return FileLock(self.token_file + '.lock')
+
+class FileLock(object):
+  """An exclusive lock on a file, across processes, held in a with statement."""
+
+  def __init__(self, lock_file):
+    self.lock_file = lock_file
+    self.fd = None
+
+  def __enter__(self):
+    import fcntl
+    self.fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0600)
+    try:
+      fcntl.flock(self.fd, fcntl.LOCK_EX)
+    except:
+      os.close(self.fd)
+      raise
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    # Closing the file releases the lock.
+    os.close(self.fd)
+    self.fd = None
+
+class MetadataCache(object):
+  """Store and retrieve resolved spreadsheet metadata, such as ids."""
+
+  def __init__(self, cache_file=None, ttl=3600):
+    """
+    The cache is kept next to the token file by default, and its entries
+    expire after ttl seconds.
+    """
+    default = os.path.splitext(TokenStore().token_file)[0] + '.cache'
+    self.cache_file = cache_file or default
+    self.ttl = ttl
+    self.entries = None
+
+  def _Load(self):
+    if self.entries is None:
+      import pickle
+      try:
+        with open(self.cache_file, 'rb') as fh:
+          self.entries = pickle.load(fh)
+      except IOError, e:
+        self.entries = {}
+      except Exception, e:
+        # A corrupt cache is no worse than an empty one.
+        self.entries = {}
+    return self.entries
+
+  def _Write(self):
+    import pickle
+    # Write then rename, so that concurrent runs never see a partial file.
+    tmp_file = '%s.%d' % (self.cache_file, os.getpid())
+    with open(tmp_file, 'wb') as fh:
       os.fchmod(fh.fileno(), 0600)
-      pickle.dump(tok, fh)
+      pickle.dump(self.entries, fh, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, self.cache_file)
+
+  def Get(self, key, max_age=None):
+    """
+    Return the value stored for key, or None if missing or older than max_age
+    seconds (the cache ttl by default).
+    """
+    entry = self._Load().get(key)
+    if entry is None:
+      return None
+    (value, stored_at) = entry
+    if time.time() - stored_at > (max_age is None and self.ttl or max_age):
+      return None
+    return value
+
+  def Set(self, key, value):
+    self._Load()[key] = (value, time.time())
+    self._Write()
+
+  def Invalidate(self, *keys):
+    entries = self._Load()
+    if [entries.pop(key) for key in keys if key in entries]:
+      self._Write()
 
 class ClientAuthorizer(object):
   """Add authorization to a client."""
@@ -98,11 +225,15 @@ class ClientAuthorizer(object):
     self.token_store = token_store or TokenStore()
     self.auth_domain = auth_domain
     self.logger = self.LogToStdout
+    # Refresh the tokens that expire within this many seconds, before use.
+    self.refresh_margin = 300
 
   def LogToStdout(self, msg):
     print msg
 
   def FetchAccessToken(self, client):
+    import gdata.gauth
+    import oneshot
     # http://code.google.com/apis/gdata/docs/auth/oauth.html#Examples
     httpd = oneshot.ParamsReceiverServer()
 
@@ -118,110 +249,89 @@ class ClientAuthorizer(object):
   def EnsureAuthToken(self, client):
     """Ensure client.auth_token is valid.
 
-    If a stored token is available, it will be used.  Otherwise, this goes
-    through the OAuth rituals described at:
+    If a stored token is available, it will be used, after refreshing it if
+    it expires within refresh_margin seconds.  Otherwise, this goes through
+    the OAuth rituals described at:
 
     http://code.google.com/apis/gdata/docs/auth/oauth.html
 
-    As a side effect, this also reads and stores the token in a file.
+    As a side effect, this also reads and stores the token in a file. Only one
+    of the runs that find the token missing or expiring, at the same time,
+    fetches or refreshes it, and the others use its result.
     """
-    access_token = self.token_store.ReadToken()
-    if not access_token:
-      access_token = self.FetchAccessToken(client)
-      self.token_store.WriteToken(access_token)
+    store = self.token_store
+    access_token = store.ReadToken()
+    if access_token is None or self.NeedsRefresh(access_token):
+      with store.Locked():
+        # Another run may have stored a new token while this one waited.
+        access_token = store.ReadToken(cached=False)
+        if access_token is None:
+          access_token = self.FetchAccessToken(client)
+          store.WriteToken(access_token)
+        elif self.NeedsRefresh(access_token):
+          self.RefreshAccessToken(client, access_token)
+          store.WriteToken(access_token)
     client.auth_token = access_token
 
-
-# The next three classes are overrides to add missing functionality in the
-# python-gdata-client.
-
-class MyListEntry(gdata.spreadsheets.data.ListEntry):
-  GSX_NS = gdata.spreadsheets.data.GSX_NAMESPACE
-
-  def ColumnTags(self):
-    """Return the names of all child elements in the GSX namespace."""
-    return [el.tag for el in self.get_elements(namespace=MyListEntry.GSX_NS)]
-
-  def RowValues(self):
-    """Return the values of all child elements in the GSX namespace."""
-    return [el.text for el in self.get_elements(namespace=MyListEntry.GSX_NS)]
-
-  def RowValueToTagMap(self):
+  def NeedsRefresh(self, access_token):
     """
-    Return the values of all child elements keyed by their tags in the GSX namespace.
-    Useful on a header row to map the column names to their tags.
+    Whether the token expires within refresh_margin seconds. Only OAuth 2.0
+    tokens have an expiry, the OAuth 1.0 ones are valid until revoked.
     """
-    return dict([(el.text, el.tag) for el in self.get_elements(namespace=MyListEntry.GSX_NS)])
-
-class MyListsFeed(gdata.spreadsheets.data.ListsFeed):
-
-  entry = [MyListEntry]
+    expiry = getattr(access_token, 'token_expiry', None)
+    if expiry is None:
+      return False
+    import datetime
+    return expiry - datetime.timedelta(seconds=self.refresh_margin) <= datetime.datetime.now()
 
-  def ColumnTags(self):
-    if not self.entry:
-      return []
-    return self.entry[0].ColumnTags()
+  def RefreshAccessToken(self, client, access_token):
+    """Get a new access token for the refresh token of access_token, in place."""
+    access_token._refresh(client.http_client.request)
+    if access_token.invalid:
+      raise Exception("The stored token can't be refreshed, remove %s to authorize again" %
+                      self.token_store.token_file)
 
-  def ColumnValueToTagMap(self):
-    if not self.entry:
-      return []
-    return self.entry[0].RowValueToTagMap()
-
-class MySpreadsheetsClient(gdata.spreadsheets.client.SpreadsheetsClient):
-  """Add in support for List feeds."""
-
-  LISTS_URL = 'https://spreadsheets.google.com/feeds/list/%s/%s/private/full'
-  CELLS_URL = 'https://spreadsheets.google.com/feeds/cells/%s/%s/private/full'
-
-  def get_list_feed(self, key, wksht_id='default', start_index=None, max_results=None, **kwargs):
-    return self._get_feed(self.LISTS_URL, key, wksht_id,
-                          desired_class=MyListsFeed,
-                          start_index=start_index,
-                          max_results=max_results,
-                          kwargs=kwargs)
-
-  GetListFeed = get_list_feed
-
-  def get_cells_feed(self, key, wksht_id='default', start_index=None,
-                     min_col=None, max_col=None, min_row=None, max_row=None,
-                     max_results=None, **kwargs):
-    return self._get_feed(self.CELLS_URL, key, wksht_id,
-                          start_index=start_index,
-                          min_col=min_col,
-                          max_col=max_col,
-                          min_row=min_row,
-                          max_row=max_row,
-                          max_results=max_results,
-                          kwargs=kwargs)
-
-  GetCellsFeed = get_cells_feed
-
-  def _get_feed(self, baseuri, key, wksht_id='default', desired_class=None, **params):
-    kwargs = params.pop('kwargs')
-
-    uri = baseuri % (key, wksht_id)
-    # Remove the params with None values, so they don't get into the query
-    params = dict([(key.replace('_', '-'), value) for (key, value) in params.items() if value is not None])
-    if params:
-      uri += ('?' + urllib.urlencode(params.items()))
-    if desired_class:
-      kwargs['desired_class'] = desired_class
-    return self.get_feed(uri, **kwargs)
 
 class LogssAction(object):
 
-  def __init__(self, debug=False, auth_domain=None):
+  def __init__(self, debug=False, auth_domain=None, cache=None, pool_size=4, idle_timeout=60,
+               concurrency=8, max_rate=None, max_retries=5, recorder=None, endpoint=None):
+    import sheets
+    import throttle
+    import transport
     self.debug = debug
     self.auth_domain = auth_domain
-    self.client = MySpreadsheetsClient()
+    self.cache = cache
+    self.concurrency = concurrency
+    self.async_client = None
+    self.recorder = recorder or instrument.Recorder()
+    self.client = sheets.MySpreadsheetsClient(
+        http_client=transport.PooledHttpClient(pool_size, idle_timeout, endpoint))
+    self.client.scheduler = throttle.RequestScheduler(max_rate, max_retries)
+    self.client.recorder = self.client.http_client.recorder = self.recorder
+    self.client.scheduler.recorder = self.recorder
     self.client.debug = debug
     self.client.http_client.debug = debug
     self.client.source = os.path.basename(sys.argv[0])
 
+  @instrument.timed('auth')
   def Authenticate(self, logger=None):
     client_authz = ClientAuthorizer(logger=logger, auth_domain=self.auth_domain)
     client_authz.EnsureAuthToken(self.client)
 
+  def AsyncClient(self):
+    """Return the client for issuing up to self.concurrency requests at once."""
+    if self.async_client is None:
+      import asyncclient
+      self.async_client = asyncclient.AsyncSpreadsheetsClient(self.client, self.concurrency)
+    return self.async_client
+
+  def Close(self):
+    """Stop the threads of the async client, if it was started."""
+    if self.async_client is not None:
+      self.async_client.close()
+      self.async_client = None
+
   def GetSpreadsheets(self, ss=None, ss_is_id=False):
     """
     Return a generator of spreadsheet (name, id) pairs.
@@ -229,13 +339,15 @@ class LogssAction(object):
     generated.
     """
     # Get all spreadsheets.
-    spreadsheets = self.client.GetSpreadsheets()
-    for (ssname, ssid) in self._gen_name_id(spreadsheets.entry):
-      if ss:
-        if (ss_is_id and ss == ssid) or (ssname == ss):
-          yield ssname, ssid
-      else:
-        yield ssname, ssid
+    with self.recorder.Phase('spreadsheets'):
+      spreadsheets = self.client.GetSpreadsheets()
+    for (ssname, ssid) in self._filter_name_id(spreadsheets.entry, ss, ss_is_id):
+      yield ssname, ssid
+
+  def GetSpreadsheetsAsync(self, ss=None, ss_is_id=False):
+    """Like GetSpreadsheets, but return a Future of the list of pairs."""
+    return self.AsyncClient().GetSpreadsheets().then(
+        lambda spreadsheets: list(self._filter_name_id(spreadsheets.entry, ss, ss_is_id)))
 
   def GetWorksheets(self, ssid, ws=None, ws_is_id=False):
     """
@@ -244,113 +356,834 @@ class LogssAction(object):
     Given a worksheet name or id, only the entry for that worksheet is
     generated.
     """
-    worksheets = self.client.GetWorksheets(ssid)
-    for (wsname, wsid) in self._gen_name_id(worksheets.entry):
-      if ws:
-        if (ws_is_id and ws == wsid) or (wsname == ws):
-          yield wsname, wsid
+    with self.recorder.Phase('worksheets'):
+      worksheets = self.client.GetWorksheets(ssid)
+    for (wsname, wsid) in self._filter_name_id(worksheets.entry, ws, ws_is_id):
+      yield wsname, wsid
+
+  def GetWorksheetsAsync(self, ssid, ws=None, ws_is_id=False):
+    """Like GetWorksheets, but return a Future of the list of pairs."""
+    return self.AsyncClient().GetWorksheets(ssid).then(
+        lambda worksheets: list(self._filter_name_id(worksheets.entry, ws, ws_is_id)))
+
+  def GenerateListing(self, ss=None, ss_is_id=False, ws=None, ws_is_id=False):
+    """
+    Return a generator of (name, id, worksheets) for the spreadsheets, where
+    worksheets generates the worksheet (name, id) pairs. The worksheets of
+    all the spreadsheets are fetched concurrently, but generated in order,
+    each spreadsheet as soon as it is known and its worksheets once they
+    arrive.
+    """
+    spreadsheets = list(self.GetSpreadsheets(ss, ss_is_id))
+    futures = [self.GetWorksheetsAsync(ssid, ws, ws_is_id) for (ssname, ssid) in spreadsheets]
+    for ((ssname, ssid), future) in zip(spreadsheets, futures):
+      yield ssname, ssid, self._awaited(future)
+
+  def _awaited(self, future):
+    for pair in future.result():
+      yield pair
+
+  def _filter_name_id(self, entries, name=None, is_id=False):
+    for (ename, eid) in self._gen_name_id(entries):
+      if name:
+        if (is_id and name == eid) or (ename == name):
+          yield ename, eid
       else:
-        yield wsname, wsid
+        yield ename, eid
 
   def _gen_name_id(self, entries):
     for entry in entries:
       yield entry.title.text, entry.id.text.split('/')[-1]
 
-def make_unique(name, name_map):
+  @instrument.timed('resolve')
+  def _ResolveId(self, cache_key, gen_name_id, desc, refresh=False):
+    """
+    Return the id from the first (name, id) pair of gen_name_id(), unless it
+    is found in the cache. Returns a (id, from_cache) pair.
+    """
+    if self.cache and not refresh:
+      cached_id = self.cache.Get(cache_key)
+      if cached_id:
+        return cached_id, True
+    ids = [id for (name, id) in gen_name_id()]
+    if not ids:
+      raise Exception("Couldn't find the %s" % desc)
+    if self.cache:
+      self.cache.Set(cache_key, ids[0])
+    return ids[0], False
+
+  def ResolveSpreadsheetId(self, ssname, refresh=False):
+    """Return the (id, from_cache) pair for the named spreadsheet."""
+    return self._ResolveId(('spreadsheet', ssname),
+                           lambda: self.GetSpreadsheets(ssname),
+                           'spreadsheet: %s' % ssname, refresh)
+
+  def ResolveWorksheetId(self, ssid, wsname, refresh=False):
+    """Return the (id, from_cache) pair for the named worksheet."""
+    return self._ResolveId(('worksheet', ssid, wsname),
+                           lambda: self.GetWorksheets(ssid, wsname),
+                           'worksheet: %s' % wsname, refresh)
+
+  def InvalidateIds(self, ssname=None, ssid=None, wsname=None):
+    """Drop the cached ids for the named spreadsheet and worksheet."""
+    if self.cache:
+      self.cache.Invalidate(('spreadsheet', ssname), ('worksheet', ssid, wsname))
+
+def chunked(iterable, size):
+  """Generate lists of up to size items from the iterable."""
+  it = iter(iterable)
+  while True:
+    chunk = list(itertools.islice(it, size))
+    if not chunk:
+      return
+    yield chunk
+
+def block_cells(rows, first_row_num, first_col_num):
+  """
+  Generate the (row, col, value) cells of the rows placed in a block with
+  the top left cell at first_row_num and first_col_num.
+  """
+  for (row_num, values) in enumerate(rows, first_row_num):
+    for (col_num, value) in enumerate(values, first_col_num):
+      yield (row_num, col_num, value)
+
+def column_tags(names):
+  """
+  Return the list feed tags of the columns with the given header names, for
+  when the list feed has no row to take them from: each name lowercased and
+  stripped of all but letters, digits, dots and dashes, with repeated tags
+  numbered from _2 (see the column tags reference).
+  """
+  tags = []
+  for name in names:
+    tag = base = re.sub(r'[^a-z0-9.-]', '', (name or '').lower())
+    if not tag:
+      raise Exception("Can't determine the column tag of header %r without a data row" % name)
+    num = 1
+    while tag in tags:
+      num += 1
+      tag = '%s_%d' % (base, num)
+    tags.append(tag)
+  return tags
+
+def revalidating(method):
+  """
+  Decorate a SpreadsheetInserter method so that, when the spreadsheet or
+  worksheet id was taken from the cache and turns out to be stale (404), the
+  ids are resolved again and the method retried.
+  """
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    try:
+      return method(self, *args, **kwargs)
+    except Exception, e:
+      import sheets
+      if (not isinstance(e, sheets.RequestError) or e.status != 404 or
+          not self.ids_from_cache):
+        raise
+      self.ReselectWorksheet()
+      return method(self, *args, **kwargs)
+  return wrapper
+
+def prefetched(iterable, depth):
+  """
+  Generate the items of the iterable, while a background thread reads up to
+  depth items ahead.
+  """
+  items = Queue.Queue(maxsize=depth)
+  done = object()
+
+  def produce():
+    try:
+      for item in iterable:
+        items.put((item, None))
+      items.put((done, None))
+    except Exception, e:
+      items.put((done, sys.exc_info()))
+
+  producer = threading.Thread(target=produce)
+  producer.daemon = True
+  producer.start()
+  while True:
+    (item, exc_info) = items.get()
+    if item is done:
+      if exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+      return
+    yield item
+
+def make_unique(name, taken, max_len=None, sffx=1):
   """
-  Make the name unique by appending a numeric prefix and return the new unique name.
-  Also insert an entry into the name_map so that we can track it.
+  Make the name unique by appending the first numeric suffix from sffx that
+  gives a name not in taken, and return the new name along with the suffix.
+  The suffix replaces the end of the name, if needed to stay within max_len.
+  The new name is added to taken.
   """
-  sffx = 1
   while True:
-    tname = name + str(sffx)
-    if tname not in name_map:
+    tname = str(sffx)
+    tname = (max_len and name[:max(max_len - len(tname), 0)] or name) + tname
+    if tname not in taken:
       break
     sffx += 1
-  name_map[tname] = name
-  return tname
+  taken.add(tname)
+  return (tname, sffx)
+
+def build_prefix_trie(names):
+  """
+  Return a compressed trie of the names, with the number of names through
+  each node. A node is [count, {first char: (edge label, child node)}]. The
+  edges are only split where the names diverge, so that a long prefix shared by
+  many names is matched with a single startswith, rather than a char at a time.
+  """
+  root = [len(names), {}]
+  for name in names:
+    node = root
+    i = 0
+    n = len(name)
+    while i < n:
+      edge = node[1].get(name[i])
+      if edge is None:
+        node[1][name[i]] = (name[i:], [1, {}])
+        break
+      (label, child) = edge
+      if name.startswith(label, i):
+        child[0] += 1
+        node = child
+        i += len(label)
+        continue
+      # Split the edge where the name leaves it.
+      k = 1
+      m = min(len(label), n - i)
+      while k < m and label[k] == name[i + k]:
+        k += 1
+      mid = [child[0] + 1, {label[k]: (label[k:], child)}]
+      node[1][name[i]] = (label[:k], mid)
+      if i + k < n:
+        mid[1][name[i + k]] = (name[i + k:], [1, {}])
+      break
+  return root
 
 def shorten(names, max_len=None):
   """
-  Compute shortest unique prefixes and return in the same order.
-  FIXME: Doesn't handle identical items.
+  Compute shortest unique prefixes and return in the same order. The names are
+  first truncated to max_len. A name that is also the start of another one is
+  kept whole. Identical names are numbered in their order, with a suffix from 1
+  that keeps them unique and within max_len.
   """
-  name_map = {}
   if max_len:
-    # Support for 
     names = [name[:max_len] for name in names]
-  else:
-    max_len = len(max(names, key=len))
-  tbp2 = list(names)
-  confl_names = {}
-  prfx_len = 1
-  while prfx_len <= max_len and tbp2:
-    tbp1, tbp2 = tbp2, []
-    confl_prfxes = set()
-    for name in tbp1:
-      prfx = name[:prfx_len]
-      if prfx in name_map:
-        pname = name_map.pop(prfx)
-        if name == pname:
-          cnt = confl_names.get(pname, 0)
-          confl_names[pname] = cnt+1
-        else:
-          tbp2.append(pname)
-          confl_prfxes.add(prfx)
-      if name in confl_names:
-        cnt = confl_names.get(name, 0)
-        confl_names[name] = cnt+1
-      elif prfx in confl_prfxes:
-        tbp2.append(name)
-      else:
-        name_map[prfx] = name
-    prfx_len += 1
-  # Inverse the dictionary
-  name_map = dict((name, prfx) for (prfx, name) in name_map.items())
-  return [name in confl_names and make_unique(name, name_map) or name_map[name]
-          for name
-          in names]
+  root = build_prefix_trie(names)
+  counts = {}
+  prefixes = []
+  for name in names:
+    # There is no branch within an edge, so the prefix ends on the first char
+    # of the edge that no other name goes through.
+    node = root
+    i = 0
+    n = prfx_len = len(name)
+    while i < n:
+      (label, node) = node[1][name[i]]
+      if node[0] == 1:
+        prfx_len = i + 1
+        break
+      i += len(label)
+    prefixes.append(name[:prfx_len])
+    counts[name] = counts.get(name, 0) + 1
+  taken = set(prfx for (name, prfx) in itertools.izip(names, prefixes) if counts[name] == 1)
+  next_sffx = {}
+  result = []
+  for (name, prfx) in itertools.izip(names, prefixes):
+    if counts[name] > 1:
+      (prfx, sffx) = make_unique(name, taken, max_len, next_sffx.get(name, 1))
+      next_sffx[name] = sffx + 1
+    result.append(prfx)
+  return result
 
 class SpreadsheetInserter(LogssAction):
   """A utility to insert rows into a spreadsheet."""
 
-  def __init__(self, debug=False, auth_domain=None):
-    super(SpreadsheetInserter, self).__init__(debug, auth_domain)
+  def __init__(self, debug=False, auth_domain=None, **kwargs):
+    super(SpreadsheetInserter, self).__init__(debug, auth_domain, **kwargs)
     self.key = None
     self.wkey = None
+    self.ss = None
+    self.ws = None
+    self.ids_from_cache = False
+    self.last_header_row_num = 1
+    # Compiled row templates, by column tags.
+    self.entry_templates = {}
     self.col_name_to_key = None
+    # Cell layout, resolved lazily for batch inserts.
+    self.col_tag_to_num = None
+    self.next_row_num = None
+    self.row_count = None
+    # The rows by key, for upserts, and the file it is kept in.
+    self.row_index = None
+    self.row_index_file = None
+
+  def SelectWorksheet(self, ss, ss_is_id=False, ws=None, ws_is_id=False, refresh=False):
+    """
+    Select the spreadsheet and worksheet to insert into, by name or id. The
+    worksheet defaults to the first one.
+    """
+    self.ss = not ss_is_id and ss or None
+    self.ws = not ws_is_id and ws or None
+    ss_from_cache = ws_from_cache = False
+    if ss_is_id:
+      self.key = ss
+    else:
+      (self.key, ss_from_cache) = self.ResolveSpreadsheetId(ss, refresh)
+    if ws and not ws_is_id:
+      (self.wkey, ws_from_cache) = self.ResolveWorksheetId(self.key, ws, refresh)
+    else:
+      self.wkey = ws or 'default'
+    self.ids_from_cache = ss_from_cache or ws_from_cache
+
+  def ReselectWorksheet(self):
+    """Forget the cached ids and resolve the selected worksheet again."""
+    self.InvalidateIds(self.ss, self.key, self.ws)
+    self.SelectWorksheet(self.ss or self.key, not self.ss, self.ws or self.wkey, not self.ws,
+                         refresh=True)
 
   def ColumnNamesHaveData(self, cols):
     """Are these just names, or do they have data (:)?"""
     return len([c for c in cols if ':' in c]) > 0
 
-  def InsertRow(self, data):
-    row_entry = gdata.spreadsheets.data.ListEntry()
+  def MapColumnNames(self, data):
+    """Translate the column names in data to their tags."""
     if self.col_name_to_key:
       data = dict([(self.col_name_to_key[name], value) for (name, value) in data.items()])
-    row_entry.from_dict(data)
-    self.client.add_list_entry(row_entry, self.key, self.wkey)
+    return data
+
+  def MapColumnTags(self, cols):
+    """Return the tags of the named columns, in order."""
+    if not self.col_name_to_key:
+      return list(cols)
+    unknown = [col for col in cols if col not in self.col_name_to_key]
+    if unknown:
+      raise Exception("Unknown columns: %s" % ', '.join(unknown))
+    return [self.col_name_to_key[col] for col in cols]
+
+  def EntryTemplate(self, tags):
+    """Return the list entry template for rows with the given column tags."""
+    tags = tuple(tags)
+    template = self.entry_templates.get(tags)
+    if template is None:
+      template = self.entry_templates[tags] = rowxml.ListEntryTemplate(tags)
+    return template
+
+  def InsertRow(self, data):
+    data = self.MapColumnNames(data)
+    self.InsertValues(data.keys(), data.values())
+
+  @revalidating
+  def InsertValues(self, tags, values):
+    """Insert a row with the values of the columns with the given tags."""
+    xml = self.EntryTemplate(tags).Serialize(values)
+    self.client.AddListEntryXml(xml, self.key, self.wkey)
+
+  @revalidating
+  def InsertEntryXml(self, xml):
+    """Insert a row from its list entry, already serialized."""
+    self.client.AddListEntryXml(xml, self.key, self.wkey)
+
+  @revalidating
+  def ResolveCellLayout(self):
+    """
+    Find the column number of each column tag and the first free row below
+    the data, which are needed to write rows through the cells feed.
+    """
+    header_cells = self.client.GetCellsFeed(self.key, wksht_id=self.wkey, max_row=1)
+    list_feed = self.client.GetListFeed(self.key, wksht_id=self.wkey, max_results=1)
+    if not header_cells.entry:
+      raise Exception("Header row 1 is empty")
+    # The list feed has one tag for every non-empty header cell, in order, but
+    # only once there is a data row to take them from.
+    coltags = (list_feed.ColumnTags() or
+               column_tags([e.content.text for e in header_cells.entry]))
+    col_nums = [int(e.cell.col) for e in header_cells.entry]
+    self.col_tag_to_num = dict(zip(coltags, col_nums))
+    self.row_count = int(header_cells.row_count.text)
+    self.next_row_num = self.FindFreeRow(list_feed)
+
+  def FindFreeRow(self, list_feed):
+    """
+    Return the number of the row below the last one with a value. The list
+    feed counts every row after the header up to the first blank one, but
+    rows may follow that (e.g. when a batch written into reserved rows
+    failed), so the cells from there on are checked as well.
+    """
+    first_blank_row_num = int(list_feed.total_results.text) + 2
+    row_nums = self.client.GetCellsFeed(
+        self.key, wksht_id=self.wkey, min_row=first_blank_row_num,
+        converter=lambda response: rowxml.cell_rows(response.read()))
+    return row_nums and max(row_nums) + 1 or first_blank_row_num
+
+  def GrowWorksheet(self, min_row_count):
+    """Add rows to the worksheet so that it has at least min_row_count rows."""
+    worksheet = self.client.GetWorksheet(self.key, self.wkey)
+    self.ResizeWorksheet(worksheet, min_row_count)
+    self.row_count = min_row_count
+
+  def ResizeWorksheet(self, worksheet, row_count, col_count=None):
+    """Set the size of the worksheet entry, and return the updated entry."""
+    worksheet.row_count.text = str(row_count)
+    if col_count is not None:
+      worksheet.col_count.text = str(col_count)
+    return self.client.update(worksheet)
+
+  def ReserveRows(self, num_rows):
+    """
+    Claim the next num_rows free rows of the worksheet, growing it if needed,
+    and return the number of the first one.
+    """
+    if self.col_tag_to_num is None:
+      self.ResolveCellLayout()
+    first_row_num = self.next_row_num
+    last_row_num = first_row_num + num_rows - 1
+    if last_row_num > self.row_count:
+      self.GrowWorksheet(last_row_num)
+    self.next_row_num = last_row_num + 1
+    return first_row_num
+
+  def RenewReservation(self, first_row_num, num_rows):
+    """
+    Resolve the cell layout again, e.g. after a write into reserved rows
+    failed, but keep the num_rows rows from first_row_num reserved, so that
+    the write can be retried into the same rows rather than duplicate what
+    part of it went through. Returns the first reserved row, which is only
+    different if the worksheet was resolved anew.
+    """
+    worksheet = (self.key, self.wkey)
+    self.ResolveCellLayout()
+    if (self.key, self.wkey) != worksheet:
+      return self.ReserveRows(num_rows)
+    last_row_num = first_row_num + num_rows - 1
+    if last_row_num > self.row_count:
+      self.GrowWorksheet(last_row_num)
+    self.next_row_num = max(self.next_row_num, last_row_num + 1)
+    return first_row_num
+
+  def WriteRows(self, first_row_num, rows):
+    """
+    Write the rows (a list of column to value dicts) to consecutive worksheet
+    rows starting at first_row_num, with a single batch request.
+    """
+    cells = []
+    for (row_num, data) in enumerate(rows, first_row_num):
+      for (tag, value) in self.MapColumnNames(data).items():
+        if tag not in self.col_tag_to_num:
+          raise Exception("Unknown column tag: %s" % tag)
+        cells.append((row_num, self.col_tag_to_num[tag], value))
+    self.client.BatchSetCells(self.key, self.wkey, cells)
+
+  def WriteTuples(self, first_row_num, tags, rows):
+    """
+    Like WriteRows, but for rows given as tuples of values of the columns
+    with the given tags.
+    """
+    unknown = [tag for tag in tags if tag not in self.col_tag_to_num]
+    if unknown:
+      raise Exception("Unknown column tags: %s" % ', '.join(unknown))
+    col_nums = [self.col_tag_to_num[tag] for tag in tags]
+    cells = [(row_num, col_num, value)
+             for (row_num, values) in enumerate(rows, first_row_num)
+             for (col_num, value) in zip(col_nums, values)]
+    self.client.BatchSetCells(self.key, self.wkey, cells)
+
+  def InsertRows(self, rows):
+    """
+    Insert the rows (a list of column to value dicts) in order with a single
+    batch request, and return the number of rows committed.
+    """
+    if not rows:
+      return 0
+    self.WriteRows(self.ReserveRows(len(rows)), rows)
+    return len(rows)
+
+  def InsertTuples(self, tags, rows):
+    """Like InsertRows, but for rows given as tuples of values."""
+    if not rows:
+      return 0
+    self.WriteTuples(self.ReserveRows(len(rows)), tags, rows)
+    return len(rows)
+
+  def InsertConcurrently(self, rows, workers, batch_size=1, verbose=False, tags=None):
+    """
+    Insert the rows using a pool of worker threads, each writing a batch at a
+    time. The worksheet rows are reserved on the calling thread while reading,
+    so the rows keep the input order no matter which write finishes first.
+    The rows are tuples of values of the columns with the given tags, or
+    column to value dicts if no tags are given.
+    Returns the (first, last) input line numbers of the batches that failed.
+    """
+    if tags is None:
+      write = self.WriteRows
+    else:
+      write = lambda first_row_num, batch: self.WriteTuples(first_row_num, tags, batch)
+    # Bounded, so that reading can't run too far ahead of the writers.
+    tasks = Queue.Queue(maxsize=workers * 2)
+    failed = []
+    lock = threading.Lock()
+
+    def work():
+      while True:
+        task = tasks.get()
+        if task is None:
+          return
+        (first_line, row_num, batch) = task
+        last_line = first_line + len(batch) - 1
+        try:
+          write(row_num, batch)
+        except Exception, e:
+          with lock:
+            failed.append((first_line, last_line))
+            print >> sys.stderr, 'Failed to insert lines %d-%d: %s' % (first_line, last_line, e)
+        else:
+          if batch_size > 1 or verbose:
+            with lock:
+              print >> sys.stderr, 'Lines %d-%d: committed %d rows' % (first_line, last_line, len(batch))
+
+    threads = [threading.Thread(target=work) for i in xrange(workers)]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    try:
+      first_line = 1
+      for batch in chunked(rows, batch_size):
+        tasks.put((first_line, self.ReserveRows(len(batch)), batch))
+        first_line += len(batch)
+    finally:
+      for thread in threads:
+        tasks.put(None)
+      for thread in threads:
+        thread.join()
+    return sorted(failed)
+
+  @revalidating
+  def GetBlockLayout(self, append):
+    """
+    Return the worksheet entry, and the first free row below the data if
+    appending, or None.
+    """
+    worksheet = self.client.GetWorksheet(self.key, self.wkey)
+    if not append:
+      return (worksheet, None)
+    list_feed = self.client.GetListFeed(self.key, wksht_id=self.wkey, max_results=1)
+    return (worksheet, self.FindFreeRow(list_feed))
+
+  def WriteBlock(self, rows, first_row_num=None, first_col_num=1, cells_per_request=2000,
+                 workers=1):
+    """
+    Write the rows (sequences of values) to a rectangular block of cells by
+    position, with the top left one at first_row_num and first_col_num, or
+    below the data if first_row_num is None. The cells are written with batch
+    requests of up to cells_per_request cells, however wide the rows, using
+    the given number of worker threads. Short rows leave the rest of their
+    cells as they are. The worksheet is grown as needed, by more rows than
+    needed at a time, and trimmed back at the end.
+    Returns the first and last row numbers and the number of cells written.
+    """
+    (worksheet, free_row_num) = self.GetBlockLayout(first_row_num is None)
+    if first_row_num is None:
+      first_row_num = free_row_num
+    row_count = orig_row_count = int(worksheet.row_count.text)
+    col_count = int(worksheet.col_count.text)
+    errors = []
+    lock = threading.Lock()
+
+    def write(cells):
+      self.client.BatchSetCells(self.key, self.wkey, cells)
+      with lock:
+        print >> sys.stderr, 'Rows %d-%d: committed %d cells' % (cells[0][0], cells[-1][0], len(cells))
+
+    def work():
+      while True:
+        cells = tasks.get()
+        if cells is None:
+          return
+        try:
+          # Skip the rest once a write failed.
+          if not errors:
+            write(cells)
+        except Exception, e:
+          errors.append(e)
+
+    if workers > 1:
+      # Bounded, so that reading can't run too far ahead of the writers.
+      tasks = Queue.Queue(maxsize=workers * 2)
+      threads = [threading.Thread(target=work) for i in xrange(workers)]
+      for thread in threads:
+        thread.daemon = True
+        thread.start()
+      submit = tasks.put
+    else:
+      threads = []
+      submit = write
+    num_cells = 0
+    last_row_num = first_row_num - 1
+    try:
+      for cells in chunked(block_cells(rows, first_row_num, first_col_num), cells_per_request):
+        if errors:
+          break
+        max_row_num = cells[-1][0]
+        max_col_num = max(col_num for (row_num, col_num, value) in cells)
+        if max_row_num > row_count or max_col_num > col_count:
+          # Add as many rows again as are written so far, so that a tall block
+          # takes few resizes.
+          row_count = max(row_count, 2 * max_row_num - first_row_num)
+          col_count = max(col_count, max_col_num)
+          worksheet = self.ResizeWorksheet(worksheet, row_count, col_count)
+        submit(cells)
+        num_cells += len(cells)
+        last_row_num = max_row_num
+    finally:
+      for thread in threads:
+        tasks.put(None)
+      for thread in threads:
+        thread.join()
+    if errors:
+      raise errors[0]
+    if row_count > max(orig_row_count, last_row_num):
+      self.ResizeWorksheet(worksheet, max(orig_row_count, last_row_num), col_count)
+    return (first_row_num, last_row_num, num_cells)
+
+  def _GenerateListEntries(self, page_size=500, prefetch=2):
+    """
+    Generate the id, edit link and (tag, value) of the columns of each row,
+    while fetching pages ahead.
+    """
+    def pages():
+      parse = lambda response: rowxml.parse_list_feed(response.read())
+      start_index = 1
+      while True:
+        entries = self.client.GetListFeed(self.key, wksht_id=self.wkey, start_index=start_index,
+                                          max_results=page_size, converter=parse)[2]
+        yield entries
+        if len(entries) < page_size:
+          return
+        start_index += page_size
+    for entries in prefetched(pages(), prefetch):
+      for entry in entries:
+        yield entry
+
+  @instrument.timed('index')
+  @revalidating
+  def LoadRowIndex(self, key_col, page_size=500, refresh=False):
+    """
+    Index the rows by the value of the key column, to upsert into. The index
+    saved by an earlier run is reused if the worksheet is as that run left it,
+    and otherwise built from all the rows again, as the entry ids it keeps are
+    those of the positions of the rows, which any insert or removal shifts.
+    """
+    import rowindex
+    key_tag = self.MapColumnTags([key_col])[0]
+    if self.cache:
+      self.row_index_file = '%s.%s.%s.%s.idx' % (os.path.splitext(self.cache.cache_file)[0],
+                                                 self.key, self.wkey, key_tag)
+    parse = lambda response: rowxml.parse_list_feed(response.read())
+    (total, updated, entries) = self.client.GetListFeed(self.key, wksht_id=self.wkey, max_results=1,
+                                                        converter=parse)
+    tags = entries and [tag for (tag, value) in entries[0][2]] or None
+    index = None
+    if self.row_index_file and not refresh:
+      index = rowindex.RowIndex.Load(self.row_index_file)
+    if index is not None and (index.key_tag != key_tag or (tags and index.tags != tags)):
+      index = None
+    if index is not None and (index.updated != updated or len(index) != total):
+      index = None
+    if index is None:
+      index = rowindex.RowIndex(key_tag, tags)
+      for entry in self._GenerateListEntries(page_size):
+        index.Add(*entry)
+    index.updated = updated
+    self.row_index = index
+
+  def SaveRowIndex(self):
+    if self.row_index_file and self.row_index is not None:
+      self.row_index.Save(self.row_index_file)
+
+  def UpsertValues(self, tags, values):
+    """
+    Update the row with the same key as the values of the columns with the
+    given tags, or insert one if there is none, using the row index. Returns
+    'inserted', 'updated', or 'unchanged' if the row already has the values.
+    """
+    import sheets
+    index = self.row_index
+    data = dict(zip(tags, values))
+    key = data.get(index.key_tag)
+    parse = lambda response: rowxml.parse_list_entry(response.read())
+
+    def written(entry):
+      # The worksheet was last updated by this row, as far as the index knows.
+      (entry_id, edit_url, row_values, index.updated) = entry
+      index.Add(entry_id, edit_url, row_values)
+
+    for attempt in (1, 2):
+      match = key and index.Lookup(key)
+      if not match:
+        xml = self.EntryTemplate(tags).Serialize(values)
+        written(self.client.AddListEntryXml(xml, self.key, self.wkey, converter=parse))
+        return 'inserted'
+      (entry_id, edit_url, current) = match
+      if not [tag for (tag, value) in data.items() if current.get(tag, '') != value]:
+        return 'unchanged'
+      # The update replaces the whole row, so keep the values of the other columns.
+      current.update(data)
+      xml = self.EntryTemplate(index.tags).Serialize([current[tag] for tag in index.tags], entry_id)
+      try:
+        written(self.client.UpdateListEntryXml(xml, edit_url, converter=parse))
+        return 'updated'
+      except sheets.RequestError, e:
+        if e.status not in (404, 409) or attempt > 1:
+          raise
+      # The row was changed or removed since it was indexed.
+      index.Remove(entry_id)
+      try:
+        index.Add(*self.client.request(method='GET', uri=entry_id, converter=parse)[:3])
+      except sheets.RequestError, e:
+        if e.status != 404:
+          raise
+
+  def UpsertRows(self, cols, rows, key_col, page_size=500, refresh=False):
+    """
+    Upsert the rows, tuples of values of the named columns, by the value of
+    the key column (see UpsertValues). Returns the counts of the rows by
+    what was done with them.
+    """
+    if key_col not in cols:
+      raise Exception("The key column %s is not one of the columns given" % key_col)
+    tags = self.MapColumnTags(cols)
+    self.LoadRowIndex(key_col, page_size, refresh)
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    try:
+      for vals in rows:
+        counts[self.UpsertValues(tags, vals)] += 1
+    finally:
+      self.SaveRowIndex()
+    return counts
 
   def InsertFromColumns(self, cols):
     # Data is mixed into column names.
     data = dict(c.split(':', 1) for c in cols)
     self.InsertRow(data)
 
-  def InsertFromFileHandle(self, cols, fh, csvformat=False, verbose=False):
+  def ReadTuples(self, cols, fh, csvformat=False, verbose=False, delimiter=None, quoting=True):
+    """
+    Generate a tuple of values for each line in fh, which is either a file or
+    any other iterable of lines. The values are delimited by whitespace, or
+    by the delimiter (a comma with csvformat), optionally quoted.
+    """
+    if csvformat and not delimiter:
+      delimiter = ','
+    reader = rowreader.RowReader(cols, delimiter, quoting)
+    if hasattr(fh, 'read'):
+      rows = reader.Read(fh)
+    else:
+      rows = reader.ParseLines(fh)
+    if not verbose:
+      return rows
+    return self._EchoRows(rows)
+
+  def _EchoRows(self, rows):
+    for vals in rows:
+      print >> sys.stderr, 'Inserting row: ' + str(list(vals))
+      yield vals
+
+  def ReadRows(self, cols, fh, csvformat=False, verbose=False, delimiter=None, quoting=True):
+    """Generate a column to value dict for each line in fh."""
+    for vals in self.ReadTuples(cols, fh, csvformat, verbose, delimiter, quoting):
+      yield dict(zip(cols, vals))
+
+  def InsertFromFileHandle(self, cols, fh, csvformat=False, verbose=False, batch_size=None,
+                           workers=None, delimiter=None, quoting=True):
+    """
+    Insert a row for each line in fh. Returns the (first, last) line numbers
+    of the lines that could not be inserted, which can only be non-empty when
+    using workers, as otherwise the first failure is raised.
+    """
     if verbose:
       print >> sys.stderr, 'Columns selected: ' + str(cols)
-    if csvformat:
-        fh = csv.reader(fh)
-    for line in fh:
-      if csvformat:
-          vals = line
-      else:
-          vals = line.rstrip().split(None, len(cols) - 1)
-      data = dict(zip(cols, vals))
-      if verbose:
-        print >> sys.stderr, 'Inserting row: ' + str(vals)
-      self.InsertRow(data)
+    rows = self.ReadTuples(cols, fh, csvformat, verbose, delimiter, quoting)
+    return self.InsertTupleStream(cols, rows, batch_size, workers, verbose)
 
+  def InsertTupleStream(self, cols, rows, batch_size=None, workers=None, verbose=False):
+    """
+    Insert the rows, tuples of values of the named columns, as they are
+    generated. Returns the (first, last) numbers of the rows that could not be
+    inserted, as InsertFromFileHandle does.
+    """
+    # Resolve the tags once, rather than for every row.
+    tags = self.MapColumnTags(cols)
+    if workers and workers > 1:
+      return self.InsertConcurrently(rows, workers, batch_size or 1, verbose=verbose, tags=tags)
+    if batch_size and batch_size > 1:
+      total = 0
+      for (batch_num, batch) in enumerate(chunked(rows, batch_size), 1):
+        committed = self.InsertTuples(tags, batch)
+        total += committed
+        print >> sys.stderr, 'Batch %d: committed %d rows (%d so far)' % (batch_num, committed, total)
+    else:
+      for vals in rows:
+        self.InsertValues(tags, vals)
+    return []
+
+  def InsertSpooled(self, cols, fh, spool, csvformat=False, verbose=False, batch_size=None,
+                    resume=False, delimiter=None, quoting=True):
+    """
+    Insert a row for each line in fh, journaling the lines in the spool first
+    and recording the count of those committed after each batch. When
+    resuming, the uncommitted lines in the spool are inserted first, and the
+    lines of fh that are already in the spool are skipped, so the same input
+    can be given again. The spool is removed once all the lines are committed.
+    """
+    if resume:
+      spool.DropPartialLine()
+      committed = spool.ReadCommitted()
+      journaled = spool.CountLines()
+    else:
+      if spool.CountLines() > spool.ReadCommitted():
+        raise Exception("The spool %s has uncommitted lines, resume or remove it first" %
+                        spool.spool_file)
+      spool.Remove()
+      committed = journaled = 0
+    if verbose:
+      print >> sys.stderr, 'Columns selected: ' + str(cols)
+      if resume:
+        print >> sys.stderr, 'Resuming after line %d of %d spooled lines' % (committed, journaled)
+    chunk_size = batch_size or 1
+    tags = self.MapColumnTags(cols)
+    if csvformat and not delimiter:
+      delimiter = ','
+    reader = rowreader.RowReader(cols, delimiter, quoting)
+
+    def chunks(lines):
+      # Whole records, so that the counts stay on record boundaries.
+      for records in chunked(reader.Records(lines), chunk_size):
+        yield list(itertools.chain.from_iterable(records))
+
+    def insert(lines):
+      rows = list(self.ReadTuples(cols, lines, csvformat, verbose, delimiter, quoting))
+      if chunk_size > 1:
+        self.InsertTuples(tags, rows)
+      else:
+        for vals in rows:
+          self.InsertValues(tags, vals)
+      spool.WriteCommitted(committed + len(lines))
+      return (committed + len(lines), len(rows))
+
+    for lines in chunks(spool.ReadLines(committed)):
+      (committed, num_rows) = insert(lines)
+    if fh is not None:
+      for lines in chunks(itertools.islice(fh, journaled, None)):
+        spool.Append(lines)
+        (committed, num_rows) = insert(lines)
+        if chunk_size > 1:
+          print >> sys.stderr, 'Committed %d rows (%d lines so far)' % (num_rows, committed)
+    spool.Remove()
+
+  @revalidating
   def ListColumns(self):
     """
     Return tuples containing the column name and the tags.
@@ -363,6 +1196,58 @@ class SpreadsheetInserter(LogssAction):
       cols = zip(coltags, coltags)
     return sorted(cols)
 
+  def GenerateListPages(self, start_index=1, page_size=500):
+    """Generate the pages of the list feed, from the entry at start_index."""
+    while True:
+      page = self.client.GetListFeed(self.key, wksht_id=self.wkey, start_index=start_index,
+                                     max_results=page_size)
+      if page.entry:
+        yield page
+      if len(page.entry) < page_size:
+        return
+      start_index += page_size
+
+  def GenerateRows(self, page_size=500, prefetch=2):
+    """
+    Generate the column names followed by the values of every row below the
+    header rows, as lists. While the rows of a page are consumed, up to
+    prefetch more pages are fetched in the background.
+    """
+    # List feed entry n is row n+1, so this starts right after the headers.
+    pages = prefetched(self.GenerateListPages(self.last_header_row_num, page_size), prefetch)
+    coltags = None
+    for page in pages:
+      for entry in page.entry:
+        values = dict(zip(entry.ColumnTags(), entry.RowValues()))
+        if coltags is None:
+          coltags = entry.ColumnTags()
+          tag_to_name = dict((tag, name) for (name, tag) in (self.col_name_to_key or {}).items())
+          yield [tag_to_name.get(tag, tag) for tag in coltags]
+        yield [values.get(tag) for tag in coltags]
+
+  @revalidating
+  def StartRows(self, page_size=500):
+    """
+    Return the first row that GenerateRows generates, or None, and the
+    generator of the rest. The ids are revalidated only up to this point, as
+    past it a retry would generate the rows from the start again.
+    """
+    rows = self.GenerateRows(page_size)
+    return (next(rows, None), rows)
+
+  def DumpRows(self, fh, csvformat=False, page_size=500):
+    """Write the rows to fh as CSV, or else tab separated values."""
+    import csv
+    if csvformat:
+      writer = csv.writer(fh)
+    else:
+      writer = csv.writer(fh, delimiter='\t', lineterminator='\n')
+    (first_row, rows) = self.StartRows(page_size)
+    if first_row is None:
+      return
+    for row in itertools.chain([first_row], rows):
+      writer.writerow([isinstance(v, unicode) and v.encode('utf-8') or v for v in row])
+
   def expand_col_names(self, col_cells, shortenColumnNames=False, maxLen=None):
     def gen_col_names(col_names):
       last_seen_col = None
@@ -394,7 +1279,46 @@ class SpreadsheetInserter(LogssAction):
     # actual range. But this is not a problem as it would extended.
     return list(gen_col_names(known_col_names))
 
-  def SetColumnHeaderRowNums(self, startHeaderRowNum, endHeaderRowNum=None, shortenColumnNames=False, maxLen=None):
+  def HeaderFingerprint(self, lastHeaderRowNum):
+    """
+    Return the (row, col, value) of all the cells up to the last header row,
+    which determine both the column tags and the header names.
+    """
+    cells = self.client.GetCellsFeed(self.key, wksht_id=self.wkey, max_row=lastHeaderRowNum)
+    return [(e.cell.row, e.cell.col, e.content.text) for e in cells.entry]
+
+  @instrument.timed('headers')
+  @revalidating
+  def SetColumnHeaderRowNums(self, startHeaderRowNum, endHeaderRowNum=None, shortenColumnNames=False, maxLen=None,
+                             refresh=False):
+    """
+    Map the qualified column names in the header rows to their tags. With a
+    cache, a map computed by an earlier run is reused as is until it expires,
+    and after that for as long as the header cells remain unchanged. The
+    worksheet's own timestamp or etag can't be used for this, as they change
+    with every inserted row.
+    """
+    self.last_header_row_num = endHeaderRowNum or startHeaderRowNum
+    if not self.cache:
+      self.col_name_to_key = self.ComputeColumnNameToKey(startHeaderRowNum, endHeaderRowNum,
+                                                         shortenColumnNames, maxLen)
+      return
+    cache_key = ('headers', self.key, self.wkey, startHeaderRowNum, endHeaderRowNum,
+                 shortenColumnNames, maxLen)
+    cached = not refresh and self.cache.Get(cache_key, max_age=sys.maxint)
+    if cached and self.cache.Get(cache_key):
+      self.col_name_to_key = cached[1]
+      return
+    fingerprint = self.HeaderFingerprint(endHeaderRowNum or startHeaderRowNum)
+    if cached and cached[0] == fingerprint:
+      self.col_name_to_key = cached[1]
+    else:
+      self.col_name_to_key = self.ComputeColumnNameToKey(startHeaderRowNum, endHeaderRowNum,
+                                                         shortenColumnNames, maxLen)
+    self.cache.Set(cache_key, (fingerprint, self.col_name_to_key))
+
+  def ComputeColumnNameToKey(self, startHeaderRowNum, endHeaderRowNum=None, shortenColumnNames=False,
+                             maxLen=None):
     header_rows = []
     coltags = None
     # Special case for first row, we need to use cells feed to get to it.
@@ -429,7 +1353,7 @@ class SpreadsheetInserter(LogssAction):
       header_rows = [header_row + header_row[-1:] * (max_header_len - len(header_row))
                      for header_row in header_rows]
     qual_col_names = ['.'.join([h for h in header_path if h]) for header_path in zip(*header_rows)]
-    self.col_name_to_key = dict(zip(qual_col_names, coltags))
+    return dict(zip(qual_col_names, coltags))
 
 def alt_header_nums(option, opt_str, value, parser):
   num_range = value.strip().split('-')
@@ -445,6 +1369,23 @@ def alt_header_nums(option, opt_str, value, parser):
     raise optparse.OptionValueError('%s only accepts a number or a single range of row numbers: e.g., 2 or 2-3' %
                                     option.get_opt_string())
 
+def cell_ref(option, opt_str, value, parser):
+  """
+  Parse a cell in A1 notation into its (row, col) numbers, with the row None
+  if only the column is given.
+  """
+  ref = value.strip().upper()
+  letters = ref.rstrip('0123456789')
+  digits = ref[len(letters):]
+  if not letters or not letters.isalpha() or digits.startswith('0'):
+    raise optparse.OptionValueError('%s only accepts a cell or a column in A1 notation: e.g., C10 or C' %
+                                    option.get_opt_string())
+  col = 0
+  for letter in letters:
+    col = col * 26 + ord(letter) - ord('A') + 1
+  setattr(parser.values, option.dest, (digits and int(digits) or None, col))
+  parser.values.block = True
+
 class BetterDescOptionParser(optparse.OptionParser):
     """
     Format description without loosing the paragraphs.
@@ -469,8 +1410,8 @@ def DefineFlags():
         One row will be added for each invocation of this program.
 
         If you just specify column tags (without a value), then data will be read
-        from stdin in whitespace (or comma, if -c option is used) delimited form,
-        and mapped to each column in order.
+        from stdin in whitespace (or comma, if -c option is used, or tab, if -t
+        option is used) delimited form, and mapped to each column in order.
       """)
   parser = BetterDescOptionParser(usage=usage, description=desc)
   parser.add_option('--debug', dest='debug', action='store_true',
@@ -481,14 +1422,22 @@ def DefineFlags():
                     help='Specify an apps domain for authentication')
   parser.add_option('--csvformat', '-c', dest='csvformat', action='store_true',
                     help='Specifies that the stdin is in CSV format')
+  parser.add_option('--tsv', '-t', dest='tsv', action='store_true',
+                    help='Specifies that the stdin is in tab separated format')
+  parser.add_option('--delimiter', dest='delimiter',
+                    help='Specifies the character that separates the values on stdin')
+  parser.add_option('--no-quoting', dest='noQuoting', action='store_true',
+                    help='Split the values on stdin at every delimiter, instead of allowing them to be quoted as in CSV')
   parser.add_option('--key', '-k', dest='ssid',
                     help='The key of the spreadsheet to update')
-  parser.add_option('--sheetid', '-i', dest='wsid',
-                    help='The key of the worksheet to update')
+  parser.add_option('--sheetid', '-i', dest='wsid', action='append',
+                    help='The key of the worksheet to update. Can be given more than once, to insert the same rows into each, but not along with --sheet.')
   parser.add_option('--name', '-n', dest='ssname',
                     help='The name of the spreadsheet to update or list')
-  parser.add_option('--sheet', '-w', dest='wsname',
-                    help='The name of the worksheet to update (defaults to the first one)')
+  parser.add_option('--sheet', '-w', dest='wsname', action='append',
+                    help='The name of the worksheet to update (defaults to the first one). Can be given more than once, to insert the same rows into each, concurrently, but not along with --sheetid.')
+  parser.add_option('--buffer-rows', dest='bufferRows', type='int', default=1000,
+                    help='With more than one --sheet or --sheetid, the max number of rows to hold for a worksheet that is behind the others, before reading stops to wait for it.')
   parser.add_option('--list', '-l', dest='listkeys', action='store_true',
                     help='Lists the id of the specified sheet (by --name and --sheet) or all sheets in the specified spreadsheet (by --name) or all availale sheets')
   parser.add_option('--alt-header', '-a', dest='headerRowNums',
@@ -500,59 +1449,480 @@ def DefineFlags():
                     help='Shorten the names of the headers so that it is easier to type. This also has the benefit of making sure they are unique.'),
   parser.add_option('--max-header-len', '-m', dest='maxHeaderLen', type='int', default=3,
                     help='When using -s option, specify the max length or 0 to disable length restriction.'),
+  parser.add_option('--input', dest='input', metavar='FILE',
+                    help='Read the rows from this file instead of stdin.')
+  parser.add_option('--processes', dest='processes', type='int',
+                    help='With --input, parse the lines and serialize the rows in this many processes, while the main one uploads them. Every line must be a row, i.e. quoted values can\'t span lines.')
+  parser.add_option('--batch-size', '-b', dest='batchSize', type='int',
+                    help='When reading rows from stdin, write them in batches of this many rows through the cells feed, instead of one request per row.')
+  parser.add_option('--workers', '-j', dest='workers', type='int',
+                    help='When reading rows from stdin, write them using this many concurrent requests. The rows still appear in the input order.')
+  parser.add_option('--block', dest='block', action='store_true',
+                    help='Write the values read from stdin to a block of cells by position, a row per line, instead of to named columns. The block is appended below the data, from the first column unless --block-at is given. This needs no header, so also suits sheets wider than theirs.')
+  parser.add_option('--block-at', dest='blockAt', metavar='CELL',
+                    type='string',
+                    action='callback',
+                    callback=cell_ref,
+                    help='Write the --block with its top left cell at this cell, e.g. C10, overwriting what is there, or append it from this column, e.g. C.')
+  parser.add_option('--cells-per-request', dest='cellsPerRequest', type='int', default=2000,
+                    help='With --block, the max number of cells to write with each batch request.')
+  parser.add_option('--key-column', dest='keyColumn', metavar='COLUMN',
+                    help='Update the row with the same value in this column, instead of inserting a duplicate, and skip the rows that are unchanged. The rows are indexed by this column, and the index kept next to the cache, for later runs to reuse until something else changes the sheet.')
+  parser.add_option('--window', dest='window', type='float', metavar='SECONDS',
+                    help='Insert a summary row for each window of this many seconds of the rows read from stdin, with the --aggregate columns, instead of every row. The summary rows have the time column (the start of the window), the --group-by columns and the --aggregate columns.')
+  parser.add_option('--aggregate', dest='aggregates', action='append', metavar='NAME=FUNC(COLUMN)',
+                    help='With --window, a column of the summary rows, e.g. cpu=avg(cpu) or n=count(). FUNC is one of count, sum, min, max, avg or pNN for a percentile, e.g. p95, of the numeric values of COLUMN. Can be given more than once.')
+  parser.add_option('--time-column', dest='timeColumn', metavar='COLUMN',
+                    help='With --window, the column with the time of the rows, as seconds since the epoch or as an ISO 8601 UTC time (defaults to the first column).')
+  parser.add_option('--group-by', dest='groupBy', action='append', metavar='COLUMN',
+                    help='With --window, summarize the rows with different values in this column separately. Can be given more than once.')
+  parser.add_option('--window-lateness', dest='windowLateness', type='float', default=0,
+                    help='With --window, how many seconds to wait for rows that are out of order, past the end of a window, before inserting its summary. Rows later than that are dropped.')
+  parser.add_option('--column-type', dest='columnTypes', action='append', metavar='NAME=TYPE[:FORMAT]',
+                    help='Convert the values of the column read from stdin to this type, one of int, float, date, datetime or bool, e.g. n=int, day=date:%d/%m/%Y. The FORMAT is what int and float values are written with (e.g. %.2f), what date and datetime values are read with (ISO 8601 by default), or the TRUE/FALSE words of bool values. Rows with values that don\'t convert are left out. Can be given more than once.')
+  parser.add_option('--rejects', dest='rejects', metavar='FILE',
+                    help='With --column-type, append the rows that are left out to this file, in the input format, instead of reporting each of them.')
+  parser.add_option('--cache-ttl', dest='cacheTtl', type='int', default=3600,
+                    help='How long (in seconds) to cache the spreadsheet and worksheet ids resolved from their names, and the column names read from the header rows, or 0 to disable the cache.')
+  parser.add_option('--refresh-cache', dest='refreshCache', action='store_true',
+                    help='Resolve the spreadsheet, worksheet and column names again, instead of using the cached ones.')
+  parser.add_option('--serve', dest='serve', metavar='ADDRESS',
+                    help='Keep running and insert the rows received on this unix socket path or [host:]port, given in the same format as stdin, in batches. The host must be this one, e.g. localhost (the default).')
+  parser.add_option('--flush-interval', dest='flushInterval', type='float', default=1.0,
+                    help='When using --serve or --follow, the max number of seconds to hold rows before inserting them.')
+  parser.add_option('--follow', dest='follow', metavar='FILE',
+                    help='Keep running and insert the lines appended to this file, as tail -F would output them, in batches (see --batch-size and --flush-interval). The position after the last line inserted is recorded, so that a restarted run continues from there, also after the file was rotated to a name starting with its own. The first run starts at the end of the file.')
+  parser.add_option('--follow-state', dest='followState', metavar='FILE',
+                    help='With --follow, record the position in this file, instead of one next to the token file named after the followed file.')
+  parser.add_option('--pool-size', dest='poolSize', type='int', default=4,
+                    help='The max number of idle HTTP connections to keep open for reuse.')
+  parser.add_option('--idle-timeout', dest='idleTimeout', type='float', default=60,
+                    help='The number of seconds to keep an idle HTTP connection open for reuse.')
+  parser.add_option('--dump', dest='dump', action='store_true',
+                    help='Write the rows of the sheet to stdout as tab separated values (or CSV, if -c option is used).')
+  parser.add_option('--page-size', dest='pageSize', type='int', default=500,
+                    help='When using --dump or --key-column, the number of rows to fetch with each request.')
+  parser.add_option('--concurrency', dest='concurrency', type='int', default=8,
+                    help='With --list, the max number of spreadsheets to fetch the worksheets of at a time.')
+  parser.add_option('--format', dest='format', type='choice', choices=['text', 'json'], default='text',
+                    help='The output format of --list: text (the default) or json.')
+  parser.add_option('--spool', dest='spool', metavar='FILE',
+                    help='When reading rows from stdin, journal them in this file and record which are committed, so that the load can be resumed if interrupted.')
+  parser.add_option('--resume', dest='resume', action='store_true',
+                    help='With --spool, first insert the rows in the spool that were not committed, then continue with the rows on stdin that are not in the spool yet.')
+  parser.add_option('--max-rate', dest='maxRate', type='float',
+                    help='The max number of requests to make per second. The rate is lowered automatically while the server responds that it is over quota.')
+  parser.add_option('--max-retries', dest='maxRetries', type='int', default=5,
+                    help='The number of times to retry a request that the server rejected for being over quota or unavailable.')
+  parser.add_option('--timings', dest='timings', action='store_true',
+                    help='At exit, print a summary of where the time went (auth, name resolution, feed reads, inserts and the requests under them) to stderr.')
+  parser.add_option('--timings-log', dest='timingsLog', metavar='FILE',
+                    help='Append a JSON line for every timed phase and request, and the summary at exit, to this file.')
+  parser.add_option('--profile', dest='profile', metavar='FILE',
+                    help='Profile the run with cProfile and write the stats to this file, for use with pstats. Only the main thread is profiled.')
+  parser.add_option('--print-startup-profile', dest='printStartupProfile', action='store_true',
+                    help='At exit, print how long the imports took, and when the run got to each of its steps, to stderr.')
+  # For the benchmarks only, to send the requests to a local fake of the
+  # feeds. Hidden, and limited to this host, as the requests carry the token.
+  parser.add_option('--endpoint', dest='endpoint', metavar='URL', help=optparse.SUPPRESS_HELP)
   return parser
 
+def is_loopback(url):
+  """Is the host of the scheme://host:port url this one?"""
+  import urlparse
+  return is_loopback_host(urlparse.urlsplit(url).hostname or '')
+
+def is_loopback_host(host):
+  return host in ('localhost', '::1') or re.match(r'127(\.\d{1,3}){3}$', host) is not None
+
 def main():
   parser = DefineFlags()
   (opts, args) = parser.parse_args()
+  startup.Mark('options parsed')
   if ((opts.wsname or opts.wsid) and
       (not opts.ssname and not opts.ssid)):
     parser.error('You must first specify either --name or --key with the --sheet or --sheetid options')
   if (opts.ssname and opts.ssid):
     parser.error('You must specify only one of --name or --key options')
   if (opts.wsname and opts.wsid):
+    if len(opts.wsname) > 1 or len(opts.wsid) > 1:
+      parser.error('--sheet and --sheetid can\'t be mixed, give all the worksheets by name or all by key')
     parser.error('You must specify only one of --sheet or --sheetid options')
   if not opts.listkeys:
     if (not opts.ssname and not opts.ssid):
       parser.error('You must specify either --name or --key options')
-
+  if opts.batchSize is not None and opts.batchSize < 1:
+    parser.error('--batch-size must be a positive number')
+  if opts.workers is not None and opts.workers < 1:
+    parser.error('--workers must be a positive number')
+  if opts.serve:
+    if opts.listkeys:
+      parser.error('--serve can\'t be used with --list')
+    if not args or [c for c in args if ':' in c]:
+      parser.error('--serve needs the column names that the received lines map to')
+    if '/' not in opts.serve:
+      host = opts.serve.rpartition(':')[0]
+      if host and not is_loopback_host(host):
+        parser.error('--serve must listen on this host, e.g. localhost or 127.0.0.1')
+
+  if opts.block:
+    if opts.listkeys or opts.serve or opts.dump or opts.spool or args:
+      parser.error('--block can\'t be used with --list, --serve, --dump, --spool or column arguments')
+    if opts.cellsPerRequest < 1:
+      parser.error('--cells-per-request must be a positive number')
+
+  if opts.window is not None:
+    if opts.window <= 0:
+      parser.error('--window must be a positive number')
+    if not opts.aggregates:
+      parser.error('--window needs at least one --aggregate')
+    if opts.listkeys or opts.serve or opts.dump or opts.spool or opts.block:
+      parser.error('--window can\'t be used with --list, --serve, --dump, --spool or --block')
+    if not args or [c for c in args if ':' in c]:
+      parser.error('--window needs the column names of the rows read from stdin')
+    import aggregate
+    try:
+      aggregate.WindowAggregator(args, opts.window, opts.aggregates, opts.timeColumn,
+                                 opts.groupBy or ())
+    except ValueError, e:
+      parser.error(str(e))
+  elif opts.aggregates or opts.timeColumn or opts.groupBy:
+    parser.error('--aggregate, --time-column and --group-by need a --window')
+  if len(opts.wsname or opts.wsid or []) > 1:
+    if opts.listkeys or opts.serve or opts.dump or opts.spool or opts.block or len(args) < 2:
+      parser.error('--sheet and --sheetid can be given more than once only to insert rows')
+    if opts.bufferRows < 1:
+      parser.error('--buffer-rows must be a positive number')
+  if opts.follow:
+    if (opts.listkeys or opts.serve or opts.dump or opts.spool or opts.block or opts.input or
+        opts.keyColumn or opts.workers or opts.window is not None or opts.columnTypes or
+        len(opts.wsname or opts.wsid or []) > 1):
+      parser.error('--follow can\'t be used with --list, --serve, --dump, --spool, --block, --input, '
+                   '--key-column, --workers, --window, --column-type or more than one worksheet')
+    if len(args) < 2 or [c for c in args if ':' in c]:
+      parser.error('--follow needs the column names that the lines map to')
+  elif opts.followState:
+    parser.error('--follow-state needs a --follow file')
+  if opts.columnTypes:
+    if (opts.listkeys or opts.serve or opts.dump or opts.spool or opts.block or
+        opts.processes is not None):
+      parser.error('--column-type can\'t be used with --list, --serve, --dump, --spool, --block '
+                   'or --processes')
+    if not args or [c for c in args if ':' in c]:
+      parser.error('--column-type needs the column names of the rows read from stdin')
+    import coerce
+    try:
+      coerce.RowCoercer(args, [coerce.parse_column_type(spec) for spec in opts.columnTypes])
+    except ValueError, e:
+      parser.error(str(e))
+  elif opts.rejects:
+    parser.error('--rejects needs a --column-type')
+  if opts.processes is not None:
+    if opts.processes < 1:
+      parser.error('--processes must be a positive number')
+    if not opts.input:
+      parser.error('--processes needs the --input file to split')
+    if (opts.listkeys or opts.serve or opts.dump or opts.spool or opts.block or opts.keyColumn or
+        opts.window is not None or len(opts.wsname or opts.wsid or []) > 1):
+      parser.error('--processes can\'t be used with --list, --serve, --dump, --spool, --block, '
+                   '--key-column, --window or more than one worksheet')
+    if len(args) < 2 or [c for c in args if ':' in c]:
+      parser.error('--processes needs the column names of the rows in the --input file')
+  if opts.keyColumn:
+    if opts.listkeys or opts.serve or opts.dump or opts.spool or opts.block:
+      parser.error('--key-column can\'t be used with --list, --serve, --dump, --spool or --block')
+    if opts.batchSize or opts.workers:
+      parser.error('--key-column can\'t be used with --batch-size or --workers')
+
+  if opts.dump:
+    if opts.listkeys or opts.serve or args:
+      parser.error('--dump can\'t be used with --list, --serve or column arguments')
+    if opts.pageSize < 1:
+      parser.error('--page-size must be a positive number')
+  if opts.delimiter is not None and len(opts.delimiter) != 1:
+    parser.error('--delimiter must be a single character')
+  if opts.resume and not opts.spool:
+    parser.error('--resume needs the --spool to resume from')
+  if opts.spool and (opts.workers or opts.serve or opts.dump):
+    parser.error('--spool can\'t be used with --workers, --serve or --dump')
+  if opts.maxRate is not None and opts.maxRate <= 0:
+    parser.error('--max-rate must be a positive number')
+  if opts.maxRetries < 0:
+    parser.error('--max-retries can\'t be negative')
+  if opts.concurrency < 1:
+    parser.error('--concurrency must be a positive number')
+  if opts.poolSize < 0:
+    parser.error('--pool-size can\'t be negative')
+  if opts.endpoint and not is_loopback(opts.endpoint):
+    parser.error('--endpoint must be on this host (localhost, 127.0.0.1 or ::1)')
+
+  delimiter = opts.delimiter or (opts.tsv and '\t') or (opts.csvformat and ',') or None
+
+  recorder = instrument.Recorder(log=opts.timingsLog and open(opts.timingsLog, 'a'))
+  if opts.profile:
+    import cProfile
+    profiler = cProfile.Profile()
+  else:
+    profiler = None
+  if profiler:
+    profiler.enable()
+  try:
+    return run(opts, args, delimiter, recorder)
+  finally:
+    if profiler:
+      profiler.disable()
+      profiler.dump_stats(opts.profile)
+    # Also when failing, to see what the time went to until then.
+    summary = recorder.Summary()
+    if opts.timings:
+      print >> sys.stderr, summary
+    if recorder.log:
+      recorder.log.close()
+
+def run(opts, args, delimiter, recorder):
+  status = 0
   if opts.listkeys:
-    lister = LogssAction(debug=opts.debug, auth_domain=opts.domain)
-    lister.Authenticate()
-    for (ssname, ssid) in lister.GetSpreadsheets(opts.ssid or opts.ssname,
-                                                 not opts.ssname):
-      print "%s: %s" % (ssname, ssid)
-      for (wsname, wsid) in lister.GetWorksheets(ssid,
-                                                 opts.wsid or opts.wsname,
-                                                 not opts.wsname):
-        print "\t%s: %s" % (wsname, wsid)
+    # Keep a connection for each of the concurrent requests.
+    lister = action = LogssAction(debug=opts.debug, auth_domain=opts.domain,
+                                  pool_size=max(opts.poolSize, opts.concurrency),
+                                  idle_timeout=opts.idleTimeout,
+                                  concurrency=opts.concurrency, max_rate=opts.maxRate,
+                                  max_retries=opts.maxRetries, recorder=recorder,
+                                  endpoint=opts.endpoint)
+    try:
+      lister.Authenticate()
+      startup.Mark('authenticated')
+      listing = lister.GenerateListing(opts.ssid or opts.ssname, not opts.ssname,
+                                       (opts.wsid or opts.wsname or [None])[0], not opts.wsname)
+      if opts.format == 'json':
+        import json
+        # Write each spreadsheet as soon as it is available.
+        sys.stdout.write('[')
+        for (i, (ssname, ssid, worksheets)) in enumerate(listing):
+          sys.stdout.write((i and ',\n ' or '\n ') + json.dumps(
+              {'name': ssname, 'id': ssid,
+               'worksheets': [{'name': wsname, 'id': wsid} for (wsname, wsid) in worksheets]}))
+          sys.stdout.flush()
+        print '\n]'
+      else:
+        for (ssname, ssid, worksheets) in listing:
+          print "%s: %s" % (ssname, ssid)
+          for (wsname, wsid) in worksheets:
+            print "\t%s: %s" % (wsname, wsid)
+    finally:
+      lister.Close()
   else:
-    inserter = SpreadsheetInserter(debug=opts.debug, auth_domain=opts.domain)
-    inserter.Authenticate()
-    ssid = opts.ssid or list(inserter.GetSpreadsheets(opts.ssname))[0][1]
-    wsid = (opts.wsid or
-            (opts.wsname and
-             list(inserter.GetWorksheets(ssid, opts.wsname))[0][1]) or
-            'default')
-    inserter.key = ssid
-    inserter.wkey = wsid
-
-    if opts.headerRowNums:
-      inserter.SetColumnHeaderRowNums(opts.headerRowNums[0],
-                                      len(opts.headerRowNums) > 1 and opts.headerRowNums[1] or None,
-                                      shortenColumnNames=opts.shorten,
-                                      maxLen=opts.maxHeaderLen)
-
-    if len(args) > 1:
-      cols = args
-      if inserter.ColumnNamesHaveData(cols):
-        inserter.InsertFromColumns(cols)
+    cache = opts.cacheTtl > 0 and MetadataCache(ttl=opts.cacheTtl) or None
+    # Only one of the two can be given (see above), however many times.
+    targets = opts.wsid or opts.wsname or [None]
+    if len(targets) > 1:
+      return run_fanned_out(opts, args, delimiter, recorder, cache, targets)
+    inserter = action = open_inserter(opts, recorder, cache, targets[0])
+
+    try:
+      if opts.dump:
+        inserter.DumpRows(sys.stdout, csvformat=opts.csvformat, page_size=opts.pageSize)
+      elif opts.serve:
+        import rowserver
+        server = rowserver.RowServer(inserter, args, opts.serve, delimiter=delimiter,
+                                     quoting=not opts.noQuoting,
+                                     batch_size=opts.batchSize or 100,
+                                     flush_interval=opts.flushInterval, verbose=opts.verbose)
+        server.serve_forever()
+      elif opts.follow:
+        import follow
+        state_file = opts.followState or '%s.%s.follow' % (
+            os.path.splitext(TokenStore().token_file)[0],
+            os.path.abspath(opts.follow).replace(os.sep, '_'))
+        follower = follow.Follower(inserter, opts.follow, args, state_file, delimiter=delimiter,
+                                   quoting=not opts.noQuoting, batch_size=opts.batchSize or 100,
+                                   flush_interval=opts.flushInterval, verbose=opts.verbose)
+        follower.Run()
+      elif opts.block:
+        (first_row_num, first_col_num) = opts.blockAt or (None, 1)
+        with input_file(opts) as fh:
+          rows = inserter.ReadTuples((), fh, verbose=opts.verbose, delimiter=delimiter,
+                                     quoting=not opts.noQuoting)
+          (first_row_num, last_row_num, num_cells) = inserter.WriteBlock(
+              rows, first_row_num, first_col_num, cells_per_request=opts.cellsPerRequest,
+              workers=opts.workers or 1)
+        print >> sys.stderr, 'Wrote %d cells to rows %d-%d' % (num_cells, first_row_num, last_row_num)
+      elif len(args) > 1 and opts.keyColumn:
+        with input_file(opts) as fh:
+          (cols, rows) = read_rows(opts, inserter, args, delimiter, fh)
+          counts = inserter.UpsertRows(cols, rows, opts.keyColumn, page_size=opts.pageSize,
+                                       refresh=opts.refreshCache)
+        if opts.verbose or not inserter.ColumnNamesHaveData(args):
+          print >> sys.stderr, format_counts(counts)
+      elif len(args) > 1:
+        cols = args
+        if inserter.ColumnNamesHaveData(cols):
+          inserter.InsertFromColumns(cols)
+        else:
+          # Read from stdin, pipe data to spreadsheet.
+          failed = []
+          if opts.spool:
+            import spool
+            with input_file(opts) as fh:
+              # Don't wait for input when only the spool is to be resumed.
+              if opts.resume and not opts.input and sys.stdin.isatty():
+                fh = None
+              inserter.InsertSpooled(cols, fh, spool.Spool(opts.spool), verbose=opts.verbose,
+                                     batch_size=opts.batchSize, resume=opts.resume,
+                                     delimiter=delimiter, quoting=not opts.noQuoting)
+          elif opts.processes:
+            import sharded
+            failed = sharded.ShardedLoader(inserter, opts.input, cols, opts.processes,
+                                           batch_size=opts.batchSize, workers=opts.workers,
+                                           delimiter=delimiter, quoting=not opts.noQuoting,
+                                           verbose=opts.verbose).Run()
+          else:
+            with input_file(opts) as fh:
+              (cols, rows) = read_rows(opts, inserter, args, delimiter, fh)
+              failed = inserter.InsertTupleStream(cols, rows, batch_size=opts.batchSize,
+                                                  workers=opts.workers, verbose=opts.verbose)
+          if failed:
+            print >> sys.stderr, 'Failed to insert lines: ' + format_ranges(failed)
+            status = 1
       else:
-        # Read from stdin, pipe data to spreadsheet.
-        inserter.InsertFromFileHandle(cols, sys.stdin, csvformat=opts.csvformat, verbose=opts.verbose)
-    else:
-      print('\n'.join("%s: %s" % (name, tag) for (name, tag) in inserter.ListColumns()))
-  return 0
+        print('\n'.join("%s: %s" % (name, tag) for (name, tag) in inserter.ListColumns()))
+    finally:
+      inserter.Close()
+  if opts.verbose:
+    print >> sys.stderr, action.client.http_client.pool.stats()
+    print >> sys.stderr, action.client.scheduler.Stats()
+  return status
+
+def open_inserter(opts, recorder, cache, ws=None):
+  """
+  Return an inserter into the worksheet (the --sheet or --sheetid one, or the
+  first), authenticated and with the column names mapped.
+  """
+  inserter = SpreadsheetInserter(debug=opts.debug, auth_domain=opts.domain, cache=cache,
+                                 pool_size=opts.poolSize, idle_timeout=opts.idleTimeout,
+                                 max_rate=opts.maxRate, max_retries=opts.maxRetries,
+                                 recorder=recorder, endpoint=opts.endpoint)
+  inserter.Authenticate()
+  startup.Mark('authenticated')
+  inserter.SelectWorksheet(opts.ssid or opts.ssname, not opts.ssname, ws, not opts.wsname,
+                           refresh=opts.refreshCache)
+
+  if opts.headerRowNums:
+    inserter.SetColumnHeaderRowNums(opts.headerRowNums[0],
+                                    len(opts.headerRowNums) > 1 and opts.headerRowNums[1] or None,
+                                    shortenColumnNames=opts.shorten,
+                                    maxLen=opts.maxHeaderLen,
+                                    refresh=opts.refreshCache)
+  startup.Mark('columns mapped')
+  return inserter
+
+def run_fanned_out(opts, args, delimiter, recorder, cache, targets):
+  """
+  Insert the rows, given by args or read from stdin, into each of the target
+  worksheets concurrently, each with its own column names.
+  """
+  import fanout
+  inserters = [open_inserter(opts, recorder, cache, ws) for ws in targets]
+
+  def consumer(inserter, cols):
+    if opts.keyColumn:
+      return lambda rows: inserter.UpsertRows(cols, rows, opts.keyColumn, page_size=opts.pageSize,
+                                              refresh=opts.refreshCache)
+    return lambda rows: inserter.InsertTupleStream(cols, rows, opts.batchSize, opts.workers,
+                                                   opts.verbose)
+
+  with input_file(opts) as fh:
+    (cols, rows) = read_rows(opts, inserters[0], args, delimiter, fh)
+    try:
+      results = fanout.FanOut([consumer(inserter, cols) for inserter in inserters],
+                              opts.bufferRows).Run(rows)
+    finally:
+      for inserter in inserters:
+        inserter.Close()
+  status = 0
+  for (ws, inserter, (result, error)) in zip(targets, inserters, results):
+    if error is not None:
+      print >> sys.stderr, '%s: %s' % (ws, error)
+      status = 1
+    elif opts.keyColumn:
+      print >> sys.stderr, '%s: %s' % (ws, format_counts(result))
+    elif result:
+      print >> sys.stderr, '%s: Failed to insert lines: %s' % (ws, format_ranges(result))
+      status = 1
+    if opts.verbose:
+      print >> sys.stderr, '%s: %s' % (ws, inserter.client.http_client.pool.stats())
+      print >> sys.stderr, '%s: %s' % (ws, inserter.client.scheduler.Stats())
+  return status
+
+def read_rows(opts, inserter, args, delimiter, fh):
+  """
+  Return the column names and the rows, given by args or else read from fh,
+  summarized over the --window if given.
+  """
+  if inserter.ColumnNamesHaveData(args):
+    data = [c.split(':', 1) for c in args]
+    return ([name for (name, value) in data], [tuple(value for (name, value) in data)])
+  if opts.verbose:
+    print >> sys.stderr, 'Columns selected: ' + str(args)
+  rows = inserter.ReadTuples(args, fh, verbose=opts.verbose, delimiter=delimiter,
+                             quoting=not opts.noQuoting)
+  if opts.columnTypes:
+    rows = coerced(opts, args, rows, delimiter)
+  if opts.window is None:
+    return (args, rows)
+  import aggregate
+  aggregator = aggregate.WindowAggregator(args, opts.window, opts.aggregates, opts.timeColumn,
+                                          opts.groupBy or (), opts.windowLateness)
+  return (aggregator.columns, summarized(aggregator, rows))
+
+@contextlib.contextmanager
+def input_file(opts):
+  """Open the --input file for the with block, or else use stdin."""
+  if not opts.input:
+    yield sys.stdin
+    return
+  with open(opts.input, 'rb') as fh:
+    yield fh
+
+def coerced(opts, cols, rows, delimiter):
+  """
+  Generate the rows with the values of the --column-type columns converted,
+  and report the rows that were left out.
+  """
+  import coerce
+  if opts.rejects:
+    rejects = coerce.RejectWriter(open(opts.rejects, 'ab'), delimiter, not opts.noQuoting)
+    reject = rejects
+  else:
+    rejects = None
+    reject = lambda row_num, values, error: sys.stderr.write('Left out row %d: %s\n' %
+                                                             (row_num, error))
+  coercer = coerce.RowCoercer(cols, [coerce.parse_column_type(spec) for spec in opts.columnTypes],
+                              opts.batchSize or 1, reject)
+  try:
+    for row in coercer.Coerce(rows):
+      yield row
+  finally:
+    if rejects:
+      rejects.fh.close()
+      if rejects.count:
+        print >> sys.stderr, 'Left out %d rows, written to %s (the first, row %d: %s)' % (
+            rejects.count, opts.rejects, rejects.first[0], rejects.first[1])
+
+def summarized(aggregator, rows):
+  """Generate the summary rows, and report the rows that were left out at the end."""
+  for row in aggregator.Aggregate(rows):
+    yield row
+  if aggregator.skipped or aggregator.late:
+    print >> sys.stderr, 'Left out %d rows without a valid time or value, and %d that came too late' % (
+        aggregator.skipped, aggregator.late)
+
+def format_ranges(ranges):
+  return ', '.join(first == last and str(first) or '%d-%d' % (first, last) for (first, last) in ranges)
+
+def format_counts(counts):
+  return 'Upserted %d rows: %d inserted, %d updated, %d unchanged' % (
+      sum(counts.values()), counts['inserted'], counts['updated'], counts['unchanged'])
 
 if __name__ == '__main__':
   sys.exit(main())
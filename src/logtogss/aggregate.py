@@ -0,0 +1,281 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Summarize the rows over tumbling windows of time, before they are inserted.
+
+The rows are grouped by the window their time falls in, and optionally by the
+values of some key columns, and a row is generated for each window and group
+with the aggregates of its numeric columns: count, sum, min, max, avg and
+percentiles. The rows are expected in about the order of their time, so only
+the windows that are still open are kept, with a few numbers for each column.
+Percentiles are estimated from a bounded sample of the values, for windows
+with more values than that.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import calendar
+import math
+import random
+import re
+import time
+
+
+FUNCTIONS = ['count', 'sum', 'min', 'max', 'avg']
+
+_SPEC = re.compile(r'^\s*([^=\s]+)\s*=\s*(\w+)\s*(?:\(\s*([^)]*?)\s*\))?\s*$')
+_PERCENTILE = re.compile(r'^p(\d+(?:\.\d+)?)$')
+
+
+def parse_aggregate(spec):
+  """
+  Parse an aggregate given as NAME=FUNC(COLUMN) into (name, func, column),
+  where func is one of FUNCTIONS or a percentile, as pNN. The column is None
+  for a count of the rows.
+  """
+  match = _SPEC.match(spec)
+  if not match:
+    raise ValueError("Can't parse the aggregate %r, expected NAME=FUNC(COLUMN)" % spec)
+  (name, func, col) = match.groups()
+  func = func.lower()
+  percentile = _PERCENTILE.match(func)
+  if func not in FUNCTIONS and not (percentile and 0 < float(percentile.group(1)) <= 100):
+    raise ValueError("Unknown function %s in %r, expected one of %s or pNN" %
+                     (func, spec, ', '.join(FUNCTIONS)))
+  if not col and func != 'count':
+    raise ValueError("The aggregate %r needs a column" % spec)
+  return (name, func, col or None)
+
+
+# The seconds since the epoch of the minutes parsed, as strptime takes longer
+# than all the rest of the aggregation.
+_minutes = {}
+
+
+def parse_time(value):
+  """
+  Return the seconds since the epoch of a time given as such, or as an ISO
+  8601 date and time (UTC, with the fraction and zone ignored), or None.
+  """
+  if value[4:5] == '-' and value[16:17] == ':':
+    minute = value[:16]
+    secs = _minutes.get(minute)
+    if secs is None:
+      try:
+        secs = calendar.timegm(time.strptime(minute.replace(' ', 'T'), '%Y-%m-%dT%H:%M'))
+      except ValueError:
+        return None
+      if len(_minutes) >= 1024:
+        _minutes.clear()
+      _minutes[minute] = secs
+    if not value[17:19].isdigit():
+      return None
+    return secs + int(value[17:19])
+  secs = parse_number(value)
+  if secs is None or not is_finite(secs):
+    return None
+  return secs
+
+
+def parse_number(value):
+  """Return the value as a float, or None if it isn't a number."""
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+
+def is_finite(number):
+  return not (math.isinf(number) or math.isnan(number))
+
+
+def format_number(value):
+  """Format a number without an exponent, or a trailing fraction of zeros."""
+  if value is None:
+    return ''
+  if value == int(value):
+    return str(int(value))
+  return ('%.6f' % value).rstrip('0').rstrip('.')
+
+
+class _Stats(object):
+  """The running aggregates of the values of a column."""
+
+  def __init__(self, sample_size):
+    self.count = 0
+    self.total = 0.0
+    self.lo = None
+    self.hi = None
+    self.sample_size = sample_size
+    self.sample = None
+    if sample_size:
+      self.sample = []
+
+  def Add(self, value):
+    """Add a value, which is a finite float."""
+    self.count += 1
+    self.total += value
+    if self.lo is None or value < self.lo:
+      self.lo = value
+    if self.hi is None or value > self.hi:
+      self.hi = value
+    if self.sample is not None:
+      if len(self.sample) < self.sample_size:
+        self.sample.append(value)
+      else:
+        # Reservoir sampling, so that each value is as likely to be kept.
+        i = random.randint(0, self.count - 1)
+        if i < self.sample_size:
+          self.sample[i] = value
+
+  def Value(self, func):
+    if func == 'count':
+      return self.count
+    if not self.count:
+      return None
+    if func == 'sum':
+      return self.total
+    if func == 'min':
+      return self.lo
+    if func == 'max':
+      return self.hi
+    if func == 'avg':
+      return self.total / self.count
+    # The nearest rank percentile.
+    values = sorted(self.sample)
+    index = int(math.ceil(float(func[1:]) / 100 * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+class WindowAggregator(object):
+  """Summarize the rows over tumbling windows of time.
+
+  Methods:
+    Aggregate: Generate the summary rows of the rows.
+
+  Extra properties:
+    columns: The names of the columns of the summary rows.
+    skipped: The number of rows without a valid time, or with an infinite or
+      NaN value to aggregate, which can't be summed or formatted.
+    late: The number of rows that came after their window was summarized.
+  """
+
+  def __init__(self, cols, window, aggregates, time_col=None, group_by=(), lateness=0,
+               sample_size=1024):
+    """
+    Summarize the rows, which have the named columns, over windows of the
+    given number of seconds, with the aggregates (see parse_aggregate, which
+    they are given to) of the rows in each window that have the same values
+    in the group_by columns. The time is taken from time_col, the first
+    column by default. A window is summarized once a row that is lateness
+    seconds past its end is read. Raises ValueError for unknown columns.
+    """
+    self.cols = list(cols)
+    self.window = window
+    self.aggregates = [parse_aggregate(spec) for spec in aggregates]
+    self.time_col = time_col or self.cols[0]
+    self.group_by = list(group_by)
+    self.lateness = lateness
+    unknown = [col for col in [self.time_col] + self.group_by + [a[2] for a in self.aggregates]
+               if col is not None and col not in self.cols]
+    if unknown:
+      raise ValueError("Unknown columns: %s" % ', '.join(unknown))
+    self.columns = [self.time_col] + self.group_by + [name for (name, func, col) in self.aggregates]
+    self.time_pos = self.cols.index(self.time_col)
+    self.group_pos = [self.cols.index(col) for col in self.group_by]
+    # The columns that have aggregates, and whether a sample is needed for them.
+    sampled = set(col for (name, func, col) in self.aggregates if func not in FUNCTIONS)
+    self.stat_cols = [(self.cols.index(col), col in sampled and sample_size or 0)
+                      for col in sorted(set(a[2] for a in self.aggregates if a[2]))]
+    self.stat_num = dict((self.cols[pos], i) for (i, (pos, size)) in enumerate(self.stat_cols))
+    self.skipped = 0
+    self.late = 0
+
+  def Aggregate(self, rows):
+    """
+    Generate a summary row for each window and group, in the order of the
+    windows. The time of a summary row is the start of its window, in the
+    format of the times read.
+    """
+    # (window start, group) -> [row count, [_Stats of each of the stat_cols]]
+    windows = {}
+    # The times past which the windows are closed, from the latest.
+    newest = None
+    closed_before = None
+    iso_format = None
+    for row in rows:
+      value = len(row) > self.time_pos and row[self.time_pos] or ''
+      secs = parse_time(value)
+      if secs is None:
+        self.skipped += 1
+        continue
+      if iso_format is None:
+        iso_format = self._TimeFormat(value)
+      start = secs - secs % self.window
+      if closed_before is not None and start < closed_before:
+        self.late += 1
+        continue
+      numbers = [parse_number(len(row) > pos and row[pos] or '') for (pos, size) in self.stat_cols]
+      if [number for number in numbers if number is not None and not is_finite(number)]:
+        self.skipped += 1
+        continue
+      group = tuple(len(row) > pos and row[pos] or '' for pos in self.group_pos)
+      state = windows.get((start, group))
+      if state is None:
+        state = windows[(start, group)] = [0, [_Stats(size) for (pos, size) in self.stat_cols]]
+      state[0] += 1
+      for (number, stats) in zip(numbers, state[1]):
+        if number is not None:
+          stats.Add(number)
+      if newest is None or secs > newest:
+        newest = secs
+        horizon = newest - self.lateness
+        horizon -= horizon % self.window
+        if closed_before is None or horizon > closed_before:
+          closed_before = horizon
+          for key in sorted(key for key in windows if key[0] < closed_before):
+            yield self._Summary(key, windows.pop(key), iso_format)
+    for key in sorted(windows):
+      yield self._Summary(key, windows[key], iso_format)
+
+  def _TimeFormat(self, value):
+    try:
+      float(value)
+      return None
+    except ValueError:
+      return '%Y-%m-%d' + (value[10:11] or 'T') + '%H:%M:%S'
+
+  def _Summary(self, key, state, iso_format):
+    (start, group) = key
+    (count, stats) = state
+    if iso_format:
+      start = time.strftime(iso_format, time.gmtime(start))
+    else:
+      start = format_number(start)
+    values = []
+    for (name, func, col) in self.aggregates:
+      if col is None:
+        values.append(str(count))
+      else:
+        values.append(format_number(stats[self.stat_num[col]].Value(func)))
+    return (start,) + group + tuple(values)
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""A non-blocking front end for the spreadsheets client.
+
+The gdata client is synchronous, so this issues its requests from a bounded
+pool of threads, and returns a Future for each of them right away. This lets
+independent requests (e.g. the worksheets of every spreadsheet) overlap, with
+the total time close to that of the slowest one rather than the sum.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import sys
+import threading
+import Queue
+
+
+class Future(object):
+  """The result of a call that may not have completed yet.
+
+  Methods:
+    result: Wait for and return the result, or raise the exception of the call.
+    done: Has the call completed?
+    add_done_callback: Call a function with this future once it is done.
+    then: Return a new Future for a function of this one's result.
+  """
+
+  def __init__(self):
+    self._done = threading.Event()
+    self._lock = threading.Lock()
+    self._callbacks = []
+    self._value = None
+    self._exc_info = None
+
+  def _complete(self, value=None, exc_info=None):
+    with self._lock:
+      self._value = value
+      self._exc_info = exc_info
+      self._done.set()
+      callbacks, self._callbacks = self._callbacks, []
+    for callback in callbacks:
+      callback(self)
+
+  def set_result(self, value):
+    self._complete(value=value)
+
+  def set_exc_info(self, exc_info):
+    self._complete(exc_info=exc_info)
+
+  def done(self):
+    return self._done.is_set()
+
+  def result(self, timeout=None):
+    if not self._done.wait(timeout):
+      raise Exception('Timed out waiting for the result')
+    if self._exc_info:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._value
+
+  def add_done_callback(self, callback):
+    with self._lock:
+      if not self._done.is_set():
+        self._callbacks.append(callback)
+        return
+    callback(self)
+
+  def then(self, func):
+    chained = Future()
+
+    def resolve(future):
+      if future._exc_info:
+        chained.set_exc_info(future._exc_info)
+        return
+      try:
+        chained.set_result(func(future._value))
+      except Exception, e:
+        chained.set_exc_info(sys.exc_info())
+
+    self.add_done_callback(resolve)
+    return chained
+
+
+class WorkerPool(object):
+  """A fixed number of threads, running the calls submitted to them in turn."""
+
+  def __init__(self, size):
+    self.size = size
+    self.calls = Queue.Queue()
+    self.threads = None
+    self.lock = threading.Lock()
+
+  def _work(self):
+    while True:
+      call = self.calls.get()
+      if call is None:
+        return
+      (future, func, args, kwargs) = call
+      try:
+        future.set_result(func(*args, **kwargs))
+      except Exception, e:
+        future.set_exc_info(sys.exc_info())
+
+  def submit(self, func, *args, **kwargs):
+    """Call func(*args, **kwargs) on one of the threads and return its Future."""
+    with self.lock:
+      if self.threads is None:
+        # Start lazily, so that a pool that is never used costs nothing.
+        self.threads = [threading.Thread(target=self._work) for i in xrange(self.size)]
+        for thread in self.threads:
+          thread.daemon = True
+          thread.start()
+    future = Future()
+    self.calls.put((future, func, args, kwargs))
+    return future
+
+  def close(self):
+    """Stop the threads once they have run the calls submitted so far."""
+    with self.lock:
+      threads, self.threads = self.threads, None
+    for thread in threads or ():
+      self.calls.put(None)
+    for thread in threads or ():
+      thread.join()
+
+
+class AsyncSpreadsheetsClient(object):
+  """Issue requests of a MySpreadsheetsClient, with at most concurrency of
+  them in flight at a time. Each method takes the same arguments as that of
+  the client, but returns a Future of its result.
+  """
+
+  def __init__(self, client, concurrency=8):
+    self.client = client
+    self.pool = WorkerPool(concurrency)
+
+  def submit(self, func, *args, **kwargs):
+    return self.pool.submit(func, *args, **kwargs)
+
+  def close(self):
+    self.pool.close()
+
+  def get_list_feed(self, *args, **kwargs):
+    return self.submit(self.client.get_list_feed, *args, **kwargs)
+
+  GetListFeed = get_list_feed
+
+  def get_cells_feed(self, *args, **kwargs):
+    return self.submit(self.client.get_cells_feed, *args, **kwargs)
+
+  GetCellsFeed = get_cells_feed
+
+  def add_list_entry(self, *args, **kwargs):
+    return self.submit(self.client.add_list_entry, *args, **kwargs)
+
+  AddListEntry = add_list_entry
+
+  def get_spreadsheets(self, *args, **kwargs):
+    return self.submit(self.client.get_spreadsheets, *args, **kwargs)
+
+  GetSpreadsheets = get_spreadsheets
+
+  def get_worksheets(self, *args, **kwargs):
+    return self.submit(self.client.get_worksheets, *args, **kwargs)
+
+  GetWorksheets = get_worksheets
@@ -0,0 +1,261 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Convert the values of typed columns before they are inserted.
+
+The values are otherwise sent as they are read, and left for the spreadsheet
+to guess the type of. A column can instead be given a type, which its values
+are checked against and written in a form the spreadsheet doesn't need to
+guess at: int, float, date, datetime or bool, each with an optional format.
+The converters are compiled once for the columns, and applied to a batch of
+rows a column at a time. The rows with a value that doesn't convert are
+rejected, rather than failing the load.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import csv
+import datetime
+import math
+import re
+
+
+TYPES = ['int', 'float', 'date', 'datetime', 'bool']
+
+_SPEC = re.compile(r'^\s*([^=\s]+)\s*=\s*(\w+)(?::(.*))?$')
+
+TRUE_WORDS = ('true', 'yes', 'y', 'on', '1')
+FALSE_WORDS = ('false', 'no', 'n', 'off', '0')
+
+
+def parse_column_type(spec):
+  """
+  Parse a column type given as NAME=TYPE[:FORMAT] into (name, type, format),
+  where the format is None if not given. The format is what int and float
+  values are written with, e.g. %.2f, what date and datetime values are read
+  with (see strptime), and the TRUE/FALSE words that bool values are read as.
+  """
+  match = _SPEC.match(spec)
+  if not match:
+    raise ValueError("Can't parse the column type %r, expected NAME=TYPE[:FORMAT]" % spec)
+  (name, type_name, fmt) = match.groups()
+  type_name = type_name.lower()
+  if type_name not in TYPES:
+    raise ValueError("Unknown type %s in %r, expected one of %s" %
+                     (type_name, spec, ', '.join(TYPES)))
+  # Fails early on a bad format.
+  make_converter(type_name, fmt)
+  return (name, type_name, fmt)
+
+
+def make_converter(type_name, fmt=None):
+  """
+  Return a function that converts a value to the given type, as it is to be
+  written, or raises a ValueError. Empty values are left empty.
+  """
+  if type_name in ('int', 'float'):
+    parse = type_name == 'int' and int or float
+    if fmt:
+      try:
+        fmt % parse('1')
+      except (TypeError, ValueError):
+        raise ValueError("Bad format %r for %s values" % (fmt, type_name))
+      write = lambda number: fmt % number
+    else:
+      write = type_name == 'int' and str or repr
+
+    def convert(value):
+      value = value.strip()
+      if not value:
+        return ''
+      number = parse(value)
+      if type_name == 'float' and (math.isinf(number) or math.isnan(number)):
+        raise ValueError("%r is not a finite number" % value)
+      return write(number)
+    return convert
+  if type_name == 'bool':
+    if fmt:
+      words = fmt.lower().split('/')
+      if len(words) != 2 or not all(words):
+        raise ValueError("Bad format %r for bool values, expected TRUE/FALSE words" % fmt)
+      words = dict([(words[0], 'TRUE'), (words[1], 'FALSE')])
+    else:
+      words = dict([(word, 'TRUE') for word in TRUE_WORDS] +
+                   [(word, 'FALSE') for word in FALSE_WORDS])
+
+    def convert(value):
+      value = value.strip()
+      if not value:
+        return ''
+      try:
+        return words[value.lower()]
+      except KeyError:
+        raise ValueError("%r is not a bool" % value)
+    return convert
+  # Dates repeat a lot in logs, and strptime takes longer than all the rest,
+  # so the converted values are remembered, up to a point.
+  if type_name == 'date':
+    (fmts, out) = (fmt and [fmt] or ['%Y-%m-%d'], '%Y-%m-%d')
+  else:
+    # ISO 8601 by default, also with the space that the values are written
+    # with, so that they read back.
+    (fmts, out) = (fmt and [fmt] or ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S'],
+                   '%Y-%m-%d %H:%M:%S')
+  # A format that doesn't read back what it writes, e.g. with a stray %,
+  # would reject every value.
+  now = datetime.datetime.now()
+  try:
+    datetime.datetime.strptime(now.strftime(fmts[0]), fmts[0])
+  except ValueError:
+    raise ValueError("Bad format %r for %s values, it doesn't parse what it formats" %
+                     (fmts[0], type_name))
+  converted = {}
+
+  def parse(value):
+    for fmt in fmts[:-1]:
+      try:
+        return datetime.datetime.strptime(value, fmt)
+      except ValueError:
+        pass
+    return datetime.datetime.strptime(value, fmts[-1])
+
+  def convert(value):
+    result = converted.get(value)
+    if result is None:
+      stripped = value.strip()
+      if not stripped:
+        return ''
+      result = parse(stripped).strftime(out)
+      if len(converted) >= 1024:
+        converted.clear()
+      converted[value] = result
+    return result
+  return convert
+
+
+class RowCoercer(object):
+  """Convert the values of the typed columns of the rows.
+
+  The rows are converted a batch of batch_size at a time, by mapping the
+  converter of each typed column over the values of the column, unless a
+  value fails to convert, when the batch is converted a row at a time
+  instead to reject the rows with such values.
+
+  Methods:
+    Coerce: Generate the rows that convert, converted.
+  """
+
+  def __init__(self, cols, types, batch_size=1, reject=None):
+    """
+    The types are the (name, type, format) of the typed columns, and reject
+    is called with the number, the values and the error of each rejected row.
+    """
+    index = dict((col, i) for (i, col) in enumerate(cols))
+    unknown = [name for (name, type_name, fmt) in types if name not in index]
+    if unknown:
+      raise ValueError("Unknown columns with a type: %s" % ', '.join(unknown))
+    self.converters = [(index[name], make_converter(type_name, fmt))
+                       for (name, type_name, fmt) in types]
+    self.width = max([i for (i, convert) in self.converters] + [-1]) + 1
+    self.batch_size = batch_size
+    self.reject = reject
+    self.rejected = 0
+
+  def Coerce(self, rows):
+    if not self.converters:
+      return rows
+    if self.batch_size > 1:
+      return self._CoerceBatches(rows)
+    return self._CoerceRows(rows)
+
+  def _CoerceRows(self, rows):
+    for (row_num, row) in enumerate(rows, 1):
+      row = self._CoerceRow(row_num, row)
+      if row is not None:
+        yield row
+
+  def _CoerceRow(self, row_num, row):
+    values = list(row)
+    try:
+      for (i, convert) in self.converters:
+        if i < len(values):
+          values[i] = convert(values[i])
+    except ValueError, e:
+      self.rejected += 1
+      if self.reject:
+        self.reject(row_num, row, e)
+      return None
+    return tuple(values)
+
+  def _CoerceBatches(self, rows):
+    import itertools
+    rows = iter(rows)
+    row_num = 1
+    while True:
+      batch = list(itertools.islice(rows, self.batch_size))
+      if not batch:
+        return
+      for row in self._CoerceBatch(row_num, batch):
+        yield row
+      row_num += len(batch)
+
+  def _CoerceBatch(self, first_row_num, batch):
+    lengths = set(map(len, batch))
+    # The columns can only be taken apart when every row has all of them.
+    if len(lengths) == 1 and lengths.pop() >= self.width:
+      columns = zip(*batch)
+      try:
+        for (i, convert) in self.converters:
+          columns[i] = map(convert, columns[i])
+      except ValueError:
+        pass
+      else:
+        return zip(*columns)
+    return [row for row in (self._CoerceRow(row_num, values)
+                            for (row_num, values) in enumerate(batch, first_row_num))
+            if row is not None]
+
+
+class RejectWriter(object):
+  """Write the rejected rows to a file, in the format they were read in.
+
+  The file can be fixed up and given back as input, while the reasons are
+  only reported for the first rejected row.
+  """
+
+  def __init__(self, fh, delimiter=None, quoting=True):
+    self.fh = fh
+    self.delimiter = delimiter
+    self.writer = delimiter and quoting and csv.writer(fh, delimiter=delimiter) or None
+    self.count = 0
+    self.first = None
+
+  def __call__(self, row_num, values, error):
+    if self.writer:
+      self.writer.writerow(values)
+    else:
+      self.fh.write((self.delimiter or ' ').join(values) + '\n')
+    self.count += 1
+    if self.first is None:
+      self.first = (row_num, error)
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Feed one stream of rows to several consumers, each on a thread of its own.
+
+The rows are read once and queued for each of the consumers, up to a bounded
+number of rows, so that a consumer that is slow to write only holds up the
+reading, and with it the others, once it is that far behind.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import Queue
+import threading
+
+
+# Marks the end of the rows in the queues.
+_END = object()
+
+
+class FanOut(object):
+  """Dispatch the rows to every consumer concurrently.
+
+  Methods:
+    Run: Feed the rows to the consumers, and collect their results.
+  """
+
+  def __init__(self, consumers, depth=1000):
+    """
+    The consumers are functions that take an iterator over the rows. Up to
+    depth rows are held for each.
+    """
+    self.consumers = consumers
+    self.depth = depth
+
+  def Run(self, rows):
+    """
+    Feed the rows to all the consumers, and return the (result, exception)
+    of each of them in order, one of which is None. A consumer that fails
+    doesn't stop the others.
+    """
+    feeds = [_Feed(self.depth) for consumer in self.consumers]
+    results = [None] * len(self.consumers)
+    threads = [threading.Thread(target=self._Consume, args=(i, consumer, feed, results))
+               for (i, (consumer, feed)) in enumerate(zip(self.consumers, feeds))]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    try:
+      for row in rows:
+        for feed in feeds:
+          feed.Put(row)
+    finally:
+      for feed in feeds:
+        feed.Close()
+      for thread in threads:
+        thread.join()
+    return results
+
+  def _Consume(self, i, consumer, feed, results):
+    try:
+      results[i] = (consumer(iter(feed)), None)
+    except Exception, e:
+      results[i] = (None, e)
+    # Take the rest of the rows, so that reading isn't held up by this one.
+    feed.Discard()
+
+
+class _Feed(object):
+  """The rows queued for one of the consumers."""
+
+  def __init__(self, depth):
+    self.queue = Queue.Queue(maxsize=depth)
+    self.discarding = False
+    self.ended = False
+
+  def Put(self, row):
+    if not self.discarding:
+      self.queue.put(row)
+
+  def Close(self):
+    self.queue.put(_END)
+
+  def __iter__(self):
+    while not self.ended:
+      row = self.queue.get()
+      if row is _END:
+        self.ended = True
+        return
+      yield row
+
+  def Discard(self):
+    self.discarding = True
+    for row in self:
+      pass
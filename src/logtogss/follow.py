@@ -0,0 +1,260 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Insert the lines appended to a file as it grows, like tail -F.
+
+The lines are inserted in batches, once batch_size lines are pending or
+flush_interval seconds after the first of them was read, and the position
+after the last inserted line is recorded in a state file, along with the
+identity (device and inode) of the file. A restarted run continues from
+there, also when the file was rotated since, as long as the rotated file is
+in the same directory under a name starting with the name of the file, e.g.
+app.log.1. A line is inserted again only if the run stops between inserting
+its batch and recording the position.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import os
+import signal
+import sys
+import time
+
+
+def read_state(state_file):
+  """Return the (device, inode, offset) recorded in the state file, or None."""
+  try:
+    with open(state_file) as fh:
+      (dev, ino, offset) = [int(field) for field in fh.read().split()]
+  except (IOError, ValueError):
+    return None
+  return (dev, ino, offset)
+
+
+def write_state(state_file, dev, ino, offset):
+  # Write then rename, so that a run that is killed never leaves a partial file.
+  tmp_file = '%s.%d' % (state_file, os.getpid())
+  with open(tmp_file, 'w') as fh:
+    fh.write('%d %d %d\n' % (dev, ino, offset))
+  os.rename(tmp_file, state_file)
+
+
+def find_rotated(path, dev, ino):
+  """
+  Return the path of the file with the given device and inode that path was
+  rotated to, looking at the files next to it with names that start with
+  its name, or None.
+  """
+  (dirname, basename) = os.path.split(os.path.abspath(path))
+  for name in os.listdir(dirname):
+    if name.startswith(basename) and name != basename:
+      try:
+        st = os.stat(os.path.join(dirname, name))
+      except OSError:
+        continue
+      if (st.st_dev, st.st_ino) == (dev, ino):
+        return os.path.join(dirname, name)
+  return None
+
+
+class Follower(object):
+  """Insert the lines appended to a file, in batches, as it grows.
+
+  The file is read in large chunks as data is appended, and polled every
+  poll_interval seconds while it isn't, so that a busy file takes a read per
+  chunk and a request per batch, and an idle one next to nothing. The
+  follower is taken to be the only writer of the worksheet while it runs, so
+  the first free row is only looked up again after an insert failed.
+
+  Methods:
+    Run: Follow the file until interrupted or terminated, then insert the
+      pending lines.
+    Stop: Have Run stop after the current batch.
+  """
+
+  def __init__(self, inserter, path, cols, state_file, delimiter=None, quoting=True,
+               batch_size=100, flush_interval=1.0, poll_interval=0.25, verbose=False):
+    self.inserter = inserter
+    self.path = path
+    self.cols = cols
+    self.state_file = state_file
+    self.delimiter = delimiter
+    self.quoting = quoting
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.poll_interval = poll_interval
+    self.verbose = verbose
+    self.tags = inserter.MapColumnTags(cols)
+    self.fd = None
+    # The complete lines read and not inserted yet, which start at offset,
+    # followed by the start of a line still being written.
+    self.pending = []
+    self.tail = ''
+    self.offset = 0
+    self.deadline = None
+    # The first row and the number of lines of the batch being inserted, once
+    # rows are reserved for it, so that a retry writes to the same rows.
+    self.reserved = None
+    # Whether the last attempt to insert a batch failed.
+    self.failed = False
+    # Set on termination, to stop between batches.
+    self.stopping = False
+
+  def _Open(self):
+    """Open the file, at the position recorded in the state file if any."""
+    st = os.stat(self.path)
+    state = read_state(self.state_file)
+    path = self.path
+    offset = st.st_size
+    if state is not None:
+      (dev, ino, offset) = state
+      if (dev, ino) != (st.st_dev, st.st_ino):
+        # Rotated since. The rest of the old file is read first, if it's still
+        # around, and the new one is switched to at its end, as usual.
+        path = find_rotated(self.path, dev, ino)
+        if path is None:
+          print >> sys.stderr, ("The file followed before wasn't found next to %s, "
+                                "continuing from the start of it" % self.path)
+          (path, offset) = (self.path, 0)
+    self.fd = os.open(path, os.O_RDONLY)
+    if offset > os.fstat(self.fd).st_size:
+      # Truncated since.
+      offset = 0
+    os.lseek(self.fd, offset, os.SEEK_SET)
+    self.offset = offset
+    if self.verbose:
+      print >> sys.stderr, 'Following %s from offset %d' % (path, offset)
+
+  def _Read(self):
+    """Read what is available, and return whether there was anything."""
+    data = os.read(self.fd, 1 << 16)
+    if not data:
+      return False
+    lines = (self.tail + data).split('\n')
+    self.tail = lines.pop()
+    if lines:
+      if not self.pending:
+        self.deadline = time.time() + self.flush_interval
+      self.pending.extend(lines)
+    return True
+
+  def _Flush(self, whole_batches=False):
+    """
+    Insert the pending lines, in batches, recording the position after each
+    batch. With whole_batches, the lines that don't fill a batch are left
+    for later. Returns whether the lines were inserted.
+    """
+    st = os.fstat(self.fd)
+    while self.pending and (self.reserved or not whole_batches or
+                            len(self.pending) >= self.batch_size):
+      lines = self.pending[:self.reserved and self.reserved[1] or self.batch_size]
+      # Blank lines would end the rows as the list feed sees them.
+      rows = [row for row in self.inserter.ReadTuples(self.cols, lines, delimiter=self.delimiter,
+                                                      quoting=self.quoting)
+              if any(value.strip() for value in row)]
+      try:
+        if rows:
+          if self.reserved is None:
+            if self.failed:
+              # The layout may be what made the reservation fail.
+              self.inserter.ResolveCellLayout()
+            self.reserved = (self.inserter.ReserveRows(len(rows)), len(lines))
+          else:
+            # Part of the batch may have been written, so write it over.
+            self.reserved = (self.inserter.RenewReservation(self.reserved[0], len(rows)),
+                             len(lines))
+          self.inserter.WriteTuples(self.reserved[0], self.tags, rows)
+      except Exception, e:
+        print >> sys.stderr, 'Failed to insert %d rows, to retry: %s' % (len(rows), e)
+        self.failed = True
+        return False
+      self.reserved = None
+      self.failed = False
+      del self.pending[:len(lines)]
+      self.offset += sum(len(line) + 1 for line in lines)
+      write_state(self.state_file, st.st_dev, st.st_ino, self.offset)
+      if self.verbose:
+        print >> sys.stderr, 'Committed %d rows, up to offset %d' % (len(rows), self.offset)
+    return True
+
+  def _Reopen(self):
+    """
+    Switch to the file now at the path, if the one read was rotated or
+    truncated, once all its lines are inserted. Returns whether it switched.
+    """
+    try:
+      st = os.stat(self.path)
+    except OSError:
+      # Being rotated.
+      return False
+    fst = os.fstat(self.fd)
+    rotated = (st.st_dev, st.st_ino) != (fst.st_dev, fst.st_ino)
+    if not rotated and fst.st_size >= os.lseek(self.fd, 0, os.SEEK_CUR):
+      return False
+    # The last line read may have no line end.
+    if self.tail:
+      self.pending.append(self.tail)
+    self.tail = ''
+    if not self._Flush():
+      return False
+    if rotated:
+      os.close(self.fd)
+      self.fd = os.open(self.path, os.O_RDONLY)
+      st = os.fstat(self.fd)
+    else:
+      os.lseek(self.fd, 0, os.SEEK_SET)
+      st = fst
+    self.offset = 0
+    write_state(self.state_file, st.st_dev, st.st_ino, 0)
+    if self.verbose:
+      print >> sys.stderr, '%s was %s, following it from the start' % (
+          self.path, rotated and 'rotated' or 'truncated')
+    return True
+
+  def Stop(self, signum=None, frame=None):
+    """Stop following after the current batch, then insert the pending lines."""
+    self.stopping = True
+
+  def Run(self):
+    # Stop between batches on termination, rather than exit in the middle of
+    # one, which would then be inserted again.
+    signal.signal(signal.SIGTERM, self.Stop)
+    self._Open()
+    try:
+      while not self.stopping:
+        # Read no further ahead than a batch, also while the inserts fail.
+        read = len(self.pending) < self.batch_size and self._Read()
+        if self.pending and (len(self.pending) >= self.batch_size or time.time() >= self.deadline):
+          if not self._Flush(whole_batches=time.time() < self.deadline):
+            time.sleep(self.flush_interval)
+        elif not read and not self._Reopen():
+          timeout = self.poll_interval
+          if self.pending:
+            timeout = max(0, min(timeout, self.deadline - time.time()))
+          time.sleep(timeout)
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self._Flush()
+      os.close(self.fd)
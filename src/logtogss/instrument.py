@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Record where the time of a run goes.
+
+The phases of a run (authentication, name resolution, feed reads, inserts and
+the HTTP requests under them) are timed as they complete, and summed up per
+phase, along with the bytes sent and received. The summary can be printed at
+exit, and every completed phase can also be logged as a JSON line, to look
+into a single slow run after the fact. Phases nest, so their times overlap.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import functools
+import threading
+import time
+
+
+class Recorder(object):
+  """Collect the timings of the phases, and counters, from all threads.
+
+  Methods:
+    Phase: A context manager that times a phase.
+    Add: Record a phase that took the given time.
+    Count: Increase a counter.
+    Summary: The totals per phase, and the counters.
+  """
+
+  def __init__(self, log=None):
+    """Write a JSON line for each completed phase to the log file, if given."""
+    self.log = log
+    self.started = time.time()
+    # name -> [count, total secs, max secs]
+    self.phases = {}
+    self.counters = {}
+    self.lock = threading.Lock()
+
+  def Phase(self, name, **fields):
+    return _Phase(self, name, fields)
+
+  def Add(self, name, secs, **fields):
+    line = None
+    if self.log:
+      # Outside the lock, which the other threads wait on for every request.
+      import json
+      fields.update(ts=round(time.time(), 3), phase=name, secs=round(secs, 6))
+      line = json.dumps(fields) + '\n'
+    with self.lock:
+      phase = self.phases.get(name)
+      if phase is None:
+        phase = self.phases[name] = [0, 0.0, 0.0]
+      phase[0] += 1
+      phase[1] += secs
+      phase[2] = max(phase[2], secs)
+      if line:
+        self.log.write(line)
+
+  def Count(self, name, n=1):
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + n
+
+  def Summary(self):
+    lines = ['Timings (%.2fs in all):' % (time.time() - self.started)]
+    for (name, (count, total, longest)) in sorted(self.phases.items(), key=lambda p: -p[1][1]):
+      lines.append('  %-14s %6d x %9.3fs  (avg %8.1fms, max %8.1fms)' %
+                   (name, count, total, total * 1000 / count, longest * 1000))
+    counters = self.counters
+    lines.append('Requests: %d, %s sent, %s received, %d retried' %
+                 (counters.get('requests', 0), format_bytes(counters.get('bytes sent', 0)),
+                  format_bytes(counters.get('bytes received', 0)), counters.get('retries', 0)))
+    if self.log:
+      import json
+      self.log.write(json.dumps({'ts': round(time.time(), 3), 'summary': {
+          'secs': round(time.time() - self.started, 6), 'counters': counters,
+          'phases': dict((name, {'count': count, 'secs': round(total, 6), 'max': round(longest, 6)})
+                         for (name, (count, total, longest)) in self.phases.items())}}) + '\n')
+      self.log.flush()
+    return '\n'.join(lines)
+
+
+class _Phase(object):
+
+  def __init__(self, recorder, name, fields):
+    self.recorder = recorder
+    self.name = name
+    self.fields = fields
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    if exc_type is not None:
+      self.fields['error'] = exc_type.__name__
+    self.recorder.Add(self.name, time.time() - self.start, **self.fields)
+
+
+def timed(phase):
+  """
+  Decorate a method to time it as the phase, in the recorder of its object,
+  if it has one.
+  """
+  def decorate(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+      if self.recorder is None:
+        return method(self, *args, **kwargs)
+      with self.recorder.Phase(phase):
+        return method(self, *args, **kwargs)
+    return wrapper
+  return decorate
+
+
+def format_bytes(num):
+  if num < 1024:
+    return '%d B' % num
+  for unit in ('KB', 'MB', 'GB'):
+    num /= 1024.0
+    if num < 1024 or unit == 'GB':
+      return '%.1f %s' % (num, unit)
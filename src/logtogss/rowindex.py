@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""An index of the rows of a worksheet by the value of a key column.
+
+The index is built from the list feed, and kept in a file along with the time
+the worksheet was last updated then, or by the last row written through it,
+so that a later run can reuse it as long as nothing else changed the
+worksheet since, to insert a row or update the one with the same key instead
+of adding a duplicate. The rows are known by their list entry ids, which
+depend on their position, so any other change calls for a new index.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import os
+import pickle
+
+
+class RowIndex(object):
+  """The rows of a worksheet, by their id and by the value of the key column.
+
+  Methods:
+    Add: Add or replace a row.
+    Lookup: Find the row with a key.
+    Load: Read an index from a file.
+    Save: Write the index to a file.
+
+  Extra properties:
+    tags: The column tags of the worksheet, in order.
+    updated: When the worksheet was last updated, as of the rows indexed, or
+      by the last row written through the index.
+  """
+
+  def __init__(self, key_tag, tags=None, updated=None):
+    self.key_tag = key_tag
+    self.tags = tags
+    self.updated = updated
+    # entry id -> (edit url, tuple of values in the order of the tags)
+    self.rows = {}
+    # key -> entry id, of the first row with the key.
+    self.keys = {}
+
+  def __len__(self):
+    return len(self.rows)
+
+  def Add(self, entry_id, edit_url, values):
+    """Add or replace the row, given the (tag, value) of each of its columns."""
+    if self.tags is None:
+      self.tags = [tag for (tag, value) in values]
+    self.Remove(entry_id)
+    values = dict(values)
+    self.rows[entry_id] = (edit_url, tuple(values.get(tag, '') for tag in self.tags))
+    key = values.get(self.key_tag)
+    if key and key not in self.keys:
+      self.keys[key] = entry_id
+
+  def Remove(self, entry_id):
+    row = self.rows.pop(entry_id, None)
+    if row is not None:
+      key = dict(zip(self.tags, row[1])).get(self.key_tag)
+      if self.keys.get(key) == entry_id:
+        del self.keys[key]
+
+  def Lookup(self, key):
+    """
+    Return the id, edit link and values (keyed by tag) of the row with the
+    key, or None.
+    """
+    entry_id = self.keys.get(key)
+    if entry_id is None:
+      return None
+    (edit_url, values) = self.rows[entry_id]
+    return (entry_id, edit_url, dict(zip(self.tags, values)))
+
+  @classmethod
+  def Load(cls, index_file):
+    """Return the index stored in the file, or None if there is none."""
+    try:
+      with open(index_file, 'rb') as fh:
+        return pickle.load(fh)
+    except IOError, e:
+      return None
+    except Exception, e:
+      # A corrupt index is no worse than a missing one.
+      return None
+
+  def Save(self, index_file):
+    # Write then rename, so that concurrent runs never see a partial file.
+    tmp_file = '%s.%d' % (index_file, os.getpid())
+    with open(tmp_file, 'wb') as fh:
+      os.fchmod(fh.fileno(), 0600)
+      pickle.dump(self, fh, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, index_file)
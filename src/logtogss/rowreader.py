@@ -0,0 +1,121 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Parse the input lines into rows of values.
+
+Rows are produced as tuples, with the values in the order of the columns
+given on the command line, so that nothing needs to be looked up per row.
+Input is read from the file descriptor in large chunks, whatever is available
+at the time, so that a slow pipe isn't held back waiting for a full buffer.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import os
+
+
+def read_lines(fh, bufsize=1 << 16, keepends=False):
+  """Generate the lines of fh, without the line terminators unless keepends."""
+  try:
+    fd = fh.fileno()
+    read = lambda: os.read(fd, bufsize)
+  except (AttributeError, IOError):
+    # Not a real file, e.g. a StringIO.
+    read = lambda: fh.read(bufsize)
+  tail = ''
+  while True:
+    chunk = read()
+    if not chunk:
+      break
+    lines = (tail + chunk).split('\n')
+    tail = lines.pop()
+    if keepends:
+      for line in lines:
+        yield line + '\n'
+    else:
+      for line in lines:
+        yield line
+  if tail:
+    yield tail
+
+
+class RowReader(object):
+  """Parse lines into tuples of values.
+
+  The values are separated by whitespace by default, with the last column
+  taking the rest of the line. Given a delimiter, the values are split on
+  it instead, with support for quoted values (as in CSV) unless quoting is
+  False.
+
+  Methods:
+    ParseLines: Generate a tuple for each of the lines.
+    Read: Generate a tuple for each line read from a file.
+    Records: Generate the lines of each record.
+  """
+
+  def __init__(self, cols, delimiter=None, quoting=True, bufsize=1 << 16):
+    self.cols = cols
+    self.delimiter = delimiter
+    self.quoting = quoting
+    self.bufsize = bufsize
+
+  def ParseLines(self, lines):
+    """Generate a tuple of values for each line (or record, if quoted)."""
+    if self.delimiter and self.quoting:
+      import csv
+      return (tuple(vals) for vals in csv.reader(lines, delimiter=self.delimiter))
+    if self.delimiter:
+      delimiter = self.delimiter
+      return (tuple(line.rstrip('\r\n').split(delimiter)) for line in lines)
+    maxsplit = len(self.cols) - 1
+    return (tuple(line.rstrip().split(None, maxsplit)) for line in lines)
+
+  def Records(self, lines):
+    """
+    Generate a list of the lines (with their line ends) that make up each
+    record, which is more than one line when a quoted value spans lines.
+    """
+    if not (self.delimiter and self.quoting):
+      return ([line] for line in lines)
+    return self._CsvRecords(lines)
+
+  def _CsvRecords(self, lines):
+    import csv
+    # The csv reader takes the lines one at a time, only as many as the
+    # record needs, so the lines taken for each record are its own.
+    taken = []
+
+    def take():
+      for line in lines:
+        taken.append(line)
+        yield line
+
+    for vals in csv.reader(take(), delimiter=self.delimiter):
+      yield taken[:]
+      del taken[:]
+
+  def Read(self, fh):
+    """Generate a tuple of values for each line read from fh."""
+    # The csv reader needs the line ends to keep them in quoted values.
+    keepends = bool(self.delimiter and self.quoting)
+    return self.ParseLines(read_lines(fh, self.bufsize, keepends))
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""A long running server that receives rows over a local socket.
+
+Each line received is parsed the same way as a line read from stdin, and the
+rows are inserted in batches by a single, already authenticated inserter. This
+avoids paying for the process startup, authentication and name resolution for
+every row, e.g.:
+
+  $ logtogss --serve /tmp/logtogss.sock --name 'Spreadsheet Name' col1 col2 &
+  $ echo 'val1 val2' | nc -U /tmp/logtogss.sock
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import Queue
+import SocketServer
+
+
+class HandlerThreadsMixIn(SocketServer.ThreadingMixIn):
+  """
+  Handle each connection in its own thread, keeping track of the threads and
+  their connections, so that shutdown can stop reading from the clients and
+  wait for the threads still handling them (see close_connections).
+  """
+
+  def process_request(self, request, client_address):
+    thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+    with self.lock:
+      # Before starting it, so that no thread is missed on shutdown.
+      self.connections[thread] = request
+    thread.start()
+
+  def process_request_thread(self, request, client_address):
+    try:
+      SocketServer.ThreadingMixIn.process_request_thread(self, request, client_address)
+    finally:
+      with self.lock:
+        del self.connections[threading.current_thread()]
+
+  def close_connections(self):
+    """Stop reading from the connected clients, and wait for their threads."""
+    with self.lock:
+      connections = self.connections.items()
+    for (thread, connection) in connections:
+      try:
+        connection.shutdown(socket.SHUT_RD)
+      except socket.error:
+        pass
+    for (thread, connection) in connections:
+      thread.join()
+
+
+class ThreadingUnixServer(HandlerThreadsMixIn, SocketServer.UnixStreamServer):
+  pass
+
+
+class ThreadingTCPServer(HandlerThreadsMixIn, SocketServer.TCPServer):
+  allow_reuse_address = True
+
+
+def make_server(address, handler_class):
+  """
+  Create a server listening on a unix socket, if the address is a path, or
+  else on a TCP port given as [host:]port, with the host defaulting to
+  localhost.
+  """
+  if '/' in address:
+    if os.path.exists(address):
+      # Left behind by a previous run.
+      os.unlink(address)
+    server = ThreadingUnixServer(address, handler_class)
+  else:
+    (host, _, port) = address.rpartition(':')
+    server = ThreadingTCPServer((host or 'localhost', int(port)), handler_class)
+  server.connections = {}
+  server.lock = threading.Lock()
+  return server
+
+
+class RowServer(object):
+  """Receive rows over a socket and insert them in batches.
+
+  Rows are queued as they are received and a single flusher thread inserts
+  them, as soon as batch_size rows have accumulated, or flush_interval seconds
+  after the first row of the batch arrived. The server is taken to be the
+  only writer of the worksheet while it runs, so the first free row is only
+  looked up again after a write failed. A batch that failed is retried into
+  the same rows until it goes through, holding up the rest, or on stopping
+  max_retries more times before its rows are written to stderr.
+
+  Methods:
+    serve_forever: Serve until interrupted or terminated, then flush the
+      pending rows.
+  """
+
+  class RowHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+      """Queue a row for each line received."""
+      rowserver = self.server.rowserver
+      for data in rowserver.inserter.ReadRows(rowserver.cols, self.rfile,
+                                              verbose=rowserver.verbose,
+                                              delimiter=rowserver.delimiter,
+                                              quoting=rowserver.quoting):
+        rowserver.rows.put(data)
+
+  def __init__(self, inserter, cols, address, delimiter=None, quoting=True, batch_size=100,
+               flush_interval=1.0, verbose=False, max_retries=3):
+    self.inserter = inserter
+    self.cols = cols
+    self.address = address
+    self.delimiter = delimiter
+    self.quoting = quoting
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.verbose = verbose
+    self.max_retries = max_retries
+    # Bounded, so that the clients block rather than the memory growing when
+    # the spreadsheet can't keep up.
+    self.rows = Queue.Queue(maxsize=batch_size * 10)
+    # Closing once serving stopped, and stopping once the end marker is read.
+    self.closing = False
+    self.stopping = False
+    self.server = make_server(address, self.RowHandler)
+    self.server.rowserver = self
+
+  def next_batch(self):
+    """Wait for the next batch of rows, or None once stopped and drained."""
+    if self.stopping:
+      # Take whatever is still queued, without waiting for more.
+      batch = []
+      while len(batch) < self.batch_size:
+        try:
+          data = self.rows.get_nowait()
+        except Queue.Empty:
+          break
+        if data is not None:
+          batch.append(data)
+      return batch or None
+    data = self.rows.get()
+    if data is None:
+      self.stopping = True
+      return self.next_batch()
+    batch = [data]
+    deadline = time.time() + self.flush_interval
+    while len(batch) < self.batch_size:
+      timeout = deadline - time.time()
+      if timeout <= 0:
+        break
+      try:
+        data = self.rows.get(timeout=timeout)
+      except Queue.Empty:
+        break
+      if data is None:
+        # Flush what we have, and drain the rest on the next calls.
+        self.stopping = True
+        break
+      batch.append(data)
+    return batch
+
+  def flush_rows(self):
+    """Insert the queued rows in batches until stopped."""
+    while True:
+      batch = self.next_batch()
+      if batch is None:
+        return
+      first_row_num = None
+      failures = 0
+      while True:
+        try:
+          if first_row_num is None:
+            first_row_num = self.inserter.ReserveRows(len(batch))
+          elif failures:
+            # The layout may be what made the write fail (e.g. a 404 or 409).
+            first_row_num = self.inserter.RenewReservation(first_row_num, len(batch))
+          self.inserter.WriteRows(first_row_num, batch)
+        except Exception, e:
+          failures += 1
+          print >> sys.stderr, 'Failed to insert %d rows: %s' % (len(batch), e)
+          if self.closing and failures > self.max_retries:
+            self.give_up(batch)
+            break
+          time.sleep(self.flush_interval)
+        else:
+          if self.verbose:
+            print >> sys.stderr, 'Committed %d rows' % len(batch)
+          break
+
+  def give_up(self, batch):
+    """Write the rows that couldn't be inserted to stderr, tab separated."""
+    print >> sys.stderr, 'Gave up on %d rows:' % len(batch)
+    for data in batch:
+      print >> sys.stderr, '\t'.join(data.get(col) or '' for col in self.cols)
+
+  def serve_forever(self):
+    flusher = threading.Thread(target=self.flush_rows)
+    flusher.start()
+    # Exit through the finally clause on termination too, to flush the rows.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+      self.server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.server.server_close()
+      self.closing = True
+      # Wait for what the clients still connected already sent to be queued,
+      # so that no row comes after the end marker.
+      self.server.close_connections()
+      self.rows.put(None)
+      flusher.join()
+      if '/' in self.address and os.path.exists(self.address):
+        os.unlink(self.address)
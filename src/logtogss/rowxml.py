@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Serialize the rows to Atom XML without building gdata element trees.
+
+All the rows inserted into a sheet have the same columns, so the XML of their
+list entries only differs in the values. The templates here are compiled once
+from the column tags, and only escape and fill in the values for each row.
+The responses to batch requests are likewise only scanned for the statuses,
+and the list feed only for the ids, edit links and values of the rows.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import xml.etree.cElementTree as ElementTree
+
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+GSX_NS = 'http://schemas.google.com/spreadsheets/2006/extended'
+GS_NS = 'http://schemas.google.com/spreadsheets/2006'
+BATCH_NS = 'http://schemas.google.com/gdata/batch'
+OPENSEARCH_NS = 'http://a9.com/-/spec/opensearch/1.1/'
+
+
+def _utf8(value):
+  if value is None:
+    return ''
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  return str(value)
+
+
+def escape_text(value):
+  """Escape a value for use as the text of an element."""
+  value = _utf8(value)
+  if '&' in value:
+    value = value.replace('&', '&amp;')
+  if '<' in value:
+    value = value.replace('<', '&lt;')
+  if '>' in value:
+    value = value.replace('>', '&gt;')
+  return value
+
+
+def escape_attr(value):
+  """Escape a value for use in a double quoted attribute."""
+  value = escape_text(value)
+  # Line ends and tabs in attributes are normalized to spaces, unless escaped.
+  for (char, entity) in (('"', '&quot;'), ('\n', '&#10;'), ('\r', '&#13;'), ('\t', '&#9;')):
+    if char in value:
+      value = value.replace(char, entity)
+  return value
+
+
+class ListEntryTemplate(object):
+  """Serialize rows with the given column tags as list feed entries.
+
+  Methods:
+    Serialize: Return the entry XML for a tuple of values.
+  """
+
+  def __init__(self, tags):
+    self.tags = tuple(tags)
+    self.num_tags = len(self.tags)
+    self.format = ('<entry xmlns="%s" xmlns:gsx="%s">' % (ATOM_NS, GSX_NS) +
+                   ''.join('<gsx:%s>%%s</gsx:%s>' % (tag, tag)
+                           for tag in (t.replace('%', '%%') for t in self.tags)) +
+                   '</entry>')
+
+  def Serialize(self, values, entry_id=None):
+    """
+    Return the entry for the values, in the order of the tags. Missing values
+    are left empty and extra ones are ignored. The id is needed to update an
+    existing entry.
+    """
+    values = [escape_text(value) for value in values[:self.num_tags]]
+    if len(values) < self.num_tags:
+      values.extend([''] * (self.num_tags - len(values)))
+    xml = self.format % tuple(values)
+    if entry_id is not None:
+      xml = xml.replace('>', '><id>%s</id>' % escape_text(entry_id), 1)
+    return xml
+
+
+def cells_batch_feed(feed_url, cells):
+  """
+  Return a cells batch feed to set the (row, col, value) cells of the
+  worksheet whose cells feed is at feed_url.
+  """
+  parts = ['<feed xmlns="%s" xmlns:batch="%s" xmlns:gs="%s"><id>%s</id>' %
+           (ATOM_NS, BATCH_NS, GS_NS, feed_url)]
+  url = feed_url.replace('%', '%%')
+  entry_format = ('<entry><batch:id>R%dC%d</batch:id><batch:operation type="update"/>'
+                  '<id>' + url + '/R%dC%d</id>'
+                  '<link rel="edit" type="application/atom+xml" href="' + url + '/R%dC%d"/>'
+                  '<gs:cell row="%d" col="%d" inputValue="%s"/></entry>')
+  for (row, col, value) in cells:
+    parts.append(entry_format % (row, col, row, col, row, col, row, col, escape_attr(value)))
+  parts.append('</feed>')
+  return ''.join(parts)
+
+
+def cells_batch_template(feed_url, cells):
+  """
+  Like cells_batch_feed, but for cells with row numbers relative to the
+  first row of the batch, which isn't known yet. Returns a format string,
+  which fill_rows turns into the feed.
+  """
+  url = feed_url.replace('%', '%%')
+  parts = ['<feed xmlns="%s" xmlns:batch="%s" xmlns:gs="%s"><id>%s</id>' %
+           (ATOM_NS, BATCH_NS, GS_NS, url)]
+  url = url.replace('%', '%%')
+  entry_format = ('<entry><batch:id>R%sC%d</batch:id><batch:operation type="update"/>'
+                  '<id>' + url + '/R%sC%d</id>'
+                  '<link rel="edit" type="application/atom+xml" href="' + url + '/R%sC%d"/>'
+                  '<gs:cell row="%s" col="%d" inputValue="%s"/></entry>')
+  for (row, col, value) in cells:
+    row = '%%(%d)d' % row
+    parts.append(entry_format % (row, col, row, col, row, col, row, col,
+                                 escape_attr(value).replace('%', '%%')))
+  parts.append('</feed>')
+  return ''.join(parts)
+
+
+def fill_rows(template, first_row_num, num_rows):
+  """Return the feed of a cells_batch_template for the rows from first_row_num."""
+  return template % dict((str(offset), first_row_num + offset) for offset in xrange(num_rows))
+
+
+def batch_statuses(xml):
+  """
+  Return the (batch id, status code, reason) of each entry in the response
+  to a batch request.
+  """
+  statuses = []
+  for entry in ElementTree.fromstring(xml).iter('{%s}entry' % ATOM_NS):
+    status = entry.find('{%s}status' % BATCH_NS)
+    if status is not None:
+      statuses.append((entry.findtext('{%s}id' % BATCH_NS), int(status.get('code')),
+                       status.get('reason')))
+  return statuses
+
+
+def cell_rows(xml):
+  """Return the row number of each cell of a cells feed, in order."""
+  return [int(cell.get('row'))
+          for cell in ElementTree.fromstring(xml).iter('{%s}cell' % GS_NS)]
+
+
+def _list_entry(entry):
+  edit_url = None
+  for link in entry.findall('{%s}link' % ATOM_NS):
+    if link.get('rel') == 'edit':
+      edit_url = link.get('href')
+  prefix = '{%s}' % GSX_NS
+  values = [(el.tag[len(prefix):], _utf8(el.text)) for el in entry if el.tag.startswith(prefix)]
+  return (entry.findtext('{%s}id' % ATOM_NS), edit_url, values)
+
+
+def parse_list_entry(xml):
+  """
+  Return the id, the edit link and the (tag, value) of each column of a list
+  entry, with the values encoded in UTF-8, and the time it was last updated.
+  """
+  entry = ElementTree.fromstring(xml)
+  return _list_entry(entry) + (entry.findtext('{%s}updated' % ATOM_NS),)
+
+
+def parse_list_feed(xml):
+  """
+  Return the total number of results, the time it was last updated and the
+  entries (as parse_list_entry returns them, but for the time) of a list
+  feed page.
+  """
+  feed = ElementTree.fromstring(xml)
+  return (int(feed.findtext('{%s}totalResults' % OPENSEARCH_NS) or 0),
+          feed.findtext('{%s}updated' % ATOM_NS),
+          [_list_entry(entry) for entry in feed.findall('{%s}entry' % ATOM_NS)])
@@ -0,0 +1,291 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Load a large input file with a pool of processes.
+
+For large files, parsing the lines and serializing the rows to XML keeps a
+single process busy for longer than the requests take. Instead, the file is
+memory mapped and split into shards of whole lines, which the processes parse
+and serialize, while the main process only uploads the payloads they send
+back, in the order of the shards. Through the cells feed, the payloads are
+serialized with row numbers relative to their first row, and rows are
+reserved for each shard that parsed as its payloads arrive, in the order of
+the file, so they keep that order no matter which upload finishes first.
+
+Each line must be a row, i.e. quoted values can't span lines, as the shards
+are split at any line end.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import collections
+import contextlib
+import mmap
+import multiprocessing
+import os
+import sys
+import threading
+import Queue
+
+import rowreader
+import rowxml
+
+
+def mapped(path):
+  """Return the file memory mapped for reading, to use in a with statement."""
+  with open(path, 'rb') as fh:
+    return contextlib.closing(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def find_shards(path, shard_size):
+  """
+  Return the (start, end) offsets of the shards of the file, each with the
+  whole lines that start in the next shard_size bytes.
+  """
+  size = os.path.getsize(path)
+  shards = []
+  if not size:
+    # An empty file can't be mapped.
+    return shards
+  with mapped(path) as data:
+    start = 0
+    while start < size:
+      end = data.find('\n', min(start + shard_size, size) - 1)
+      end = end < 0 and size or end + 1
+      shards.append((start, end))
+      start = end
+  return shards
+
+
+def shard_lines(data, start, end):
+  """Generate the lines, with their line ends, of the mapped data between the offsets."""
+  data.seek(start)
+  while data.tell() < end:
+    yield data.readline()
+
+
+class ShardSerializer(object):
+  """Parse the lines of a shard and serialize the rows, in a worker process.
+
+  The rows are serialized as a list entry each, or, given the url of the
+  cells feed and the column numbers, as cells batch feeds of batch_size rows.
+  Instances are sent to the worker processes, so only keep what pickles.
+  """
+
+  def __init__(self, path, cols, tags, delimiter=None, quoting=True, feed_url=None,
+               col_nums=None, batch_size=1):
+    self.path = path
+    self.cols = cols
+    self.tags = tags
+    self.delimiter = delimiter
+    self.quoting = quoting
+    self.feed_url = feed_url
+    self.col_nums = col_nums
+    self.batch_size = batch_size
+
+  def Parse(self, lines):
+    """Return the rows of the lines, checking that there is one for each."""
+    reader = rowreader.RowReader(self.cols, self.delimiter, self.quoting)
+    rows = list(reader.ParseLines(lines))
+    if len(rows) != len(lines):
+      raise Exception("Found %d rows in %d lines, quoted values can't span lines" %
+                      (len(rows), len(lines)))
+    return rows
+
+  def __call__(self, shard):
+    """
+    Parse the lines of the (start, end) shard and serialize the rows. Returns
+    the number of lines, and the (num_rows, xml) payloads and None, or else
+    None and the error as a string. For the cells feed, the payloads are
+    rowxml.cells_batch_template ones, with the row numbers to fill in.
+    """
+    (start, end) = shard
+    with mapped(self.path) as data:
+      lines = list(shard_lines(data, start, end))
+    try:
+      rows = self.Parse(lines)
+      if self.feed_url is None:
+        template = rowxml.ListEntryTemplate(self.tags)
+        payloads = [(1, template.Serialize(values)) for values in rows]
+      else:
+        payloads = []
+        for offset in xrange(0, len(rows), self.batch_size):
+          batch = rows[offset:offset + self.batch_size]
+          cells = [(row_num, col_num, value)
+                   for (row_num, values) in enumerate(batch)
+                   for (col_num, value) in zip(self.col_nums, values)]
+          payloads.append((len(batch), rowxml.cells_batch_template(self.feed_url, cells)))
+    except Exception, e:
+      return (len(lines), None, str(e) or e.__class__.__name__)
+    return (len(lines), payloads, None)
+
+
+class ShardedLoader(object):
+  """Insert the rows of a file, parsed and serialized by a pool of processes.
+
+  As with InsertTupleStream, the rows are written through the cells feed,
+  with workers concurrent requests, when batching or with more than one
+  worker, and otherwise added one at a time through the list feed.
+
+  Methods:
+    Run: Insert the rows, and return the (first, last) line numbers of those
+      that failed.
+  """
+
+  def __init__(self, inserter, path, cols, processes, batch_size=None, workers=None,
+               delimiter=None, quoting=True, verbose=False, shard_size=1 << 18):
+    self.inserter = inserter
+    self.path = path
+    self.cols = cols
+    self.processes = processes
+    self.batch_size = batch_size or 1
+    self.workers = workers or 1
+    self.delimiter = delimiter
+    self.quoting = quoting
+    self.verbose = verbose
+    # Small enough that the payloads of the shards in flight, which are many
+    # times larger than the lines, don't take too much memory.
+    self.shard_size = shard_size
+
+  def Run(self):
+    shards = find_shards(self.path, self.shard_size)
+    if self.verbose:
+      print >> sys.stderr, 'Columns selected: %s, %d shards' % (self.cols, len(shards))
+    tags = self.inserter.MapColumnTags(self.cols)
+    pool = multiprocessing.Pool(self.processes)
+    try:
+      if self.batch_size > 1 or self.workers > 1:
+        return self._WriteCells(pool, shards, tags)
+      return self._AddEntries(pool, shards, tags)
+    finally:
+      pool.terminate()
+      pool.join()
+
+  def _Serialized(self, pool, serializer, shards):
+    """
+    Generate each shard with the result of serializing it, in order, while
+    the pool serializes up to one more shard per process.
+    """
+    pending = collections.deque()
+    for shard in shards:
+      pending.append((shard, pool.apply_async(serializer, (shard,))))
+      if len(pending) > self.processes:
+        yield pending.popleft()
+    while pending:
+      yield pending.popleft()
+
+  def _AddEntries(self, pool, shards, tags):
+    """Add the rows one at a time, in order. The first failure is raised."""
+    serializer = ShardSerializer(self.path, self.cols, tags, self.delimiter, self.quoting)
+    first_line = 1
+    for (_, result) in self._Serialized(pool, serializer, shards):
+      (num_rows, payloads, error) = result.get()
+      if error is not None:
+        raise Exception('Failed to read lines %d-%d: %s' % (first_line, first_line + num_rows - 1,
+                                                            error))
+      for (_, xml) in payloads:
+        self.inserter.InsertEntryXml(xml)
+      if self.verbose:
+        print >> sys.stderr, 'Lines %d-%d: committed %d rows' % (
+            first_line, first_line + num_rows - 1, num_rows)
+      first_line += num_rows
+    return []
+
+  def _WriteCells(self, pool, shards, tags):
+    """
+    Write the rows to the rows reserved for them, with a pool of uploader
+    threads. The rows of a shard are only reserved once it parsed, so that
+    a shard that fails to parse gets none. It is reported, as is a batch
+    that fails to write, and the rest are still written. The rows of a
+    failed batch are left blank, which the next insert looks past for the
+    last row in use.
+    """
+    failed = []
+    lock = threading.Lock()
+
+    def fail(first_line, last_line, what, e):
+      with lock:
+        failed.append((first_line, last_line))
+        print >> sys.stderr, 'Failed to %s lines %d-%d: %s' % (what, first_line, last_line, e)
+
+    inserter = self.inserter
+    if inserter.col_tag_to_num is None:
+      inserter.ResolveCellLayout()
+    unknown = [tag for tag in tags if tag not in inserter.col_tag_to_num]
+    if unknown:
+      raise Exception("Unknown column tags: %s" % ', '.join(unknown))
+    client = inserter.client
+    (key, wkey) = (inserter.key, inserter.wkey)
+    serializer = ShardSerializer(self.path, self.cols, tags, self.delimiter, self.quoting,
+                                 client.CELLS_URL % (key, wkey),
+                                 [inserter.col_tag_to_num[tag] for tag in tags], self.batch_size)
+    # Bounded, so that serializing can't run too far ahead of the uploads.
+    uploads = Queue.Queue(maxsize=self.workers * 2)
+
+    def upload():
+      while True:
+        payload = uploads.get()
+        if payload is None:
+          return
+        (first_line, row_num, num_rows, template) = payload
+        last_line = first_line + num_rows - 1
+        try:
+          client.PostCellsBatch(rowxml.fill_rows(template, row_num, num_rows), key, wkey)
+        except Exception, e:
+          fail(first_line, last_line, 'insert', e)
+        else:
+          if self.batch_size > 1 or self.verbose:
+            with lock:
+              print >> sys.stderr, 'Lines %d-%d: committed %d rows' % (first_line, last_line,
+                                                                      num_rows)
+
+    threads = [threading.Thread(target=upload) for i in xrange(self.workers)]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    size = shards and shards[-1][1] or 0
+    try:
+      first_line = 1
+      for ((start, end), result) in self._Serialized(pool, serializer, shards):
+        (num_lines, payloads, error) = result.get()
+        if error is not None:
+          fail(first_line, first_line + num_lines - 1, 'read', error)
+        else:
+          last_row_num = inserter.next_row_num + num_lines - 1
+          if last_row_num > inserter.row_count:
+            # Grow the worksheet for the rest of the file too, estimated from
+            # the lines read so far, rather than once for every shard.
+            inserter.GrowWorksheet(last_row_num + (size - end) * (first_line + num_lines - 1) // end)
+          (line, row_num) = (first_line, inserter.ReserveRows(num_lines))
+          for (num_rows, template) in payloads:
+            uploads.put((line, row_num, num_rows, template))
+            line += num_rows
+            row_num += num_rows
+        first_line += num_lines
+    finally:
+      for thread in threads:
+        uploads.put(None)
+      for thread in threads:
+        thread.join()
+    return sorted(failed)
@@ -0,0 +1,208 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""The spreadsheets client, with the feeds that logtogss needs.
+
+This is kept apart from the command line, as the gdata modules take longer
+to import than everything else put together, and aren't needed for --help or
+to report a usage error.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import urllib
+
+import atom.http_core
+import gdata.client
+import gdata.spreadsheets.client
+import gdata.spreadsheets.data
+
+import instrument
+import rowxml
+
+
+# The error raised for the responses that aren't successful.
+RequestError = gdata.client.RequestError
+
+
+# The next four classes are overrides to add missing functionality in the
+# python-gdata-client.
+
+class MyListEntry(gdata.spreadsheets.data.ListEntry):
+  GSX_NS = gdata.spreadsheets.data.GSX_NAMESPACE
+
+  def ColumnTags(self):
+    """Return the names of all child elements in the GSX namespace."""
+    return [el.tag for el in self.get_elements(namespace=MyListEntry.GSX_NS)]
+
+  def RowValues(self):
+    """Return the values of all child elements in the GSX namespace."""
+    return [el.text for el in self.get_elements(namespace=MyListEntry.GSX_NS)]
+
+  def RowValueToTagMap(self):
+    """
+    Return the values of all child elements keyed by their tags in the GSX namespace.
+    Useful on a header row to map the column names to their tags.
+    """
+    return dict([(el.text, el.tag) for el in self.get_elements(namespace=MyListEntry.GSX_NS)])
+
+class MyListsFeed(gdata.spreadsheets.data.ListsFeed):
+
+  entry = [MyListEntry]
+
+  def ColumnTags(self):
+    if not self.entry:
+      return []
+    return self.entry[0].ColumnTags()
+
+  def ColumnValueToTagMap(self):
+    if not self.entry:
+      return []
+    return self.entry[0].RowValueToTagMap()
+
+class MyCellsFeed(gdata.spreadsheets.data.CellsFeed):
+  """Add the size of the worksheet, which the cells feed also has."""
+
+  row_count = gdata.spreadsheets.data.RowCount
+  col_count = gdata.spreadsheets.data.ColCount
+
+class MySpreadsheetsClient(gdata.spreadsheets.client.SpreadsheetsClient):
+  """Add in support for List feeds."""
+
+  LISTS_URL = 'https://spreadsheets.google.com/feeds/list/%s/%s/private/full'
+  CELLS_URL = 'https://spreadsheets.google.com/feeds/cells/%s/%s/private/full'
+  CELLS_BATCH_URL = CELLS_URL + '/batch'
+
+  # Paces and retries all the requests, when set.
+  scheduler = None
+  # Times the feed reads and inserts, when set.
+  recorder = None
+
+  def request(self, *args, **kwargs):
+    request = super(MySpreadsheetsClient, self).request
+    if self.scheduler is None:
+      return request(*args, **kwargs)
+    return self.scheduler.Call(request, *args, **kwargs)
+
+  Request = request
+
+  @instrument.timed('list feed')
+  def get_list_feed(self, key, wksht_id='default', start_index=None, max_results=None,
+                    updated_min=None, **kwargs):
+    return self._get_feed(self.LISTS_URL, key, wksht_id,
+                          desired_class=MyListsFeed,
+                          start_index=start_index,
+                          max_results=max_results,
+                          updated_min=updated_min,
+                          kwargs=kwargs)
+
+  GetListFeed = get_list_feed
+
+  @instrument.timed('cells feed')
+  def get_cells_feed(self, key, wksht_id='default', start_index=None,
+                     min_col=None, max_col=None, min_row=None, max_row=None,
+                     max_results=None, desired_class=MyCellsFeed, **kwargs):
+    return self._get_feed(self.CELLS_URL, key, wksht_id,
+                          desired_class=desired_class,
+                          start_index=start_index,
+                          min_col=min_col,
+                          max_col=max_col,
+                          min_row=min_row,
+                          max_row=max_row,
+                          max_results=max_results,
+                          kwargs=kwargs)
+
+  GetCellsFeed = get_cells_feed
+
+  def batch_set_cells(self, key, wksht_id, cells, **kwargs):
+    """
+    Set the values of the given (row, col, value) cells with a single request
+    to the cells batch feed. Raises an Exception if any of the updates failed.
+    Returns the (batch id, status code, reason) of each update.
+    """
+    batch = rowxml.cells_batch_feed(self.CELLS_URL % (key, wksht_id), cells)
+    return self.post_cells_batch(batch, key, wksht_id, **kwargs)
+
+  BatchSetCells = batch_set_cells
+
+  @instrument.timed('insert batch')
+  def post_cells_batch(self, xml, key, wksht_id, **kwargs):
+    """Like batch_set_cells, but for a cells batch feed already serialized to XML."""
+    # The cells have no etags, so the updates need to be forced. The response
+    # echoes every cell, which would take longer to parse into gdata objects
+    # than the request takes, so only the statuses are read from it.
+    statuses = self.post_xml(xml, self.CELLS_BATCH_URL % (key, wksht_id), if_match='*',
+                             converter=lambda response: rowxml.batch_statuses(response.read()),
+                             **kwargs)
+    failed = [status for status in statuses if status[1] >= 300]
+    if failed:
+      raise Exception("%d of %d cell updates failed, first error: %s %s" %
+                      (len(failed), len(statuses), failed[0][1], failed[0][2]))
+    return statuses
+
+  PostCellsBatch = post_cells_batch
+
+  def post_xml(self, xml, uri, if_match=None, method='POST', **kwargs):
+    """POST (or PUT) an entry or feed that is already serialized to XML."""
+    http_request = atom.http_core.HttpRequest()
+    http_request.add_body_part(xml, 'application/atom+xml')
+    if if_match:
+      http_request.headers['If-Match'] = if_match
+    return self.request(method=method, uri=uri, http_request=http_request, **kwargs)
+
+  PostXml = post_xml
+
+  @instrument.timed('insert row')
+  def add_list_entry_xml(self, xml, key, wksht_id='default', converter=None, **kwargs):
+    """
+    Add a row from its serialized list entry. The response isn't parsed
+    unless a converter is given, as usually nothing is needed from it.
+    """
+    return self.post_xml(xml, self.LISTS_URL % (key, wksht_id),
+                         converter=converter or (lambda response: response.read()), **kwargs)
+
+  AddListEntryXml = add_list_entry_xml
+
+  @instrument.timed('update row')
+  def update_list_entry_xml(self, xml, edit_url, converter=None, **kwargs):
+    """
+    Replace a row with its serialized list entry, which needs the id. The
+    edit link identifies the version of the row, so the update fails with a
+    409 if the row was changed since.
+    """
+    return self.post_xml(xml, edit_url, method='PUT',
+                         converter=converter or (lambda response: response.read()), **kwargs)
+
+  UpdateListEntryXml = update_list_entry_xml
+
+  def _get_feed(self, baseuri, key, wksht_id='default', desired_class=None, **params):
+    kwargs = params.pop('kwargs')
+
+    uri = baseuri % (key, wksht_id)
+    # Remove the params with None values, so they don't get into the query
+    params = dict([(key.replace('_', '-'), value) for (key, value) in params.items() if value is not None])
+    if params:
+      uri += ('?' + urllib.urlencode(params.items()))
+    if desired_class:
+      kwargs['desired_class'] = desired_class
+    return self.get_feed(uri, **kwargs)
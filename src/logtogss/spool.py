@@ -0,0 +1,125 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""A write-ahead journal of input lines, for loads that can be resumed.
+
+Lines are appended to the spool file (and synced to disk) before they are
+inserted, and the number of lines inserted so far is recorded next to it,
+in a .committed file, after each chunk. Chunks are made of whole records, so
+that the count never falls inside a quoted value that spans lines. If the
+load dies, the lines after the committed ones can be replayed from the spool,
+without having to work out which rows made it to the spreadsheet. A chunk
+that was inserted just before the load died, but not yet recorded, gets
+inserted again.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import itertools
+import os
+
+
+class Spool(object):
+  """An append only journal of lines, and the count of those committed."""
+
+  def __init__(self, spool_file):
+    self.spool_file = spool_file
+    self.committed_file = spool_file + '.committed'
+
+  def ReadCommitted(self):
+    """Return the number of lines committed, 0 if none."""
+    try:
+      with open(self.committed_file) as fh:
+        return int(fh.read().strip() or 0)
+    except IOError, e:
+      return 0
+
+  def WriteCommitted(self, count):
+    """Record that the first count lines are committed."""
+    # Write then rename, so that a crash can't leave a partial count behind.
+    tmp_file = '%s.%d' % (self.committed_file, os.getpid())
+    with open(tmp_file, 'w') as fh:
+      fh.write('%d\n' % count)
+      fh.flush()
+      os.fsync(fh.fileno())
+    os.rename(tmp_file, self.committed_file)
+
+  def CountLines(self):
+    """Return the number of lines in the spool."""
+    try:
+      with open(self.spool_file, 'rb') as fh:
+        return sum(1 for line in fh)
+    except IOError, e:
+      return 0
+
+  def DropPartialLine(self):
+    """
+    Truncate a last line without a line end, as left by an append that a
+    crash cut short. The whole line is still in the input, so it gets
+    journaled again on resume.
+    """
+    try:
+      fh = open(self.spool_file, 'r+b')
+    except IOError, e:
+      return
+    with fh:
+      fh.seek(0, os.SEEK_END)
+      end = size = fh.tell()
+      # Look back for the last line end, a block at a time.
+      while end > 0:
+        start = max(0, end - (1 << 16))
+        fh.seek(start)
+        pos = fh.read(end - start).rfind('\n')
+        if pos >= 0:
+          end = start + pos + 1
+          break
+        end = start
+      if end < size:
+        fh.truncate(end)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+  def ReadLines(self, start=0):
+    """Generate the lines of the spool, skipping the first start lines."""
+    try:
+      fh = open(self.spool_file, 'rb')
+    except IOError, e:
+      return
+    with fh:
+      for line in itertools.islice(fh, start, None):
+        yield line
+
+  def Append(self, lines):
+    """Append the lines to the spool and make sure they are on disk."""
+    with open(self.spool_file, 'ab') as fh:
+      # Terminate the last line of the input too, so that it stays separate
+      # from the lines appended after a resume.
+      fh.writelines(line.endswith('\n') and line or line + '\n' for line in lines)
+      fh.flush()
+      os.fsync(fh.fileno())
+
+  def Remove(self):
+    """Remove the spool, once all of its lines are committed."""
+    for path in (self.spool_file, self.committed_file):
+      if os.path.exists(path):
+        os.unlink(path)
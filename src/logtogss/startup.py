@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Time the startup of a run, for --print-startup-profile.
+
+Only the standard library modules that the interpreter has loaded by itself
+are imported here, as this is imported first to time the rest. The imports
+are timed by wrapping __import__, so only the modules loaded after that are
+accounted for, and their times include those of the modules they import.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import __builtin__
+import atexit
+import os
+import sys
+import time
+
+
+STARTED = time.time()
+
+# (started, depth, name, secs) of each import that loaded a module.
+imports = []
+# (name, at) of the points reached.
+marks = []
+_depth = [0]
+
+
+def TimeImports():
+  """Time the imports from now on, and print the report to stderr at exit."""
+  real_import = __builtin__.__import__
+
+  def timed_import(name, *args, **kwargs):
+    loaded = len(sys.modules)
+    depth = _depth[0]
+    _depth[0] += 1
+    start = time.time()
+    try:
+      return real_import(name, *args, **kwargs)
+    finally:
+      _depth[0] -= 1
+      if len(sys.modules) > loaded:
+        imports.append((start, depth, name, time.time() - start))
+
+  __builtin__.__import__ = timed_import
+  atexit.register(lambda: sys.stderr.write(Report() + '\n'))
+
+def Mark(name):
+  """Note that the run got to the named point."""
+  marks.append((name, time.time()))
+
+def process_started():
+  """Return when the process started, to the clock tick, if it can be told."""
+  try:
+    with open('/proc/self/stat') as fh:
+      # The fields after the command, which is in parentheses, from the 3rd.
+      fields = fh.read().rsplit(')', 1)[1].split()
+    with open('/proc/uptime') as fh:
+      uptime = float(fh.read().split()[0])
+    return time.time() - uptime + int(fields[19]) / float(os.sysconf('SC_CLK_TCK'))
+  except (IOError, OSError, ValueError, IndexError), e:
+    return None
+
+def Report(top=15):
+  """Return the report of the startup so far."""
+  ms = lambda secs: secs * 1000
+  lines = ['Startup profile:']
+  started = process_started()
+  if started is not None:
+    lines.append('  %-32s %8.1fms (+/- 10ms)' % ('python startup', ms(max(STARTED - started, 0))))
+  for (name, at) in marks + [('now', time.time())]:
+    lines.append('  %-32s %8.1fms after logtogss started loading' % (name, ms(at - STARTED)))
+  direct = [(name, secs) for (start, depth, name, secs) in imports if depth == 0]
+  lines.append('Imports by logtogss (%.1fms in all):' % ms(sum(secs for (name, secs) in direct)))
+  for (name, secs) in sorted(direct, key=lambda i: -i[1])[:top]:
+    lines.append('  %-32s %8.1fms' % (name, ms(secs)))
+  # The time of each module less that of the modules it imported.
+  own = []
+  for (i, (start, depth, name, secs)) in enumerate(imports):
+    # Nested imports complete, and are recorded, before the one importing them.
+    j = i - 1
+    while j >= 0 and imports[j][0] >= start:
+      if imports[j][1] == depth + 1:
+        secs -= imports[j][3]
+      j -= 1
+    own.append((name, secs))
+  lines.append('Slowest modules, less their own imports:')
+  for (name, secs) in sorted(own, key=lambda i: -i[1])[:top]:
+    lines.append('  %-32s %8.1fms' % (name, ms(secs)))
+  return '\n'.join(lines)
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Pace the requests to the server, and back off when it pushes back.
+
+Requests are paced with a token bucket. When the server responds that it is
+over quota or unavailable (429 or 503), the request is retried after the
+delay that it asks for in Retry-After, or else after an exponentially growing,
+randomized delay, and the request rate is halved. Every successful request then
+raises the rate a little, back up to the max rate, so that the client settles
+close to the highest rate that the server accepts.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import collections
+import random
+import threading
+import time
+
+import gdata.client
+
+
+# The responses that mean that the server didn't process the request.
+RETRY_STATUSES = (429, 503)
+
+
+def retry_after(error):
+  """Return the delay in seconds asked for by the Retry-After header, or None."""
+  headers = getattr(error, 'headers', None) or []
+  if isinstance(headers, dict):
+    headers = headers.items()
+  for (name, value) in headers:
+    if name.lower() == 'retry-after':
+      try:
+        return max(0, int(value))
+      except ValueError:
+        import email.utils
+        date = email.utils.parsedate_tz(value)
+        if date:
+          return max(0, email.utils.mktime_tz(date) - time.time())
+  return None
+
+
+class RequestScheduler(object):
+  """Pace and retry calls that make a request to the server.
+
+  Methods:
+    Call: Make the call, after waiting for its turn, and retry it if needed.
+    Stats: A summary of the counters.
+
+  Extra properties:
+    requests, retries, throttled: Counters of the calls made, retried and
+      delayed to keep to the rate.
+  """
+
+  def __init__(self, max_rate=None, max_retries=5, base_delay=1.0, max_delay=60.0):
+    """
+    Make up to max_rate requests per second, or as many as the server allows
+    when None, and retry each up to max_retries times.
+    """
+    self.max_rate = max_rate
+    self.rate = max_rate
+    self.max_retries = max_retries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.tokens = 1.0
+    self.last_refill = time.time()
+    # The start times of the recent requests, to estimate the rate that
+    # the server pushed back on, when there is no max rate.
+    self.recent = collections.deque(maxlen=50)
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.retries = 0
+    self.throttled = 0
+    self.throttled_secs = 0.0
+    # An instrument.Recorder for the time spent waiting, if set.
+    self.recorder = None
+
+  def _WaitForTurn(self):
+    while True:
+      with self.lock:
+        now = time.time()
+        if self.rate:
+          # Allow a burst of up to a second's worth of requests.
+          self.tokens = min(max(self.rate, 1.0),
+                            self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if not self.rate or self.tokens >= 1:
+          self.tokens -= self.rate and 1 or 0
+          self.requests += 1
+          self.recent.append(now)
+          return
+        delay = (1 - self.tokens) / self.rate
+        self.throttled += 1
+        self.throttled_secs += delay
+      if self.recorder:
+        self.recorder.Add('throttle wait', delay)
+      time.sleep(delay)
+
+  def _SlowDown(self):
+    with self.lock:
+      rate = self.rate
+      if not rate and len(self.recent) > 1:
+        rate = (len(self.recent) - 1) / max(self.recent[-1] - self.recent[0], 0.001)
+      if not rate:
+        # Too few requests to tell, so just rely on the retry delay.
+        return
+      self.rate = max(rate / 2, 0.1)
+      self.tokens = min(self.tokens, 0)
+
+  def _SpeedUp(self):
+    with self.lock:
+      if not self.rate:
+        return
+      self.rate += max(self.rate / 20, 0.1)
+      if self.max_rate and self.rate >= self.max_rate:
+        self.rate = self.max_rate
+
+  def Call(self, func, *args, **kwargs):
+    attempt = 0
+    while True:
+      self._WaitForTurn()
+      try:
+        result = func(*args, **kwargs)
+      except gdata.client.RequestError, e:
+        if e.status not in RETRY_STATUSES or attempt >= self.max_retries:
+          raise
+        self._SlowDown()
+        delay = retry_after(e)
+        if delay is None:
+          delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self.lock:
+          self.retries += 1
+        if self.recorder:
+          self.recorder.Count('retries')
+          self.recorder.Add('retry wait', delay, status=e.status)
+        time.sleep(delay)
+        attempt += 1
+      else:
+        self._SpeedUp()
+        return result
+
+  def Stats(self):
+    return ('Requests: %d made, %d retried, %d throttled for %.1fs, current rate %s/s' %
+            (self.requests, self.retries, self.throttled, self.throttled_secs,
+             self.rate and '%.2f' % self.rate or 'unlimited'))
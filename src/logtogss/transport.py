@@ -0,0 +1,203 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011, "Hari Dara" <haridara@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+#     Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#       disclaimer.
+#     Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""An HTTP client for the gdata clients that keeps its connections alive.
+
+The stock atom client opens a new connection (and for https, does a new TLS
+handshake) for every request. This one keeps the connections in a pool and
+reuses them for the following requests to the same host.
+"""
+
+
+__author__ = 'Hari Dara <haridara@gmail.com>'
+
+
+import errno
+import httplib
+import socket
+import threading
+import time
+
+import atom.http_core
+
+
+# The methods that can be sent again without changing their effect. Our PUTs
+# are conditional updates, which a repeat would fail with a 409.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# The errors of a write to, or a read from, a socket the server has closed.
+CLOSED_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def never_reached(e):
+  """
+  Does the error of a request, raised before any of the response was read,
+  show that the server closed the connection before it got the request?
+  """
+  if isinstance(e, httplib.BadStatusLine):
+    # Closed with no response at all.
+    return True
+  return isinstance(e, socket.error) and e.errno in CLOSED_ERRNOS
+
+
+class ConnectionPool(object):
+  """A thread safe pool of idle connections, keyed by (scheme, host, port).
+
+  Methods:
+    acquire: Get an idle connection, or None.
+    release: Return a connection for reuse.
+
+  Extra properties:
+    opened, reused, discarded: Counters of connections.
+  """
+
+  def __init__(self, max_idle=4, idle_timeout=60):
+    """
+    Keep up to max_idle connections per host, for up to idle_timeout seconds
+    each, which should be below the time the server keeps them open.
+    """
+    self.max_idle = max_idle
+    self.idle_timeout = idle_timeout
+    self.idle = {}
+    self.lock = threading.Lock()
+    self.opened = 0
+    self.reused = 0
+    self.discarded = 0
+
+  def acquire(self, key):
+    now = time.time()
+    with self.lock:
+      idle = self.idle.get(key, [])
+      while idle:
+        (connection, released_at) = idle.pop()
+        if now - released_at < self.idle_timeout:
+          self.reused += 1
+          return connection
+        self.discarded += 1
+        connection.close()
+      self.opened += 1
+    return None
+
+  def release(self, key, connection):
+    with self.lock:
+      idle = self.idle.setdefault(key, [])
+      if len(idle) < self.max_idle:
+        idle.append((connection, time.time()))
+        return
+      self.discarded += 1
+    connection.close()
+
+  def close(self):
+    with self.lock:
+      for idle in self.idle.values():
+        for (connection, released_at) in idle:
+          connection.close()
+      self.idle = {}
+
+  def stats(self):
+    return ('HTTP connections: %d opened, %d reused, %d discarded' %
+            (self.opened, self.reused, self.discarded))
+
+
+class BufferedResponse(atom.http_core.HttpResponse):
+  """A response that is already read, so its connection can be reused."""
+
+  def __init__(self, response):
+    body = response.read()
+    atom.http_core.HttpResponse.__init__(self, response.status, response.reason,
+                                         dict(response.getheaders()), body)
+    self.size = len(body)
+
+  def getheader(self, name, default=None):
+    # httplib gives the header names in lower case.
+    return atom.http_core.HttpResponse.getheader(self, name.lower(), default)
+
+
+class PooledHttpClient(atom.http_core.ProxiedHttpClient):
+  """An atom HTTP client that reuses its connections from a ConnectionPool."""
+
+  # An instrument.Recorder for the timings and sizes of the requests, if set.
+  recorder = None
+
+  def __init__(self, pool_size=4, idle_timeout=60, endpoint=None):
+    """
+    With an endpoint (scheme://host:port), all the requests are sent there
+    instead, e.g. to a local fake of the server.
+    """
+    self.pool = ConnectionPool(pool_size, idle_timeout)
+    self.endpoint = endpoint and atom.http_core.Uri.parse_uri(endpoint)
+    # The connection used by the current request, per thread.
+    self.current = threading.local()
+
+  def _get_connection(self, uri, headers=None):
+    key = (uri.scheme, uri.host, uri.port)
+    connection = self.pool.acquire(key)
+    self.current.key = key
+    self.current.reused = connection is not None
+    if connection is None:
+      connection = atom.http_core.ProxiedHttpClient._get_connection(self, uri, headers)
+      if connection.sock is None:
+        connection.connect()
+      # The body is sent after the headers, and with Nagle's algorithm it would
+      # wait for them to be acked, which the server may delay by up to 40ms.
+      connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.current.connection = connection
+    return connection
+
+  def _http_request(self, method, uri, headers=None, body_parts=None):
+    if self.endpoint:
+      uri = atom.http_core.Uri(self.endpoint.scheme, self.endpoint.host, self.endpoint.port,
+                               uri.path, uri.query)
+    if self.recorder is None:
+      return self._pooled_request(method, uri, headers, body_parts)
+    sent = sum(len(part) for part in body_parts or () if isinstance(part, basestring))
+    with self.recorder.Phase('request', method=method, path=uri.path) as phase:
+      response = self._pooled_request(method, uri, headers, body_parts)
+      phase.fields.update(status=response.status, sent=sent, received=response.size)
+    self.recorder.Count('requests')
+    self.recorder.Count('bytes sent', sent)
+    self.recorder.Count('bytes received', response.size)
+    return response
+
+  def _pooled_request(self, method, uri, headers=None, body_parts=None):
+    while True:
+      self.current.connection = None
+      response = None
+      try:
+        response = atom.http_core.ProxiedHttpClient._http_request(
+            self, method, uri, headers, body_parts)
+        buffered = BufferedResponse(response)
+      except (httplib.HTTPException, socket.error), e:
+        if self.current.connection:
+          self.current.connection.close()
+        # The server may have closed an idle connection just as we reused it,
+        # in which case the request never got to it, so try a fresh one. Any
+        # other failure may come after the server acted on the request, which
+        # is only safe to send again if doing so has the same effect.
+        if (self.current.connection and self.current.reused and
+            (method in IDEMPOTENT_METHODS or (response is None and never_reached(e)))):
+          continue
+        raise
+      if response.will_close:
+        self.current.connection.close()
+      else:
+        self.pool.release(self.current.key, self.current.connection)
+      return buffered